@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for every remote service the widgets talk to
+Replays recorded responses from bench/fixtures with configurable latency,
+errors and 429s, and counts requests and bytes per route
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# URL path -> (fixture file, content type)
+ROUTES = {
+    '/t212/equity/account/cash': ('t212_cash.json', 'application/json'),
+    '/t212/equity/portfolio': ('t212_portfolio.json', 'application/json'),
+    '/t212/equity/account/info': ('t212_info.json', 'application/json'),
+    '/t212/equity/orders': ('t212_orders.json', 'application/json'),
+    '/t212/equity/history/orders': ('t212_history_orders.json', 'application/json'),
+    '/t212/history/dividends': ('t212_history_dividends.json', 'application/json'),
+    '/t212/history/transactions': ('t212_history_transactions.json', 'application/json'),
+    '/feeds/bbc.xml': ('bbc.xml', 'application/rss+xml'),
+    '/feeds/guardian.xml': ('guardian.xml', 'application/rss+xml'),
+    '/feeds/sky.xml': ('sky.xml', 'application/rss+xml'),
+    '/feeds/hackernews.xml': ('hackernews.xml', 'application/rss+xml'),
+    '/feeds/techcrunch.xml': ('techcrunch.xml', 'application/rss+xml'),
+    '/feeds/malformed.xml': ('malformed.xml', 'application/rss+xml'),
+    '/sun/json': ('sunrise_sunset.json', 'application/json'),
+    '/fx/v4/latest/GBP': ('exchangerate_gbp.json', 'application/json'),
+    '/weather/London': ('wttr_london.txt', 'text/plain; charset=utf-8'),
+}
+
+# History routes: the fixture's items (newest first) are served a page at a
+# time, with nextPagePath cursors that stay valid when newer items arrive
+PAGED_ROUTES = ('/t212/equity/history/orders', '/t212/history/dividends', '/t212/history/transactions')
+DEFAULT_PAGE_SIZE = 20
+
+# Bytes written per step when a route's body is dripped out slowly
+DRIP_CHUNK_SIZE = 1024
+
+
+class FaultProfile:
+    """Latency and failure injection applied to every request"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=5, slow_routes=None, drip_routes=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        # route prefix -> extra latency in ms, e.g. {'/feeds/guardian': 3000}
+        self.slow_routes = slow_routes or {}
+        # route prefix -> pause in ms between DRIP_CHUNK_SIZE pieces of the
+        # body, for a server that answers at once but sends slowly
+        self.drip_routes = drip_routes or {}
+
+    def delay_for(self, path):
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        for prefix, extra in self.slow_routes.items():
+            if path.startswith(prefix):
+                delay += extra
+        return delay / 1000.0
+
+    def drip_for(self, path):
+        for prefix, pause in self.drip_routes.items():
+            if path.startswith(prefix):
+                return pause / 1000.0
+        return 0.0
+
+
+class RequestStats:
+    """Thread-safe request and byte counters per route"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+    def record(self, path, status, sent_bytes):
+        with self.lock:
+            route = self.routes.setdefault(path, {'requests': 0, 'bytes': 0, 'statuses': {}})
+            route['requests'] += 1
+            route['bytes'] += sent_bytes
+            route['statuses'][str(status)] = route['statuses'].get(str(status), 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            routes = json.loads(json.dumps(self.routes))
+        return {
+            'requests': sum(route['requests'] for route in routes.values()),
+            'bytes': sum(route['bytes'] for route in routes.values()),
+            'routes': routes,
+        }
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def _send(self, status, body, content_type='text/plain', extra_headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            pause = self.server.faults.drip_for(self.path)
+            if pause and status == 200:
+                for start in range(0, len(body), DRIP_CHUNK_SIZE):
+                    self.wfile.write(body[start:start + DRIP_CHUNK_SIZE])
+                    self.wfile.flush()
+                    time.sleep(pause)
+            else:
+                self.wfile.write(body)
+        self.server.stats.record(self.path.split('?')[0], status, len(body))
+
+    def _page(self, path, body):
+        """One page of a history fixture for ?limit=N&cursor=C
+
+        The cursor counts the items older than the previous page, so it still
+        points at the same place after newer items are added to the fixture.
+        """
+        query = dict(parse_qsl(urlsplit(self.path).query))
+        items = json.loads(body)['items']
+        limit = int(query.get('limit', DEFAULT_PAGE_SIZE))
+        start = len(items) - int(query.get('cursor', len(items)))
+        page = items[start:start + limit]
+        older = len(items) - start - len(page)
+        next_path = f"{path}?limit={limit}&cursor={older}" if older > 0 else None
+        return json.dumps({'items': page, 'nextPagePath': next_path}).encode('utf-8')
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+
+        if path == '/__stats':
+            body = json.dumps(self.server.stats.snapshot()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if path == '/__reset':
+            self.server.stats.reset()
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        faults = self.server.faults
+        time.sleep(faults.delay_for(path))
+
+        if path not in ROUTES:
+            self._send(404, b'not found')
+            return
+        if random.random() < faults.throttle_rate:
+            self._send(429, b'{"code":"TooManyRequests"}', 'application/json', {
+                'Retry-After': str(faults.retry_after),
+                'x-ratelimit-remaining': '0',
+                'x-ratelimit-reset': str(int(time.time()) + faults.retry_after),
+            })
+            return
+        if random.random() < faults.error_rate:
+            self._send(503, b'service unavailable')
+            return
+
+        filename, content_type = ROUTES[path]
+        body = self.server.fixture(filename)
+        headers = {
+            'Last-Modified': self.server.last_modified,
+            'x-ratelimit-limit': '1',
+            'x-ratelimit-period': '5',
+            'x-ratelimit-remaining': '0',
+            'x-ratelimit-reset': str(int(time.time()) + 5),
+        }
+        if path in PAGED_ROUTES:
+            body = self._page(path, body)
+            headers.update({'x-ratelimit-limit': '6', 'x-ratelimit-period': '60', 'x-ratelimit-remaining': '5'})
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        headers['ETag'] = etag
+
+        if self.headers.get('If-None-Match') == etag or \
+                self.headers.get('If-Modified-Since') == self.server.last_modified:
+            self._send(304, b'', content_type, headers)
+            return
+
+        self._send(200, body, content_type, headers)
+
+
+class FakeServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, faults=None):
+        super().__init__(address, FakeServiceHandler)
+        self.faults = faults or FaultProfile()
+        self.stats = RequestStats()
+        self.last_modified = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+        self._fixtures = {}
+
+    def fixture(self, filename):
+        if filename not in self._fixtures:
+            with open(os.path.join(FIXTURES_DIR, filename), 'rb') as f:
+                self._fixtures[filename] = f.read()
+        return self._fixtures[filename]
+
+    def set_fixture(self, filename, body):
+        """Serve body in place of a fixture file (e.g. to add new history items)"""
+        self._fixtures[filename] = body
+
+    def handle_error(self, request, client_address):
+        # Widgets time out and drop connections on purpose; only report real errors
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(faults=None, port=0):
+    """Start a server on a background thread and return it"""
+    server = FakeServiceServer(('127.0.0.1', port), faults)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0)
+    args = parser.parse_args()
+
+    faults = FaultProfile(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate)
+    server = FakeServiceServer(('127.0.0.1', args.port), faults)
+    print(f"Serving fixtures on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the widget entry points
+Warms each command's caches against bench/fake_server.py, then runs it under
+`python -X importtime` and adds up the modules it imports beyond what an
+empty interpreter already loads. Fails if a cached command imports a
+network or parsing library, or goes over its budget.
+
+Usage: python3 bench/import_budget.py [--runs 5] [--scale 1.0] [--python PATH]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_server import FaultProfile, start_server  # noqa: E402
+from run_benchmarks import build_workdir  # noqa: E402
+
+# (script, argv, budget in ms of imports) - every command is measured with warm caches
+ENTRY_POINTS = [
+    ('sun_moon.py', ['moon'], 15),
+    ('sun_moon.py', ['sunrise'], 20),
+    ('news_simple.py', ['single', '0'], 15),
+    ('news_simple.py', ['rotate', '0'], 15),
+    ('trading212_api.py', ['total_value'], 15),
+    ('market_weather.py', ['rates'], 15),
+    ('panel.py', ['render', 'market'], 25),
+]
+
+# Only the fetch paths may import these
+FORBIDDEN = ('requests', 'urllib3', 'feedparser', 'numpy', 'sqlite3', 'subprocess',
+             'xml.etree.ElementTree', 'concurrent.futures')
+
+
+def parse_importtime(stderr):
+    """[(module, cumulative microseconds, is top level)] from -X importtime output"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        top_level = not name[1:].startswith(' ')
+        modules.append((name.strip(), int(cumulative), top_level))
+    return modules
+
+
+def startup_modules(python):
+    """Modules an empty interpreter imports (site, encodings, .pth hooks)"""
+    result = subprocess.run([python, '-X', 'importtime', '-c', 'pass'], capture_output=True, text=True)
+    return {name for name, _, _ in parse_importtime(result.stderr)}
+
+
+def measure(python, workdir, script, argv, baseline):
+    """(import ms, imported module names, slowest top-level imports) for one run"""
+    result = subprocess.run([python, '-X', 'importtime', script] + argv, cwd=workdir,
+                            capture_output=True, text=True)
+    modules = [entry for entry in parse_importtime(result.stderr) if entry[0] not in baseline]
+    top = [(cumulative, name) for name, cumulative, top_level in modules if top_level]
+    total_ms = sum(cumulative for cumulative, _ in top) / 1000
+    return total_ms, {name for name, _, _ in modules}, sorted(top, reverse=True)[:3]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import-time budget of each entry point")
+    parser.add_argument('--runs', type=int, default=5, help="measured runs per command")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply every budget (slow machines)")
+    parser.add_argument('--python', default=sys.executable, help="interpreter to measure")
+    args = parser.parse_args()
+
+    server = start_server(FaultProfile())
+    workdir = build_workdir(server.base_url)
+    failures = []
+    try:
+        baseline = startup_modules(args.python)
+        # Measure with bytecode cached, as after a normal run (even under PYTHONDONTWRITEBYTECODE)
+        subprocess.run([args.python, '-m', 'compileall', '-q', workdir], check=True)
+
+        # Fill every cache, then let any background refresh finish
+        for script, argv, _ in ENTRY_POINTS:
+            subprocess.run([args.python, script] + argv, cwd=workdir, capture_output=True)
+        time.sleep(2)
+
+        for script, argv, budget in ENTRY_POINTS:
+            budget *= args.scale
+            runs = [measure(args.python, workdir, script, argv, baseline) for _ in range(args.runs)]
+            median_ms = statistics.median(run[0] for run in runs)
+            forbidden = sorted(set().union(*(run[1] for run in runs)).intersection(FORBIDDEN))
+            slowest = ", ".join(f"{name} {cumulative / 1000:.1f}" for cumulative, name in runs[0][2])
+
+            command = f"{script} {' '.join(argv)}"
+            ok = median_ms <= budget and not forbidden
+            print(f"{'ok  ' if ok else 'FAIL'} {command:26} {median_ms:6.1f} ms / {budget:5.1f} ms  [{slowest}]")
+            if forbidden:
+                print(f"     imports {', '.join(forbidden)} on the cached path")
+            if not ok:
+                failures.append(command)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print(f"{len(failures)} entry point(s) over budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmarks for the Conky widget scripts
+Runs every CLI entry point against bench/fake_server.py and reports cold-start
+time, per-command wall time, request count and bytes as JSON
+
+Usage: python3 bench/run_benchmarks.py [--runs 5] [--latency-ms 80] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_server import FaultProfile, start_server  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# script -> (module name, list of argv to benchmark)
+COMMANDS = {
+    'sun_moon.py': ('sun_moon', [
+        ['sunrise'], ['sunset'], ['day_length'], ['all'], ['twilight'], ['moon'],
+        ['moon_illumination'], ['next_full'], ['check'], ['table', '--days', '7'],
+    ]),
+    'news_simple.py': ('news_simple', [
+        ['list'], ['single', '0'], ['single', '1'], ['single', '2'], ['single', '3'], ['rotate', '0'],
+        ['count'], ['search', 'security'],
+    ]),
+    'trading212_api.py': ('trading212_api', [
+        ['total_value'], ['total_ppl'], ['free_cash'], ['positions_count'], ['pending_orders'],
+        ['top_position'], ['top_positions', '5'], ['allocation'], ['movers'], ['sparkline'],
+        ['change_1d'], ['status'], ['snapshot'], ['dividends_month'], ['realised_ytd'], ['last_fill'],
+    ]),
+    'market_weather.py': ('market_weather', [
+        ['weather'], ['currency'], ['currency', 'EUR'], ['rates'],
+    ]),
+    'panel.py': ('panel', [
+        ['render', 'trading212'], ['render', 'market'], ['render', 'news'],
+    ]),
+}
+
+
+def build_workdir(base_url):
+    """Copy the scripts into a scratch directory with configs pointing at the fake server"""
+    workdir = tempfile.mkdtemp(prefix='conky-bench-')
+    for name in os.listdir(REPO_DIR):
+        if name.endswith('.py') or name.endswith('.json') and name != 'config.json':
+            shutil.copy(os.path.join(REPO_DIR, name), workdir)
+    shutil.copytree(os.path.join(REPO_DIR, 'templates'), os.path.join(workdir, 'templates'))
+
+    with open(os.path.join(REPO_DIR, 'config.json'), 'r') as f:
+        config = json.load(f)
+    config['news']['sources'] = {
+        source: f"{base_url}/feeds/{source}.xml" for source in config['news']['sources']
+    }
+    config['sun_moon']['api_url'] = f"{base_url}/sun/json"
+    config['currency']['api_url'] = f"{base_url}/fx/v4/latest/GBP"
+    config['weather']['api_url'] = f"{base_url}/weather"
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+
+    with open(os.path.join(workdir, 'trading212_config.json'), 'w') as f:
+        json.dump({
+            'api_key': 'bench-key',
+            'api_secret': 'bench-secret',
+            'base_url': f"{base_url}/t212",
+            'cache_duration': 60,
+        }, f, indent=2)
+    return workdir
+
+
+def clear_state(workdir):
+    """Remove every cache/state dotfile so the next run starts cold"""
+    for name in os.listdir(workdir):
+        path = os.path.join(workdir, name)
+        if name.startswith('.') and os.path.isfile(path):
+            os.remove(path)
+        elif name in ('.cache', '.widget_cache', '__pycache__'):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def timed_run(python, argv, cwd):
+    """Run a command, returning (wall seconds, stdout)"""
+    start = time.perf_counter()
+    result = subprocess.run([python] + argv, cwd=cwd, capture_output=True, text=True)
+    return time.perf_counter() - start, result.stdout.strip()
+
+
+def server_stats(server):
+    stats = server.stats.snapshot()
+    server.stats.reset()
+    return stats
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def benchmark_command(python, workdir, server, script, argv, runs, fresh):
+    """Cold run plus `runs` warm runs of one command"""
+    clear_state(workdir)
+    server.stats.reset()
+    cold_seconds, output = timed_run(python, [script] + argv, workdir)
+    cold_stats = server_stats(server)
+
+    warm_times = []
+    warm_requests = 0
+    warm_bytes = 0
+    for _ in range(runs):
+        if fresh:
+            clear_state(workdir)
+        seconds, output = timed_run(python, [script] + argv, workdir)
+        warm_times.append(seconds)
+        stats = server_stats(server)
+        warm_requests += stats['requests']
+        warm_bytes += stats['bytes']
+
+    return {
+        'script': script,
+        'command': ' '.join(argv),
+        'output': output,
+        'cold_ms': round(cold_seconds * 1000, 2),
+        'cold_requests': cold_stats['requests'],
+        'cold_bytes': cold_stats['bytes'],
+        'warm_ms_median': round(statistics.median(warm_times) * 1000, 2),
+        'warm_ms_p95': round(percentile(warm_times, 95) * 1000, 2),
+        'warm_ms_min': round(min(warm_times) * 1000, 2),
+        'warm_requests_per_run': round(warm_requests / runs, 2),
+        'warm_bytes_per_run': round(warm_bytes / runs, 1),
+    }
+
+
+def interpreter_baseline(python, runs):
+    """Median wall time of an empty interpreter start"""
+    times = [timed_run(python, ['-c', 'pass'], REPO_DIR)[0] for _ in range(runs)]
+    return statistics.median(times)
+
+
+def import_times(python, workdir, runs):
+    """Median wall time to start the interpreter and import each script's module"""
+    results = {}
+    for script, (module, _) in COMMANDS.items():
+        times = [timed_run(python, ['-c', f'import {module}'], workdir)[0] for _ in range(runs)]
+        results[script] = round(statistics.median(times) * 1000, 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Conky widget scripts")
+    parser.add_argument('--runs', type=int, default=5, help="warm runs per command")
+    parser.add_argument('--latency-ms', type=float, default=50, help="fake server latency")
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0, help="fraction of 503 responses")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="fraction of 429 responses")
+    parser.add_argument('--slow-route', action='append', default=[], metavar='PREFIX=MS',
+                        help="extra latency for a route prefix, e.g. /feeds/guardian=3000")
+    parser.add_argument('--drip-route', action='append', default=[], metavar='PREFIX=MS',
+                        help="send a route's body 1 KB at a time, pausing MS between pieces")
+    parser.add_argument('--fresh', action='store_true', help="clear caches before every run")
+    parser.add_argument('--only', choices=sorted(COMMANDS), help="benchmark one script")
+    parser.add_argument('--python', default=sys.executable, help="interpreter to benchmark")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    slow_routes = {}
+    for item in args.slow_route:
+        prefix, _, ms = item.partition('=')
+        slow_routes[prefix] = float(ms)
+    drip_routes = {}
+    for item in args.drip_route:
+        prefix, _, ms = item.partition('=')
+        drip_routes[prefix] = float(ms)
+
+    faults = FaultProfile(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate,
+                          slow_routes=slow_routes, drip_routes=drip_routes)
+    server = start_server(faults)
+    workdir = build_workdir(server.base_url)
+
+    try:
+        results = []
+        for script, (_, commands) in COMMANDS.items():
+            if args.only and script != args.only:
+                continue
+            for argv in commands:
+                result = benchmark_command(args.python, workdir, server, script, argv,
+                                           args.runs, args.fresh)
+                results.append(result)
+                print(f"{script:18} {result['command']:18} cold {result['cold_ms']:8.1f} ms  "
+                      f"warm {result['warm_ms_median']:8.1f} ms  "
+                      f"{result['warm_requests_per_run']:5.1f} req  "
+                      f"{result['warm_bytes_per_run']:9.0f} B", file=sys.stderr)
+
+        report = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'python': args.python,
+                'python_version': sys.version.split()[0],
+                'runs': args.runs,
+                'fresh': args.fresh,
+                'faults': {
+                    'latency_ms': args.latency_ms,
+                    'jitter_ms': args.jitter_ms,
+                    'error_rate': args.error_rate,
+                    'throttle_rate': args.throttle_rate,
+                    'slow_routes': slow_routes,
+                    'drip_routes': drip_routes,
+                },
+            },
+            'interpreter_startup_ms': round(interpreter_baseline(args.python, args.runs) * 1000, 2),
+            'import_ms': import_times(args.python, workdir, args.runs),
+            'results': results,
+        }
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Merged headline pool for news_simple.py
+Titles from every source are interleaved, near-duplicates (the same story
+from BBC and Sky) are dropped by a normalized hash, and keyword filters and
+ranking run against a small inverted index. The pool is stored whole in the
+widget cache, so showing a headline is one lookup by position.
+"""
+
+import re
+
+WORD = re.compile(r"[a-z0-9]+")
+
+# Ignored when comparing titles for duplicates
+STOPWORDS = frozenset((
+    'a', 'an', 'the', 'and', 'or', 'but', 'of', 'to', 'in', 'on', 'at', 'for', 'as', 'by',
+    'with', 'from', 'into', 'after', 'over', 'is', 'are', 'was', 'were', 'be', 'has', 'have',
+    'says', 'say', 'live', 'news',
+))
+
+
+def tokens(text):
+    """Lowercase words of text; apostrophes are dropped so "PM's" matches "pms" """
+    return WORD.findall(text.lower().replace("'", '').replace('’', ''))
+
+
+def dedup_key(title):
+    """Hash of a title's significant words, ignoring case, order and punctuation"""
+    import hashlib
+    words = sorted(set(tokens(title)) - STOPWORDS)
+    return hashlib.sha1(' '.join(words).encode('utf-8')).hexdigest()[:16]
+
+
+def build_index(headlines):
+    """word -> positions of the headlines whose title contains it"""
+    index = {}
+    for position, headline in enumerate(headlines):
+        for word in set(tokens(headline['title'])):
+            index.setdefault(word, []).append(position)
+    return index
+
+
+def matches(index, phrase):
+    """Positions of headlines containing every word of phrase"""
+    words = tokens(phrase)
+    if not words:
+        return set()
+    found = set(index.get(words[0], ()))
+    for word in words[1:]:
+        found.intersection_update(index.get(word, ()))
+    return found
+
+
+def build_pool(feeds, include=(), exclude=(), rank=None):
+    """{'headlines': [...], 'index': {...}} from [(source, titles)] in source order
+
+    Sources are interleaved round-robin (first title of each, then the
+    second, ...) and the first copy of a duplicate is kept. With include
+    keywords, only headlines matching one of them stay; exclude keywords
+    drop matches. rank maps keywords to weights: headlines are ordered by
+    their summed weight, ties keeping the interleaved order.
+    """
+    headlines = []
+    seen = set()
+    depth = max((len(titles) for _, titles in feeds), default=0)
+    for position in range(depth):
+        for source, titles in feeds:
+            if position >= len(titles) or not titles[position]:
+                continue
+            key = dedup_key(titles[position])
+            if key in seen:
+                continue
+            seen.add(key)
+            headlines.append({'source': source.upper(), 'title': titles[position]})
+
+    index = build_index(headlines)
+    keep = set(range(len(headlines)))
+    if include:
+        keep.intersection_update(set().union(*(matches(index, keyword) for keyword in include)))
+    for keyword in exclude:
+        keep.difference_update(matches(index, keyword))
+
+    scores = [0] * len(headlines)
+    for keyword, weight in (rank or {}).items():
+        for position in matches(index, keyword):
+            scores[position] += weight
+
+    ranked = [headlines[position] for position in sorted(keep, key=lambda p: (-scores[p], p))]
+    return {'headlines': ranked, 'index': build_index(ranked)}
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Local SQLite copy of the Trading212 history endpoints
+Orders, dividends and transactions are synced incrementally (only records
+newer than what is stored, plus any unfinished backfill) and answered from
+indexed queries
+"""
+
+import json
+import sqlite3
+import time
+from datetime import datetime
+
+# endpoint -> table; every table has a unique key and an indexed time column
+HISTORY_ENDPOINTS = {
+    '/equity/history/orders': 'orders',
+    '/history/dividends': 'dividends',
+    '/history/transactions': 'transactions',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    ticker TEXT,
+    status TEXT,
+    executed_at REAL,
+    filled_quantity REAL,
+    fill_price REAL,
+    filled_value REAL,
+    fill_result REAL,
+    raw TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_executed_at ON orders (executed_at);
+
+CREATE TABLE IF NOT EXISTS dividends (
+    reference TEXT PRIMARY KEY,
+    ticker TEXT,
+    paid_at REAL,
+    amount REAL,
+    raw TEXT
+);
+CREATE INDEX IF NOT EXISTS dividends_paid_at ON dividends (paid_at);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    reference TEXT PRIMARY KEY,
+    type TEXT,
+    at REAL,
+    amount REAL,
+    raw TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_at ON transactions (at);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    endpoint TEXT PRIMARY KEY,
+    pending TEXT,
+    synced_at REAL
+);
+"""
+
+
+def parse_time(text):
+    """Unix time from the API's ISO 8601 timestamps, or None"""
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _row(table, item):
+    """Column values for one API item"""
+    raw = json.dumps(item, separators=(',', ':'))
+    if table == 'orders':
+        return (item.get('id'), item.get('ticker'), item.get('status'),
+                parse_time(item.get('dateExecuted') or item.get('dateModified')),
+                item.get('filledQuantity'), item.get('fillPrice'), item.get('filledValue'),
+                item.get('fillResult'), raw)
+    if table == 'dividends':
+        return (item.get('reference'), item.get('ticker'), parse_time(item.get('paidOn')),
+                item.get('amount'), raw)
+    return (item.get('reference'), item.get('type'), parse_time(item.get('dateTime')),
+            item.get('amount'), raw)
+
+
+class HistoryStore:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=10)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def insert(self, table, items):
+        """Insert new items; returns how many were not already stored"""
+        placeholders = ','.join('?' * (9 if table == 'orders' else 5))
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(f"INSERT OR IGNORE INTO {table} VALUES ({placeholders})",
+                                  [_row(table, item) for item in items])
+        return self.conn.total_changes - before
+
+    def get_state(self, endpoint):
+        """(pending cursors, last sync time) for an endpoint
+
+        Pending cursors are nextPagePath values still to be followed: the
+        initial backfill, or a gap left when more new records arrived than
+        one sync could page through.
+        """
+        row = self.conn.execute("SELECT pending, synced_at FROM sync_state WHERE endpoint = ?",
+                                (endpoint,)).fetchone()
+        if not row:
+            return [], None
+        return json.loads(row[0] or '[]'), row[1]
+
+    def set_state(self, endpoint, pending, synced_at):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                              (endpoint, json.dumps(pending), synced_at))
+
+    def last_synced(self):
+        """Oldest per-endpoint sync time (0 if any endpoint was never synced)"""
+        rows = self.conn.execute("SELECT endpoint, synced_at FROM sync_state").fetchall()
+        synced = {endpoint: synced_at or 0 for endpoint, synced_at in rows}
+        return min(synced.get(endpoint, 0) for endpoint in HISTORY_ENDPOINTS)
+
+    def dividends_since(self, since):
+        return self.conn.execute("SELECT COALESCE(SUM(amount), 0) FROM dividends WHERE paid_at >= ?",
+                                 (since,)).fetchone()[0]
+
+    def realised_since(self, since):
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(fill_result), 0) FROM orders WHERE executed_at >= ? AND status = 'FILLED'",
+            (since,)).fetchone()[0]
+
+    def last_fill(self):
+        """(ticker, filled quantity, fill price, executed at) of the newest filled order"""
+        return self.conn.execute(
+            "SELECT ticker, filled_quantity, fill_price, executed_at FROM orders "
+            "WHERE status = 'FILLED' AND executed_at IS NOT NULL ORDER BY executed_at DESC LIMIT 1").fetchone()
+
+
+def month_start(now=None):
+    moment = datetime.fromtimestamp(now or time.time())
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+def year_start(now=None):
+    moment = datetime.fromtimestamp(now or time.time())
+    return moment.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0).timestamp()
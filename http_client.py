@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP client for the Conky widget scripts
+One keep-alive requests.Session per process with per-host connection pools,
+the configured User-Agent, compressed transfer and default timeouts.
+
+Every request goes through a per-host circuit breaker shared by all
+processes via .http_circuits.json: after repeated connection errors,
+timeouts or 5xx answers the host fails fast for a cool-off window, then
+one half-open probe decides whether to close it again. A failed URL is
+also negatively cached for a short while.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import widget_config
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CIRCUIT_FILE = os.path.join(BASE_DIR, '.http_circuits.json')
+
+# Host pools kept open, and connections per host (the Trading212 refresh
+# and the news fetch both run several requests at once)
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class CircuitOpenError(OSError):
+    """Raised instead of sending a request to a failing host or URL"""
+
+
+def __getattr__(name):
+    """http_client.RequestException without importing requests up front
+
+    Callers name it in except clauses, which are only evaluated once an
+    exception is raised, and by then requests has been imported.
+    """
+    if name == 'RequestException':
+        import requests
+        return requests.exceptions.RequestException
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _build_settings(general):
+    http = general.get('http', {})
+    return {
+        'user_agent': general.get('user_agent', 'conky-widgets'),
+        'timeout': (http.get('connect_timeout', 3.05), http.get('read_timeout', 10)),
+        'circuit_failures': http.get('circuit_failures', 3),
+        'circuit_cooloff': http.get('circuit_cooloff_seconds', 60),
+        'circuit_max_cooloff': http.get('circuit_max_cooloff_seconds', 600),
+        'negative_ttl': http.get('negative_cache_seconds', 30),
+    }
+
+
+def _load_settings():
+    """User-Agent, timeouts and circuit settings from config.json's general section"""
+    return widget_config.settings(_build_settings)
+
+
+def _accept_encoding():
+    """gzip/deflate always; br only when a brotli decoder is installed"""
+    encodings = ['gzip', 'deflate']
+    for module in ('brotli', 'brotlicffi'):
+        try:
+            __import__(module)
+            encodings.append('br')
+            break
+        except ImportError:
+            continue
+    return ', '.join(encodings)
+
+
+def get_session():
+    """The process-wide session (created on first use)"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({
+                    'User-Agent': _load_settings()['user_agent'],
+                    'Accept-Encoding': _accept_encoding(),
+                })
+                _session = session
+    # Follows config.json edits in the daemon
+    _session.headers['User-Agent'] = _load_settings()['user_agent']
+    return _session
+
+
+def default_timeout():
+    """(connect, read) timeout in seconds"""
+    return _load_settings()['timeout']
+
+
+def _load_circuits():
+    try:
+        with open(CIRCUIT_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _update_circuits(update):
+    """Apply update(state) to the shared circuit file under an exclusive lock"""
+    try:
+        with open(CIRCUIT_FILE + '.lock', 'w') as lock_fd:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            state = _load_circuits()
+            state.setdefault('hosts', {})
+            state.setdefault('urls', {})
+            result = update(state)
+
+            now = time.time()
+            state['urls'] = {url: until for url, until in state['urls'].items() if until > now}
+            # Unique per call: daemon threads share a pid
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(CIRCUIT_FILE),
+                                            prefix=os.path.basename(CIRCUIT_FILE) + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp_file, CIRCUIT_FILE)
+            except OSError:
+                os.unlink(tmp_file)
+                raise
+            return result
+    except OSError:
+        return True  # Never block requests because the state file is unwritable
+
+
+def is_blocked(url):
+    """Whether a request to url would fail fast right now (no probe is claimed)"""
+    state = _load_circuits()
+    now = time.time()
+    if state.get('urls', {}).get(url, 0) > now:
+        return True
+    circuit = state.get('hosts', {}).get(urlsplit(url).netloc)
+    return bool(circuit) and circuit.get('failures', 0) >= _load_settings()['circuit_failures'] \
+        and circuit.get('open_until', 0) > now
+
+
+def _before_request(host, url, probe_window):
+    """Raise CircuitOpenError if the host's circuit is open or the URL just failed"""
+    state = _load_circuits()
+    now = time.time()
+    if state.get('urls', {}).get(url, 0) > now:
+        raise CircuitOpenError(f"{url} failed recently")
+
+    circuit = state.get('hosts', {}).get(host)
+    if not circuit or circuit.get('failures', 0) < _load_settings()['circuit_failures']:
+        return
+    if circuit.get('open_until', 0) > now:
+        raise CircuitOpenError(f"circuit open for {host}")
+
+    def claim_probe(state):
+        # Half-open: exactly one process gets to try the host
+        circuit = state['hosts'].get(host, {})
+        if circuit.get('probe_until', 0) > time.time():
+            return False
+        circuit['probe_until'] = time.time() + probe_window
+        state['hosts'][host] = circuit
+        return True
+
+    if not _update_circuits(claim_probe):
+        raise CircuitOpenError(f"circuit half-open for {host}, probe in flight")
+
+
+def _record_result(host, url, failed):
+    settings = _load_settings()
+    if not failed:
+        if host in _load_circuits().get('hosts', {}):
+            def close(state):
+                state['hosts'].pop(host, None)
+                state['urls'].pop(url, None)
+            _update_circuits(close)
+        return
+
+    def trip(state):
+        now = time.time()
+        circuit = state['hosts'].setdefault(host, {'failures': 0})
+        if 'open_until' not in circuit and now - circuit.get('last_failure', now) > settings['circuit_max_cooloff']:
+            # Old failures don't count towards a new outage; a circuit that
+            # has opened keeps its count until a probe succeeds
+            circuit['failures'] = 0
+        circuit['failures'] = circuit.get('failures', 0) + 1
+        circuit['last_failure'] = now
+        circuit.pop('probe_until', None)
+        if circuit['failures'] >= settings['circuit_failures'] and circuit.get('open_until', 0) <= now:
+            # Open (or re-open after a failed probe, doubling the cool-off);
+            # failures of requests already in flight don't extend it
+            previous = circuit.get('cooloff')
+            cooloff = settings['circuit_cooloff'] if previous is None else previous * 2
+            circuit['cooloff'] = min(cooloff, settings['circuit_max_cooloff'])
+            circuit['open_until'] = now + circuit['cooloff']
+        state['urls'][url] = now + settings['negative_ttl']
+    _update_circuits(trip)
+
+
+def record_stream_error(url, error):
+    """Count an error raised while reading a streamed body against url's circuit
+
+    request() returns a stream=True response once the headers arrive, so a
+    body that times out or breaks off later is only seen by the caller.
+    """
+    import requests
+    if isinstance(error, (TimeoutError, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          requests.exceptions.ChunkedEncodingError)):
+        _record_result(urlsplit(url).netloc, url, failed=True)
+
+
+def request(method, url, **kwargs):
+    """Send a request through the shared session, guarded by the host's circuit breaker"""
+    kwargs.setdefault('timeout', default_timeout())
+    timeout = kwargs['timeout']
+    probe_window = sum(timeout) if isinstance(timeout, tuple) else (timeout or 30)
+    host = urlsplit(url).netloc
+
+    _before_request(host, url, probe_window)
+    session = get_session()
+    try:
+        response = session.request(method, url, **kwargs)
+    except Exception as e:
+        import requests
+        if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            _record_result(host, url, failed=True)
+        raise
+    _record_result(host, url, failed=response.status_code >= 500)
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
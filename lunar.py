@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Offline lunar phase engine (Meeus, Astronomical Algorithms ch. 47-49)
+Moon illumination, age and new/quarter/full moon times, no network needed
+"""
+
+import bisect
+import math
+import time
+
+SYNODIC_MONTH = 29.530588861  # days
+UNIX_EPOCH_JD = 2440587.5
+DELTA_T_SECONDS = 69  # TT - UT, good enough for minute precision this decade
+
+NEW_MOON, FIRST_QUARTER, FULL_MOON, LAST_QUARTER = 0, 1, 2, 3
+PHASE_EVENT_NAMES = ("New Moon", "First Quarter", "Full Moon", "Third Quarter")
+# Name for the stretch after each principal phase
+PHASE_SPAN_NAMES = ("Waxing Crescent", "Waxing Gibbous", "Waning Gibbous", "Waning Crescent")
+
+# Within this many seconds of a principal phase, report the phase itself
+PRINCIPAL_WINDOW = 86400
+
+# A year's table never changes; keep it cached for longer than the year lasts
+PHASE_TABLE_TTL = 400 * 86400
+
+# Periodic terms shared by new and full moon: (coefficient, power of E, M, M', F, Omega multipliers)
+_NEW_MOON_TERMS = (
+    (-0.40720, 0, 0, 1, 0, 0), (0.17241, 1, 1, 0, 0, 0), (0.01608, 0, 0, 2, 0, 0),
+    (0.01039, 0, 0, 0, 2, 0), (0.00739, 1, -1, 1, 0, 0), (-0.00514, 1, 1, 1, 0, 0),
+    (0.00208, 2, 2, 0, 0, 0), (-0.00111, 0, 0, 1, -2, 0), (-0.00057, 0, 0, 1, 2, 0),
+    (0.00056, 1, 1, 2, 0, 0), (-0.00042, 0, 0, 3, 0, 0), (0.00042, 1, 1, 0, 2, 0),
+    (0.00038, 1, 1, 0, -2, 0), (-0.00024, 1, -1, 2, 0, 0), (-0.00017, 0, 0, 0, 0, 1),
+    (-0.00007, 0, 2, 1, 0, 0), (0.00004, 0, 0, 2, -2, 0), (0.00004, 0, 3, 0, 0, 0),
+    (0.00003, 0, 1, 1, -2, 0), (0.00003, 0, 0, 2, 2, 0), (-0.00003, 0, 1, 1, 2, 0),
+    (0.00003, 0, -1, 1, 2, 0), (-0.00002, 0, -1, 1, -2, 0), (-0.00002, 0, 1, 3, 0, 0),
+    (0.00002, 0, 0, 4, 0, 0),
+)
+_FULL_MOON_TERMS = (
+    (-0.40614, 0, 0, 1, 0, 0), (0.17302, 1, 1, 0, 0, 0), (0.01614, 0, 0, 2, 0, 0),
+    (0.01043, 0, 0, 0, 2, 0), (0.00734, 1, -1, 1, 0, 0), (-0.00515, 1, 1, 1, 0, 0),
+    (0.00209, 2, 2, 0, 0, 0), (-0.00111, 0, 0, 1, -2, 0), (-0.00057, 0, 0, 1, 2, 0),
+    (0.00056, 1, 1, 2, 0, 0), (-0.00042, 0, 0, 3, 0, 0), (0.00042, 1, 1, 0, 2, 0),
+    (0.00038, 1, 1, 0, -2, 0), (-0.00024, 1, -1, 2, 0, 0), (-0.00017, 0, 0, 0, 0, 1),
+    (-0.00007, 0, 2, 1, 0, 0), (0.00004, 0, 0, 2, -2, 0), (0.00004, 0, 3, 0, 0, 0),
+    (0.00003, 0, 1, 1, -2, 0), (0.00003, 0, 0, 2, 2, 0), (-0.00003, 0, 1, 1, 2, 0),
+    (0.00003, 0, -1, 1, 2, 0), (-0.00002, 0, -1, 1, -2, 0), (-0.00002, 0, 1, 3, 0, 0),
+    (0.00002, 0, 0, 4, 0, 0),
+)
+_QUARTER_TERMS = (
+    (-0.62801, 0, 0, 1, 0, 0), (0.17172, 1, 1, 0, 0, 0), (-0.01183, 1, 1, 1, 0, 0),
+    (0.00862, 0, 0, 2, 0, 0), (0.00804, 0, 0, 0, 2, 0), (0.00454, 1, -1, 1, 0, 0),
+    (0.00204, 2, 2, 0, 0, 0), (-0.00180, 0, 0, 1, -2, 0), (-0.00070, 0, 0, 1, 2, 0),
+    (-0.00040, 0, 0, 3, 0, 0), (-0.00034, 1, -1, 2, 0, 0), (0.00032, 1, 1, 0, 2, 0),
+    (0.00032, 1, 1, 0, -2, 0), (-0.00028, 2, 2, 1, 0, 0), (0.00027, 1, 1, 2, 0, 0),
+    (-0.00017, 0, 0, 0, 0, 1), (-0.00005, 0, -1, 1, -2, 0), (0.00004, 0, 0, 2, 2, 0),
+    (-0.00004, 0, 1, 1, 2, 0), (0.00004, 0, -2, 1, 0, 0), (0.00003, 0, 1, 1, -2, 0),
+    (0.00003, 0, 3, 0, 0, 0), (0.00002, 0, 0, 2, -2, 0), (0.00002, 0, -1, 1, 2, 0),
+    (-0.00002, 0, 1, 3, 0, 0),
+)
+# Planetary arguments A1..A14: (constant, k rate, coefficient)
+_PLANETARY_TERMS = (
+    (299.77, 0.107408, 0.000325), (251.88, 0.016321, 0.000165), (251.83, 26.651886, 0.000164),
+    (349.42, 36.412478, 0.000126), (84.66, 18.206239, 0.000110), (141.74, 53.303771, 0.000062),
+    (207.14, 2.453732, 0.000060), (154.84, 7.306860, 0.000056), (34.52, 27.261239, 0.000047),
+    (207.19, 0.121824, 0.000042), (291.34, 1.844379, 0.000040), (161.72, 24.198154, 0.000037),
+    (239.56, 25.513099, 0.000035), (331.55, 3.592518, 0.000023),
+)
+
+
+def jd_to_unix(jd):
+    return (jd - UNIX_EPOCH_JD) * 86400.0
+
+
+def unix_to_jd(timestamp):
+    return timestamp / 86400.0 + UNIX_EPOCH_JD
+
+
+def phase_time(k):
+    """Unix timestamp of the lunar phase with lunation number k
+
+    k is an integer for new moons, +0.25 first quarter, +0.5 full, +0.75 last quarter.
+    """
+    t = k / 1236.85
+    jde = (2451550.09766 + SYNODIC_MONTH * k + 0.00015437 * t ** 2
+           - 0.000000150 * t ** 3 + 0.00000000073 * t ** 4)
+    e = 1 - 0.002516 * t - 0.0000074 * t ** 2
+    m = math.radians(2.5534 + 29.10535670 * k - 0.0000014 * t ** 2 - 0.00000011 * t ** 3)
+    mp = math.radians(201.5643 + 385.81693528 * k + 0.0107582 * t ** 2
+                      + 0.00001238 * t ** 3 - 0.000000058 * t ** 4)
+    f = math.radians(160.7108 + 390.67050284 * k - 0.0016118 * t ** 2
+                     - 0.00000227 * t ** 3 + 0.000000011 * t ** 4)
+    omega = math.radians(124.7746 - 1.56375588 * k + 0.0020672 * t ** 2 + 0.00000215 * t ** 3)
+
+    fraction = round((k % 1) * 4) % 4
+    terms = {NEW_MOON: _NEW_MOON_TERMS, FULL_MOON: _FULL_MOON_TERMS}.get(fraction, _QUARTER_TERMS)
+    for coeff, e_power, cm, cmp, cf, comega in terms:
+        jde += coeff * e ** e_power * math.sin(cm * m + cmp * mp + cf * f + comega * omega)
+
+    if fraction in (FIRST_QUARTER, LAST_QUARTER):
+        w = (0.00306 - 0.00038 * e * math.cos(m) + 0.00026 * math.cos(mp)
+             - 0.00002 * math.cos(mp - m) + 0.00002 * math.cos(mp + m) + 0.00002 * math.cos(2 * f))
+        jde += w if fraction == FIRST_QUARTER else -w
+
+    for i, (constant, rate, coeff) in enumerate(_PLANETARY_TERMS):
+        angle = constant + rate * k
+        if i == 0:
+            angle -= 0.009173 * t ** 2
+        jde += coeff * math.sin(math.radians(angle))
+
+    return jd_to_unix(jde) - DELTA_T_SECONDS
+
+
+def build_phase_table(year):
+    """Sorted (timestamps, phase codes) for every principal phase around a year
+
+    Covers a month either side so 'previous' and 'next' lookups work at the
+    year boundaries.
+    """
+    k = math.floor((year - 2000) * 12.3685) - 1
+    times, codes = [], []
+    while True:
+        for quarter in range(4):
+            timestamp = phase_time(k + quarter / 4)
+            times.append(round(timestamp))
+            codes.append(quarter)
+        if time.gmtime(timestamp).tm_year > year and time.gmtime(timestamp).tm_mon > 1:
+            break
+        k += 1
+    return times, codes
+
+
+def illumination(timestamp):
+    """Illuminated fraction (0-1) and phase angle in degrees (0 = full)"""
+    t = (unix_to_jd(timestamp) - 2451545.0) / 36525.0
+    d = math.radians(297.8501921 + 445267.1114034 * t - 0.0018819 * t ** 2)
+    m = math.radians(357.5291092 + 35999.0502909 * t - 0.0001536 * t ** 2)
+    mp = math.radians(134.9633964 + 477198.8675055 * t + 0.0087414 * t ** 2)
+
+    phase_angle = (180 - math.degrees(d)
+                   - 6.289 * math.sin(mp) + 2.100 * math.sin(m)
+                   - 1.274 * math.sin(2 * d - mp) - 0.658 * math.sin(2 * d)
+                   - 0.214 * math.sin(2 * mp) - 0.110 * math.sin(d)) % 360
+    fraction = (1 + math.cos(math.radians(phase_angle))) / 2
+    return fraction, min(phase_angle, 360 - phase_angle)
+
+
+class PhaseTable:
+    """Precomputed phase events for one year, looked up by bisection"""
+
+    def __init__(self, year, times, codes):
+        self.year = year
+        self.times = times
+        self.codes = codes
+
+    @classmethod
+    def load(cls, year, cache=None):
+        """Load the year's table from cache (a WidgetCache), building and storing it if needed"""
+        key = f"phases:{year}"
+        data = cache.get(key) if cache else None
+        if data:
+            return cls(year, data['times'], [int(code) for code in data['codes']])
+
+        times, codes = build_phase_table(year)
+        if cache:
+            cache.put(key, {'times': times, 'codes': ''.join(map(str, codes))}, ttl=PHASE_TABLE_TTL)
+        return cls(year, times, codes)
+
+    def previous_event(self, timestamp):
+        """(timestamp, code) of the last principal phase at or before timestamp"""
+        i = bisect.bisect_right(self.times, timestamp) - 1
+        return self.times[i], self.codes[i]
+
+    def next_event(self, timestamp, code=None):
+        """(timestamp, code) of the next principal phase, optionally of one kind"""
+        i = bisect.bisect_right(self.times, timestamp)
+        while code is not None and self.codes[i] != code:
+            i += 1
+        return self.times[i], self.codes[i]
+
+    def moon_info(self, timestamp):
+        """Everything the widget shows about the moon at a moment"""
+        prev_time, prev_code = self.previous_event(timestamp)
+        next_time, next_code = self.next_event(timestamp)
+
+        if timestamp - prev_time <= PRINCIPAL_WINDOW:
+            name = PHASE_EVENT_NAMES[prev_code]
+        elif next_time - timestamp <= PRINCIPAL_WINDOW:
+            name = PHASE_EVENT_NAMES[next_code]
+        else:
+            name = PHASE_SPAN_NAMES[prev_code]
+
+        i = bisect.bisect_right(self.times, timestamp) - 1
+        while self.codes[i] != NEW_MOON:
+            i -= 1
+        last_new = self.times[i]
+
+        fraction, phase_angle = illumination(timestamp)
+        return {
+            'name': name,
+            'illumination': fraction,
+            'phase_angle': phase_angle,
+            'age_days': (timestamp - last_new) / 86400.0,
+            'next_new': self.next_event(timestamp, NEW_MOON)[0],
+            'next_full': self.next_event(timestamp, FULL_MOON)[0],
+        }
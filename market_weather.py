@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Conky Market & Weather - exchange rates and current conditions
+Reads the currency and weather sections of config.json; results are kept in
+the shared widget cache so every Conky refresh inside the TTL is a file read
+"""
+
+import sys
+import json
+import os
+
+import http_client
+import metrics
+import revalidate
+from widget_cache import WidgetCache
+
+
+class CachedProvider:
+    """Base for the providers: a widget cache namespace plus the fetch timeout"""
+
+    component = 'market'
+
+    def __init__(self, namespace, ttl, timeout):
+        self.cache = WidgetCache(namespace, ttl)
+        self.timeout = timeout
+        # Set when a value was served past its TTL
+        self.served_stale = False
+
+    def cached(self, key, fetch, allow_stale=True):
+        """Fresh cached value, else fetch(); a failed fetch serves the stale value
+
+        With stale-while-revalidate on, an expired value is returned at once
+        and a background `refresh` process fetches the new one.
+        """
+        cached, fresh = self.cache.lookup(key)
+        if fresh:
+            metrics.incr('conky_widget_cache_total', component=self.component, target=key, result='hit')
+            return cached
+
+        if cached is not None and allow_stale and revalidate.enabled():
+            metrics.incr('conky_widget_cache_total', component=self.component, target=key, result='stale')
+            revalidate.spawn_refresh('market', 'market_weather.py', ['refresh'])
+            self.served_stale = True
+            return cached
+
+        try:
+            with metrics.timer('conky_widget_fetch_seconds', component=self.component, target=key):
+                value = fetch()
+        except Exception as e:
+            metrics.record_error(self.component, e, key)
+            if cached is not None:
+                metrics.incr('conky_widget_cache_total', component=self.component, target=key, result='stale')
+            return cached
+
+        metrics.incr('conky_widget_cache_total', component=self.component, target=key, result='miss')
+        self.cache.put(key, value)
+        return value
+
+    def get(self, url):
+        """GET with the connect timeout from general.http and this provider's read timeout"""
+        response = http_client.get(url, timeout=(http_client.default_timeout()[0], self.timeout))
+        response.raise_for_status()
+        return response
+
+
+class CurrencyProvider(CachedProvider):
+    """Exchange rates from one base currency; one response serves every pair"""
+
+    def __init__(self, config):
+        currency_config = config['currency']
+        super().__init__('currency',
+                         currency_config.get('cache_minutes', 10) * 60,
+                         currency_config.get('timeout_seconds', 5))
+        self.api_url = currency_config['api_url']
+        self.base = currency_config.get('base_currency', 'GBP')
+        self.targets = currency_config.get('target_currencies') or [currency_config.get('target_currency', 'USD')]
+
+    def get_rates(self, allow_stale=True):
+        """All rates for the base currency, or None"""
+        def fetch():
+            rates = self.get(self.api_url).json()['rates']
+            return {code: float(rate) for code, rate in rates.items()}
+        return self.cached(f"rates:{self.base}", fetch, allow_stale)
+
+    def cached_rates(self):
+        """The stored rates however old, or None; never fetches"""
+        return self.cache.get(f"rates:{self.base}", allow_stale=True)
+
+    def get_rate(self, target=None):
+        rates = self.get_rates()
+        if not rates:
+            return None
+        return rates.get((target or self.targets[0]).upper())
+
+    def format_rate(self, target=None):
+        rate = self.get_rate(target)
+        return f"£{rate:.3f}" if rate is not None else "N/A"
+
+    def format_rates(self):
+        """Every configured target on one line"""
+        rates = self.get_rates()
+        if not rates:
+            return "N/A"
+        return " | ".join(f"{target} {rates[target]:.3f}" for target in self.targets if target in rates)
+
+
+class WeatherProvider(CachedProvider):
+    """Current conditions from wttr.in's one-line format"""
+
+    def __init__(self, config):
+        weather_config = config['weather']
+        super().__init__('weather',
+                         weather_config.get('cache_minutes', 30) * 60,
+                         weather_config.get('timeout_seconds', 5))
+        url = weather_config['api_url']
+        if '://' not in url:
+            url = 'https://' + url
+        self.api_url = url.rstrip('/')
+        self.format = weather_config.get('format', '%t+%C&m')
+        self.location = config['location']['name']
+
+    def get_weather(self, location=None, allow_stale=True):
+        location = location or self.location
+        def fetch():
+            text = self.get(f"{self.api_url}/{location}?format={self.format}").text
+            # wttr.in joins fields with '+'
+            return text.replace('+', ' ').strip()
+        return self.cached(f"weather:{location}", fetch, allow_stale) or "N/A"
+
+
+class MarketWeatherManager:
+    def __init__(self, config_path=None):
+        """Initialize with configuration"""
+        if config_path is None:
+            config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+
+        with open(config_path, 'r') as f:
+            self.config = json.load(f)
+
+        self.currency = CurrencyProvider(self.config)
+        self.weather = WeatherProvider(self.config)
+
+    def refresh_all(self):
+        """Fetch everything past its TTL in the foreground (the background refresh job)"""
+        self.currency.get_rates(allow_stale=False)
+        self.weather.get_weather(allow_stale=False)
+        return "refreshed"
+
+USAGE = "Usage: market_weather.py [weather [location]|currency [code]|rates|refresh|stats]"
+
+def run(args, manager=None):
+    """Run a CLI command and return its output text"""
+    command = args[0].lower() if args else ''
+    with metrics.timer('conky_widget_command_seconds', component='market', command=command):
+        return _run_command(args, manager)
+
+def _run_command(args, manager):
+    try:
+        if manager is None:
+            manager = MarketWeatherManager()
+
+        if not args:
+            return USAGE
+
+        command = args[0].lower()
+        if command == 'stats':
+            return metrics.format_stats('market')
+        elif command == 'refresh':
+            return manager.refresh_all()
+
+        manager.currency.served_stale = manager.weather.served_stale = False
+        if command == 'weather':
+            text = manager.weather.get_weather(args[1] if len(args) > 1 else None)
+        elif command == 'currency':
+            text = manager.currency.format_rate(args[1] if len(args) > 1 else None)
+        elif command == 'rates':
+            text = manager.currency.format_rates()
+        else:
+            return USAGE
+        return revalidate.mark(text, manager.currency.served_stale or manager.weather.served_stale)
+
+    except Exception as e:
+        metrics.record_error('market', e, 'run')
+        return "N/A"
+
+def main():
+    print(run(sys.argv[1:]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Opt-in metrics for the Conky widget scripts
+Fetch latency histograms, cache hit/miss/stale counts, retries and error
+classes, merged across processes into .widget_metrics.json and exported as
+a Prometheus textfile or JSON
+
+Enable with "metrics": {"enabled": true} under "general" in config.json, or
+CONKY_WIDGET_METRICS=1. When disabled every call is a cheap no-op.
+
+Usage: metrics.py [stats|json|prometheus [path]|reset]
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, unquote
+
+import widget_config
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_FILE = os.path.join(BASE_DIR, '.widget_metrics.json')
+
+# Latency histogram upper bounds in seconds (Prometheus defaults)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Long-running processes (the widget daemon) merge at least this often
+FLUSH_INTERVAL = 10
+
+HELP = {
+    'conky_widget_fetch_seconds': 'Latency of remote fetches by component and target',
+    'conky_widget_command_seconds': 'Wall time of widget commands',
+    'conky_widget_bytes_total': 'Response bytes read from the network',
+    'conky_widget_cache_total': 'Cache lookups by result (hit, miss, stale, revalidated)',
+    'conky_widget_retries_total': 'Requests delayed or re-attempted, by reason',
+    'conky_widget_errors_total': 'Failures by component, target and error class',
+}
+
+_lock = threading.Lock()
+_enabled = None
+_atexit_registered = False
+_counters = {}
+_histograms = {}
+_last_flush = time.monotonic()
+
+
+def _build_settings(general):
+    metrics = general.get('metrics', {})
+    return {
+        'enabled': bool(metrics.get('enabled', False)),
+        'textfile': metrics.get('textfile'),
+    }
+
+
+def enabled():
+    """Whether metrics are switched on (CONKY_WIDGET_METRICS, else config.json, rechecked when it changes)"""
+    global _enabled, _atexit_registered
+    env = os.environ.get('CONKY_WIDGET_METRICS')
+    if env is not None:
+        if _enabled is None:
+            _enabled = env not in ('', '0', 'false', 'no')
+    else:
+        _enabled = widget_config.settings(_build_settings)['enabled']
+    if _enabled and not _atexit_registered:
+        _atexit_registered = True
+        atexit.register(flush)
+    return _enabled
+
+
+def _key(name, labels):
+    """name|label=value,... with values percent-encoded, so ',', '=' and '|' in them survive"""
+    return name + '|' + ','.join(f"{k}={quote(str(v), safe='')}" for k, v in sorted(labels.items()))
+
+
+def _split_key(key):
+    name, _, label_text = key.partition('|')
+    labels = {}
+    for item in label_text.split(','):
+        if item:
+            label, _, value = item.partition('=')
+            labels[label] = unquote(value)
+    return name, labels
+
+
+def incr(name, amount=1, **labels):
+    """Add to a counter"""
+    if not enabled():
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    _flush_if_due()
+
+
+def observe(name, seconds, **labels):
+    """Record one latency sample in a histogram"""
+    if not enabled():
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.setdefault(key, {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist['buckets'][i] += 1
+                break
+        else:
+            hist['buckets'][-1] += 1
+        hist['sum'] += seconds
+        hist['count'] += 1
+    _flush_if_due()
+
+
+def record_error(component, error, target=''):
+    """Count a failure by exception class (or any short error string)"""
+    if not enabled():
+        return
+    error_class = error if isinstance(error, str) else type(error).__name__
+    incr('conky_widget_errors_total', component=component, target=target, error=error_class)
+
+
+class timer:
+    """Context manager timing a block into a histogram"""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def _load(path=METRICS_FILE):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'counters': {}, 'histograms': {}}
+
+
+def flush():
+    """Merge this process's deltas into the shared metrics file"""
+    global _last_flush
+    with _lock:
+        counters, histograms = dict(_counters), dict(_histograms)
+        _counters.clear()
+        _histograms.clear()
+        _last_flush = time.monotonic()
+    if not counters and not histograms:
+        return
+
+    try:
+        with open(METRICS_FILE + '.lock', 'w') as lock_fd:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            data = _load()
+            for key, value in counters.items():
+                data['counters'][key] = data['counters'].get(key, 0) + value
+            for key, hist in histograms.items():
+                stored = data['histograms'].setdefault(key, {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+                stored['buckets'] = [a + b for a, b in zip(stored['buckets'], hist['buckets'])]
+                stored['sum'] += hist['sum']
+                stored['count'] += hist['count']
+            data['updated'] = time.time()
+
+            _write_atomic(METRICS_FILE, json.dumps(data))
+
+            textfile = _textfile_path()
+            if textfile:
+                write_prometheus(textfile, data)
+    except OSError:
+        pass  # Metrics must never break the widget
+
+
+def _flush_if_due():
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def _textfile_path():
+    """Prometheus textfile path from config, if one is configured"""
+    return widget_config.settings(_build_settings)['textfile']
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus(data=None):
+    """Prometheus text exposition format"""
+    data = data or _load()
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for key in sorted(data['counters']):
+        name, labels = _split_key(key)
+        header(name, 'counter')
+        lines.append(f"{name}{_format_labels(labels)} {data['counters'][key]}")
+
+    for key in sorted(data['histograms']):
+        name, labels = _split_key(key)
+        hist = data['histograms'][key]
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), hist['buckets']):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(dict(labels, le=str(bound)))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']:.6f}")
+        lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path, text):
+    """Replace path with text via a uniquely named temp file (daemon threads share a pid)"""
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            os.fchmod(f.fileno(), 0o644)  # node_exporter may run as another user
+            f.write(text)
+        os.replace(tmp_file, path)
+    except OSError:
+        os.unlink(tmp_file)
+        raise
+
+
+def write_prometheus(path, data=None):
+    """Write the textfile atomically (for node_exporter's textfile collector)"""
+    _write_atomic(path, render_prometheus(data))
+
+
+def _quantile(hist, q):
+    """Approximate quantile from bucket counts (upper bound of the bucket)"""
+    target = hist['count'] * q
+    running = 0
+    for bound, count in zip(BUCKETS + (float('inf'),), hist['buckets']):
+        running += count
+        if running >= target:
+            return bound
+    return float('inf')
+
+
+def format_stats(component=None):
+    """Human-readable summary, optionally for one component"""
+    flush()
+    data = _load()
+    lines = []
+
+    for key in sorted(data['histograms']):
+        name, labels = _split_key(key)
+        if component and labels.get('component') != component:
+            continue
+        hist = data['histograms'][key]
+        if not hist['count']:
+            continue
+        target = labels.get('target') or labels.get('command', '')
+        avg_ms = hist['sum'] / hist['count'] * 1000
+        p95 = _quantile(hist, 0.95)
+        p95_text = f"<{p95 * 1000:.0f}ms" if p95 != float('inf') else ">10s"
+        lines.append(f"{name.replace('conky_widget_', '')} {labels.get('component', '')} {target}: "
+                     f"n={hist['count']} avg={avg_ms:.0f}ms p95{p95_text}")
+
+    for key in sorted(data['counters']):
+        name, labels = _split_key(key)
+        if component and labels.get('component') != component:
+            continue
+        detail = ' '.join(f"{k}={v}" for k, v in sorted(labels.items()) if k != 'component' and v)
+        lines.append(f"{name.replace('conky_widget_', '')} {labels.get('component', '')} {detail}: "
+                     f"{data['counters'][key]}")
+
+    if not lines:
+        return "No metrics recorded" + ("" if enabled() else " (metrics disabled)")
+    return "\n".join(lines)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'stats':
+        print(format_stats(sys.argv[2] if len(sys.argv) > 2 else None))
+    elif command == 'json':
+        print(json.dumps(_load(), indent=2))
+    elif command == 'prometheus':
+        if len(sys.argv) > 2:
+            write_prometheus(sys.argv[2])
+        else:
+            print(render_prometheus(), end='')
+    elif command == 'reset':
+        if os.path.exists(METRICS_FILE):
+            os.remove(METRICS_FILE)
+    else:
+        print("Usage: metrics.py [stats|json|prometheus [path]|reset]")
+
+if __name__ == "__main__":
+    main()
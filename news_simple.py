@@ -1,13 +1,75 @@
 #!/usr/bin/env python3
 """
 Simple News Headlines for Conky
-No caching, no click functionality - just clean news display
+Feeds are cached on disk and revalidated with ETag/Last-Modified, then merged
+into one deduplicated headline pool - no click functionality
 """
 
-import feedparser
 import sys
 import json
 import os
+import time
+import threading
+
+# Parsing modules (feedparser, xml.etree, email.utils, ...) are imported in
+# the functions that fetch, so serving headlines from the cache stays cheap
+import http_client
+import metrics
+import revalidate
+from headline_pool import build_pool, matches
+from widget_cache import WidgetCache
+
+# Titles kept per source in the feed cache
+CACHED_ITEMS_PER_SOURCE = 10
+
+# Widget cache key of the merged pool (source names are the other keys)
+POOL_KEY = '@pool'
+
+# Bytes read from the socket per step of the streaming parser
+STREAM_CHUNK_SIZE = 8192
+
+# Adaptive polling: weight of the newest interval sample, and the growth
+# factor applied for each poll that finds nothing new
+EWMA_ALPHA = 0.3
+BACKOFF_FACTOR = 2
+
+# Item date elements (RSS, Atom)
+DATE_TAGS = ('pubDate', 'published', 'updated')
+
+def parse_feed_date(text):
+    """Unix time from an RFC 822 (RSS) or ISO 8601 (Atom) date, or None"""
+    from datetime import datetime
+    from email.utils import parsedate_to_datetime
+    
+    text = (text or '').strip()
+    if not text:
+        return None
+    try:
+        return parsedate_to_datetime(text).timestamp()
+    except (TypeError, ValueError, IndexError):
+        pass
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+def publish_interval(dates):
+    """Median gap in seconds between consecutive item dates, or None"""
+    import statistics
+    
+    dates = sorted(set(date for date in dates if date), reverse=True)
+    gaps = [newer - older for newer, older in zip(dates, dates[1:])]
+    return statistics.median(gaps) if gaps else None
+
+def titles_hash(titles):
+    import hashlib
+    return hashlib.sha1("\n".join(titles).encode('utf-8')).hexdigest()
+
+def clean_title(title):
+    """Collapse newlines and runs of whitespace in a headline"""
+    title = title.strip()
+    title = title.replace('\n', ' ').replace('\r', ' ')
+    return ' '.join(title.split())  # Clean whitespace
 
 class SimpleNewsManager:
     def __init__(self, config_path=None):
@@ -17,47 +79,368 @@ class SimpleNewsManager:
         
         with open(config_path, 'r') as f:
             self.config = json.load(f)
+        
+        self.cache = WidgetCache('news')
+        self.cache_ttl = self.cache.ttl
+        
+        news_config = self.config['news']
+        self.concurrent_fetch = news_config.get('concurrent_fetch', True)
+        self.source_timeout = news_config.get('source_timeout_seconds', 5)
+        self.overall_timeout = news_config.get('overall_timeout_seconds', 6)
+        self.streaming_parser = news_config.get('streaming_parser', True)
+        self.adaptive_polling = news_config.get('adaptive_polling', True)
+        self.min_poll = news_config.get('min_poll_seconds', 120)
+        self.rotate_seconds = news_config.get('rotate_seconds', 60)
+        # Everything the pool depends on; a change rebuilds it
+        self.pool_settings = {
+            'sources': news_config['sources'],
+            'include': news_config.get('include_keywords', []),
+            'exclude': news_config.get('exclude_keywords', []),
+            'rank': news_config.get('rank_keywords', {}),
+        }
+        # Set when the last get_all_headlines() served an expired feed
+        self.served_stale = False
     
-    def fetch_headlines_from_source(self, source_name, max_headlines=2):
-        """Fetch headlines from a specific RSS source"""
+    def fetch_feed_titles(self, source_name, url, allow_stale=True, deadline=None):
+        """Return cleaned titles for a feed, using the cache and conditional GET
+        
+        With stale-while-revalidate on, an expired feed is returned as-is and
+        a background `refresh` process fetches it; only feeds with nothing
+        cached are fetched in the foreground. A fetch gives up at deadline
+        (a time.monotonic() value), if one is given.
+        """
+        entry, fresh = self.cache.lookup(source_name)
+        if entry and entry.get('url') != url:
+            entry = None
+        
+        now = time.time()
+        if entry and fresh:
+            metrics.incr('conky_widget_cache_total', component='news', target=source_name, result='hit')
+            return entry['titles']
+        
+        if entry and allow_stale and revalidate.enabled():
+            metrics.incr('conky_widget_cache_total', component='news', target=source_name, result='stale')
+            revalidate.spawn_refresh('news', 'news_simple.py', ['refresh'])
+            self.served_stale = True
+            return entry['titles']
+        
+        # Revalidate with the stored validators; unchanged feeds answer 304
+        etag = entry.get('etag') if entry else None
+        modified = entry.get('modified') if entry else None
+        with metrics.timer('conky_widget_fetch_seconds', component='news', target=source_name):
+            try:
+                if self.streaming_parser:
+                    result = self.stream_titles(url, etag, modified, deadline)
+                else:
+                    result = self.parse_titles(url, etag, modified, deadline=deadline)
+            except Exception as e:
+                result = {'status': None, 'titles': [], 'error': e}
+        metrics.incr('conky_widget_bytes_total', result.get('bytes', 0), component='news', target=source_name)
+        
+        if entry and result['status'] == 304:
+            metrics.incr('conky_widget_cache_total', component='news', target=source_name, result='revalidated')
+            entry['fetched_at'] = now
+            self.schedule_next_poll(entry, now, changed=False)
+        elif result['titles']:
+            metrics.incr('conky_widget_cache_total', component='news', target=source_name, result='miss')
+            content_hash = titles_hash(result['titles'])
+            changed = not entry or entry.get('hash') != content_hash
+            entry = dict(entry or {}, **{
+                'url': url,
+                'fetched_at': now,
+                'etag': result.get('etag'),
+                'modified': result.get('modified'),
+                'titles': result['titles'],
+                'hash': content_hash,
+            })
+            self.schedule_next_poll(entry, now, changed, result.get('dates'))
+        else:
+            # Fetch failed - keep serving whatever we had
+            metrics.record_error('news', result.get('error') or 'NoEntries', source_name)
+            if entry:
+                metrics.incr('conky_widget_cache_total', component='news', target=source_name, result='stale')
+            return entry['titles'] if entry else []
+        
+        # Fresh until the scheduled poll
+        self.cache.put(source_name, entry, ttl=entry['next_poll'] - now)
+        return entry['titles']
+    
+    def schedule_next_poll(self, entry, now, changed, dates=None):
+        """Set entry['next_poll'] from the feed's learned update interval
+        
+        The interval is an EWMA of the gap between item publish dates (or,
+        for feeds without dates, between polls that saw new content). Each
+        poll that finds nothing new doubles the wait. The result is clamped
+        between min_poll_seconds and the cache TTL.
+        """
+        if not self.adaptive_polling:
+            entry['next_poll'] = now + self.cache_ttl
+            return
+        
+        estimate = entry.get('update_interval')
+        if changed:
+            sample = publish_interval(dates or [])
+            if sample is None and 'changed_at' in entry:
+                sample = now - entry['changed_at']
+            if sample is not None:
+                estimate = sample if estimate is None else EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * estimate
+            entry['changed_at'] = now
+            entry['unchanged_polls'] = 0
+        else:
+            entry['unchanged_polls'] = entry.get('unchanged_polls', 0) + 1
+        
+        if estimate is None:
+            interval = self.cache_ttl  # Nothing learned yet
+        else:
+            interval = estimate * BACKOFF_FACTOR ** entry['unchanged_polls']
+        interval = min(max(interval, self.min_poll), self.cache_ttl)
+        
+        entry['update_interval'] = estimate
+        entry['poll_interval'] = interval
+        entry['next_poll'] = now + interval
+    
+    def poll_schedule(self):
+        """One line per source: learned interval and time to next poll"""
+        now = time.time()
+        lines = []
+        for source in self.config['news']['sources']:
+            entry = self.cache.get(source, allow_stale=True)
+            if not entry:
+                lines.append(f"{source}: not fetched yet")
+                continue
+            next_poll = entry.get('next_poll', entry.get('fetched_at', 0) + self.cache_ttl)
+            interval = entry.get('poll_interval', self.cache_ttl)
+            lines.append(f"{source}: every {interval / 60:.0f}m, next in {max(next_poll - now, 0) / 60:.0f}m"
+                         f" ({entry.get('unchanged_polls', 0)} unchanged)")
+        return "\n".join(lines)
+    
+    def request_timeout(self, deadline=None):
+        """(connect, read) timeout for a feed request, cut to the time left before deadline"""
+        connect = http_client.default_timeout()[0]
+        if deadline is None:
+            return (connect, self.source_timeout)
+        left = max(deadline - time.monotonic(), 0.1)
+        return (min(connect, left), min(self.source_timeout, left))
+    
+    @staticmethod
+    def conditional_headers(etag=None, modified=None):
+        """Validator headers for a conditional GET"""
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        return headers
+    
+    def parse_titles(self, url, etag=None, modified=None, body=None, deadline=None):
+        """Fetch (or parse an already downloaded body) with feedparser"""
+        import calendar
+        import feedparser
+        
+        result = {}
+        if body is None:
+            response = http_client.get(url, headers=self.conditional_headers(etag, modified),
+                                       timeout=self.request_timeout(deadline))
+            if response.status_code == 304:
+                return {'status': 304, 'titles': [], 'bytes': 0}
+            response.raise_for_status()
+            body = response.content
+            result = {
+                'status': response.status_code,
+                'etag': response.headers.get('ETag'),
+                'modified': response.headers.get('Last-Modified'),
+                'bytes': len(body),
+            }
+        
+        feed = feedparser.parse(body)
+        entries = feed.entries[:CACHED_ITEMS_PER_SOURCE]
+        result['titles'] = [clean_title(item.title) for item in entries if 'title' in item]
+        result['dates'] = [calendar.timegm(item.get('published_parsed') or item.get('updated_parsed'))
+                           for item in entries if item.get('published_parsed') or item.get('updated_parsed')]
+        result['error'] = feed.get('bozo_exception')
+        return result
+    
+    def stream_titles(self, url, etag=None, modified=None, deadline=None):
+        """Read a feed incrementally and stop once enough item titles are found
+        
+        Only <item>/<entry> titles are kept and elements are discarded as
+        soon as they close, so a 100-item feed costs a few KB of reading.
+        Feeds the XML parser rejects are read to the end and handed to
+        feedparser instead.
+        """
+        import xml.etree.ElementTree as ET
+        
+        response = http_client.get(url, headers=self.conditional_headers(etag, modified), stream=True,
+                                   timeout=self.request_timeout(deadline))
+        
+        # Closing a partly read response drops that connection from the pool,
+        # which is the price of not downloading the rest of the feed
+        with response:
+            if response.status_code == 304:
+                return {'status': 304, 'titles': [], 'bytes': 0}
+            response.raise_for_status()
+            
+            parser = ET.XMLPullParser(events=('start', 'end'))
+            titles = []
+            dates = []
+            body = []
+            depth = 0
+            have_title = False
+            have_date = False
+            parse_failed = False
+            
+            # iter_content undoes gzip/br transfer encoding
+            try:
+                for data in response.iter_content(STREAM_CHUNK_SIZE):
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise TimeoutError("feed not read before the deadline")
+                    body.append(data)
+                    if parse_failed:
+                        continue  # Just collecting the body for feedparser
+                    
+                    try:
+                        parser.feed(data)
+                        for event, elem in parser.read_events():
+                            tag = elem.tag.rsplit('}', 1)[-1]
+                            if tag in ('item', 'entry'):
+                                if event == 'start':
+                                    depth += 1
+                                    have_title = have_date = False
+                                else:
+                                    depth -= 1
+                                    elem.clear()
+                                    if len(titles) >= CACHED_ITEMS_PER_SOURCE:
+                                        break  # Stop at the end of the item, after its date
+                            elif event == 'end' and tag == 'title' and depth == 1 and not have_title:
+                                # First title only - skip media:title and friends
+                                titles.append(clean_title(''.join(elem.itertext())))
+                                have_title = True
+                            elif event == 'end' and tag in DATE_TAGS and depth == 1 and not have_date:
+                                dates.append(parse_feed_date(elem.text))
+                                have_date = True
+                    except ET.ParseError:
+                        parse_failed = True
+                    
+                    if len(titles) >= CACHED_ITEMS_PER_SOURCE:
+                        break
+            except Exception as e:
+                # Slow or broken bodies count against the host like failed requests
+                http_client.record_stream_error(url, e)
+                raise
+            
+            # Bytes off the wire (compressed), not the decoded size
+            bytes_read = response.raw.tell()
+            status = response.status_code
+            new_etag = response.headers.get('ETag')
+            new_modified = response.headers.get('Last-Modified')
+        
+        if parse_failed or not titles:
+            result = self.parse_titles(url, body=b''.join(body))
+        else:
+            result = {'titles': titles, 'dates': dates}
+        
+        result.update({'status': status, 'etag': new_etag, 'modified': new_modified, 'bytes': bytes_read})
+        return result
+    
+    def source_titles(self, source_name, deadline=None):
+        """Titles for a configured source ([] if unknown or failing)"""
         try:
             sources = self.config['news']['sources']
             if source_name not in sources:
                 return []
-            
-            headers = {'User-Agent': self.config['general']['user_agent']}
-            feed = feedparser.parse(sources[source_name])
-            
-            if not feed.entries:
-                return []
-            
-            headlines = []
-            for entry in feed.entries[:max_headlines]:
-                title = entry.title.strip()
-                title = title.replace('\n', ' ').replace('\r', ' ')
-                title = ' '.join(title.split())  # Clean whitespace
-                
-                headlines.append({
-                    'source': source_name.upper(),
-                    'title': title
-                })
-            
-            return headlines
-        except:
+            return self.fetch_feed_titles(source_name, sources[source_name], deadline=deadline)
+        except Exception as e:
+            metrics.record_error('news', e, source_name)
             return []
     
-    def get_all_headlines(self):
-        """Get headlines from all sources - fresh each time"""
-        all_headlines = []
-        sources = ['bbc', 'guardian', 'sky', 'hackernews']
+    def fetch_headlines_from_source(self, source_name, max_headlines=2):
+        """Fetch headlines from a specific RSS source"""
+        return [
+            {'source': source_name.upper(), 'title': title}
+            for title in self.source_titles(source_name)[:max_headlines]
+        ]
+    
+    def refresh_all(self):
+        """Fetch every due source in the foreground, then rebuild the pool (the background refresh job)"""
+        threads = []
+        for source, url in self.config['news']['sources'].items():
+            thread = threading.Thread(target=self.fetch_feed_titles, args=(source, url, False))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.build_pool()
+        return "refreshed"
+    
+    def fetch_sources_concurrently(self, sources):
+        """Fetch all sources in parallel; [(source, titles)] in source order
+        
+        Each source gets its own deadline, source_timeout seconds from when
+        it starts but never past overall_timeout seconds from the start of
+        the call. Late sources are dropped rather than waited on. The time
+        left is passed to each request as its timeout, so their threads give
+        up at the same deadline instead of running on in the daemon.
+        """
+        overall_deadline = time.monotonic() + self.overall_timeout
+        deadlines = {}
+        results = {}
+        finished = {}
         
+        def worker(source):
+            results[source] = self.source_titles(source, deadlines[source])
+            finished[source].set()
+        
+        for source in sources:
+            finished[source] = threading.Event()
+            deadlines[source] = min(time.monotonic() + self.source_timeout, overall_deadline)
+            threading.Thread(target=worker, args=(source,), daemon=True).start()
+        
+        feeds = []
         for source in sources:
-            if source in self.config['news']['sources']:
-                headlines = self.fetch_headlines_from_source(source, 2)
-                all_headlines.extend(headlines)
-                
-                if len(all_headlines) >= 8:
-                    break
+            if not finished[source].wait(max(0, deadlines[source] - time.monotonic())):
+                metrics.record_error('news', 'DeadlineExceeded', source)
+                continue  # Too slow - drop it
+            feeds.append((source, results[source]))
+        
+        return feeds
+    
+    def build_pool(self):
+        """Merge every source's cached titles into the pool and store it
+        
+        The pool stays fresh for min_poll_seconds; a background refresh
+        rebuilds it as soon as new feeds are in.
+        """
+        self.served_stale = False
+        sources = list(self.config['news']['sources'])
+        if self.concurrent_fetch:
+            feeds = self.fetch_sources_concurrently(sources)
+        else:
+            overall_deadline = time.monotonic() + self.overall_timeout
+            feeds = [(source, self.source_titles(source, min(time.monotonic() + self.source_timeout,
+                                                             overall_deadline)))
+                     for source in sources]
+        
+        pool = build_pool(feeds, self.pool_settings['include'], self.pool_settings['exclude'],
+                          self.pool_settings['rank'])
+        pool.update(settings=self.pool_settings, stale=self.served_stale)
+        if pool['headlines']:
+            self.cache.put(POOL_KEY, pool, ttl=self.min_poll)
+        return pool
+    
+    def get_pool(self):
+        """The merged pool: one cache read while fresh, else rebuilt from the feeds"""
+        pool, fresh = self.cache.lookup(POOL_KEY)
+        if pool and fresh and pool.get('settings') == self.pool_settings:
+            metrics.incr('conky_widget_cache_total', component='news', target='pool', result='hit')
+            self.served_stale = pool.get('stale', False)
+            return pool
+        
+        metrics.incr('conky_widget_cache_total', component='news', target='pool', result='miss')
+        return self.build_pool()
+    
+    def get_all_headlines(self):
+        """Every headline in the pool, best ranked first"""
+        all_headlines = self.get_pool()['headlines']
         
         # Fallback if no headlines
         if len(all_headlines) < 2:
@@ -99,43 +482,91 @@ class SimpleNewsManager:
         if index < len(headlines):
             return self.format_headline(headlines[index], truncate=False)
         return "No headlines available"
+    
+    def get_rotating_headline(self, line=0, lines=4):
+        """Headline for one of `lines` Conky lines, moving through the whole pool
+        
+        The cursor advances by `lines` every rotate_seconds, so the lines
+        show consecutive headlines and every line agrees on the page
+        without sharing any state.
+        """
+        headlines = self.get_all_headlines()
+        if len(headlines) <= lines:
+            return self.get_single_headline(line)
+        cursor = int(time.time() // self.rotate_seconds) * lines
+        return self.format_headline(headlines[(cursor + line) % len(headlines)], truncate=False)
+    
+    def search(self, phrase):
+        """Pool headlines containing every word of phrase, from the index"""
+        pool = self.get_pool()
+        found = sorted(matches(pool['index'], phrase))
+        return [self.format_headline(pool['headlines'][position], truncate=False) for position in found]
 
-def main():
+def run(args, news_manager=None):
+    """Run a CLI command and return its output text"""
+    command = args[0].lower() if args else 'list'
+    with metrics.timer('conky_widget_command_seconds', component='news', command=command):
+        return _run_command(args, news_manager)
+
+def _run_command(args, news_manager):
+    if args and args[0].lower() == 'stats':
+        return metrics.format_stats('news')
+    
     try:
-        news_manager = SimpleNewsManager()
+        if news_manager is None:
+            news_manager = SimpleNewsManager()
         
-        if len(sys.argv) < 2:
+        if not args:
             # Default: return multiple headlines
-            headlines = news_manager.get_headlines_for_display(4)
-            for headline in headlines:
-                print(headline)
-            return
+            lines = news_manager.get_headlines_for_display(4)
+            return revalidate.mark("\n".join(lines), news_manager.served_stale)
         
-        command = sys.argv[1].lower()
+        command = args[0].lower()
         
         if command == 'list':
             # Show multiple headlines
-            num_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 4
-            headlines = news_manager.get_headlines_for_display(num_lines)
-            for headline in headlines:
-                print(headline)
+            num_lines = int(args[1]) if len(args) > 1 else 4
+            lines = news_manager.get_headlines_for_display(num_lines)
+            return revalidate.mark("\n".join(lines), news_manager.served_stale)
         
         elif command == 'single':
             # Show single headline by index
-            index = int(sys.argv[2]) if len(sys.argv) > 2 else 0
-            headline = news_manager.get_single_headline(index)
-            print(headline)
+            index = int(args[1]) if len(args) > 1 else 0
+            return revalidate.mark(news_manager.get_single_headline(index), news_manager.served_stale)
+        
+        elif command == 'rotate':
+            # Line N of a block that pages through the whole pool
+            line = int(args[1]) if len(args) > 1 else 0
+            lines = int(args[2]) if len(args) > 2 else 4
+            return revalidate.mark(news_manager.get_rotating_headline(line, lines), news_manager.served_stale)
+        
+        elif command == 'search':
+            # Headlines mentioning a keyword
+            found = news_manager.search(' '.join(args[1:]))
+            return "\n".join(found) if found else "No matching headlines"
+        
+        elif command == 'refresh':
+            # Background stale-while-revalidate job
+            return news_manager.refresh_all()
+        
+        elif command == 'schedule':
+            # Learned per-source polling intervals
+            return news_manager.poll_schedule()
         
         elif command == 'count':
             # Get total number of headlines available
             headlines = news_manager.get_all_headlines()
-            print(len(headlines))
+            return str(len(headlines))
         
         else:
-            print(f"Usage: {sys.argv[0]} [list|single|count] [number]")
+            return "Usage: news_simple.py [list|single|rotate|count|search|schedule|refresh|stats] [number]"
     
     except Exception as e:
-        print("News service temporarily unavailable")
+        metrics.record_error('news', e, 'run')
+        return "News service temporarily unavailable"
+
+def main():
+    print(run(sys.argv[1:]))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
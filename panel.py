@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Conky panel renderer
+Fills a whole section template (templates/<section>.conky) in one process,
+and generates conky.conf from templates/conky.conf.in with the update
+intervals and Python path from config.json
+
+Usage: panel.py render <section>
+       panel.py generate [output|-]
+"""
+
+import importlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+LAYOUT_TEMPLATE = os.path.join(TEMPLATES_DIR, 'conky.conf.in')
+
+# {{source command args}}, {{raw source command}} (no $ escaping),
+# {{section name}} and {{exec source command}} (generator only)
+PLACEHOLDER = re.compile(r'\{\{\s*(.*?)\s*\}\}')
+
+# placeholder source -> (module, manager class, script file, leading command)
+SOURCES = {
+    'trading212': ('trading212_api', 'CachedTrading212API', 'trading212_api.py', []),
+    'news': ('news_simple', 'SimpleNewsManager', 'news_simple.py', []),
+    'sun_moon': ('sun_moon', 'SunMoonManager', 'sun_moon.py', []),
+    'weather': ('market_weather', 'MarketWeatherManager', 'market_weather.py', ['weather']),
+    'currency': ('market_weather', 'MarketWeatherManager', 'market_weather.py', ['currency']),
+}
+
+# placeholder source -> key under conky.update_intervals
+SOURCE_INTERVALS = {
+    'trading212': 'trading212_seconds',
+    'news': 'news_seconds',
+    'sun_moon': 'sun_times_seconds',
+    'weather': 'weather_seconds',
+    'currency': 'currency_seconds',
+}
+
+# Seconds between the staggered execpi calls of one source in the layout
+EXEC_STAGGER = 2
+
+
+def escape_conky(text):
+    """Stop execpi from parsing $ in fetched text as a Conky variable"""
+    return text.replace('$', '$$')
+
+
+class PanelRenderer:
+    def __init__(self, config_path=None):
+        """Initialize with configuration"""
+        if config_path is None:
+            config_path = os.path.join(BASE_DIR, 'config.json')
+
+        with open(config_path, 'r') as f:
+            self.config = json.load(f)
+
+        self.managers = {}
+        self.modules = {}
+
+    def _source(self, name):
+        """(module, manager) for a script source, both created once per module"""
+        module_name, class_name = SOURCES[name][:2]
+        if module_name not in self.modules:
+            self.modules[module_name] = importlib.import_module(module_name)
+            # Construction errors (e.g. missing credentials) are reported by run()
+            try:
+                self.managers[module_name] = getattr(self.modules[module_name], class_name)()
+            except Exception:
+                self.managers[module_name] = None
+        return self.modules[module_name], self.managers[module_name]
+
+    @staticmethod
+    def load_template(section):
+        if not re.fullmatch(r'\w+', section):
+            raise ValueError(f"bad section name {section!r}")
+        with open(os.path.join(TEMPLATES_DIR, f"{section}.conky"), 'r') as f:
+            return f.read()
+
+    def value(self, words):
+        """Output text for one placeholder"""
+        source, args = words[0], words[1:]
+        if source not in SOURCES:
+            return f"Unknown source: {source}"
+
+        module, manager = self._source(source)
+        try:
+            return module.run(SOURCES[source][3] + args, manager)
+        except Exception:
+            return "N/A"
+
+    def render(self, section):
+        """Fill every placeholder of templates/<section>.conky"""
+        template = self.load_template(section)
+
+        def replace(match):
+            words = match.group(1).split()
+            if words and words[0] == 'raw':
+                return self.value(words[1:])
+            return escape_conky(self.value(words))
+
+        return PLACEHOLDER.sub(replace, template).rstrip('\n')
+
+    def command(self, script_args):
+        """Shell command Conky runs for one script call"""
+        conky_config = self.config.get('conky', {})
+        python = conky_config.get('python', 'python3')
+        script_dir = conky_config.get('script_dir', '~/.config/conky').rstrip('/')
+        if conky_config.get('use_daemon', True):
+            return f"{python} {script_dir}/widget_client.py {script_args}"
+        return f"{python} {script_dir}/{script_args}"
+
+    def interval(self, sources):
+        """Shortest configured update interval among the given sources"""
+        intervals = self.config.get('conky', {}).get('update_intervals', {})
+        values = [intervals[SOURCE_INTERVALS[source]] for source in sources
+                  if SOURCE_INTERVALS.get(source) in intervals]
+        return min(values) if values else 300
+
+    def section_sources(self, section):
+        """Placeholder sources used by a section template"""
+        sources = set()
+        for match in PLACEHOLDER.finditer(self.load_template(section)):
+            words = [word for word in match.group(1).split() if word != 'raw']
+            if words:
+                sources.add(words[0])
+        return sources
+
+    def generate(self):
+        """conky.conf text: one execpi per section, staggered execpi per exec line"""
+        with open(LAYOUT_TEMPLATE, 'r') as f:
+            layout = f.read()
+        exec_counts = {}
+
+        def replace(match):
+            words = match.group(1).split()
+            if words[0] == 'section':
+                section = words[1]
+                interval = self.interval(self.section_sources(section))
+                return f"${{execpi {interval} {self.command(f'panel.py render {section}')}}}"
+            if words[0] == 'exec':
+                source, args = words[1], words[2:]
+                count = exec_counts.get(source, 0)
+                exec_counts[source] = count + 1
+                interval = self.interval([source]) + EXEC_STAGGER * count
+                script_args = ' '.join([SOURCES[source][2]] + SOURCES[source][3] + args)
+                return f"${{execpi {interval} {self.command(script_args)}}}"
+            return match.group(0)
+
+        return PLACEHOLDER.sub(replace, layout)
+
+
+def run(args, renderer=None):
+    """Run a CLI command and return its output text"""
+    if len(args) < 2 and not (args and args[0] == 'generate'):
+        return "Usage: panel.py render <section> | generate [output|-]"
+
+    try:
+        if renderer is None:
+            renderer = PanelRenderer()
+
+        if args[0] == 'render':
+            return renderer.render(args[1])
+
+        elif args[0] == 'generate':
+            text = renderer.generate()
+            output = args[1] if len(args) > 1 else os.path.join(BASE_DIR, 'conky.conf')
+            if output == '-':
+                return text.rstrip('\n')
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)),
+                                            prefix=os.path.basename(output) + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    os.fchmod(f.fileno(), 0o644)  # mkstemp's 0600 would differ from a hand-written conky.conf
+                    f.write(text)
+                os.replace(tmp_file, output)
+            except OSError:
+                os.unlink(tmp_file)
+                raise
+            return f"Wrote {output}"
+
+        return "Usage: panel.py render <section> | generate [output|-]"
+
+    except (OSError, ValueError, KeyError) as e:
+        return f"Panel error: {e}"
+
+def main():
+    print(run(sys.argv[1:]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Portfolio history ring buffer for the Trading212 widget
+Fixed-size memory-mapped file of packed (timestamp, total, ppl, free, invested)
+records; the oldest point is overwritten once the buffer is full
+"""
+
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+
+MAGIC = b'T2HR'
+VERSION = 1
+# magic, version, capacity, count, next slot to write
+HEADER = struct.Struct('<4sIIII')
+RECORD = struct.Struct('<ddddd')
+
+# 4096 points is two weeks of 5-minute refreshes in 160 KB
+DEFAULT_CAPACITY = 4096
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+class _Timestamps:
+    """Sequence view of record timestamps, oldest first, for bisect"""
+
+    def __init__(self, history):
+        self.history = history
+
+    def __len__(self):
+        return self.history.header[1]
+
+    def __getitem__(self, index):
+        return self.history._record_at(index)[0]
+
+
+class PortfolioHistory:
+    """Reader/writer over the memory-mapped ring buffer
+
+    Writers are serialised by the caller (the Trading212 refresh lock). An
+    append holds an exclusive flock on the file and every read a shared
+    one, so a reader never sees a slot half overwritten once the buffer
+    has wrapped. The header (capacity, count, head) is kept in memory:
+    the writer updates it as it appends, readers re-read it once per read.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, writable=False):
+        self.path = path
+        self.writable = writable
+        self.map = None
+        self.fd = None
+        self.capacity = 0
+        self.header = (0, 0, 0)
+        if writable:
+            self._open_for_write(capacity)
+        else:
+            self._open_for_read()
+
+    def _open_for_read(self):
+        try:
+            self.fd = os.open(self.path, os.O_RDONLY)
+            self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.close()
+            return  # Missing or empty file: no history yet
+        if not self._valid_header():
+            self.close()
+
+    def _open_mapped(self):
+        """Map the file read-write, keeping the descriptor for flock"""
+        self.fd = os.open(self.path, os.O_RDWR)
+        self.map = mmap.mmap(self.fd, 0)
+        self.header = HEADER.unpack_from(self.map, 0)[2:]
+
+    def _open_for_write(self, capacity):
+        previous = []
+        if os.path.exists(self.path):
+            self._open_for_read()
+            if self.map is not None and self.capacity == capacity:
+                self.close()
+                self._open_mapped()
+                self.capacity = capacity
+                return
+            # Capacity changed (or unreadable file): keep the newest points
+            previous = self.last(capacity)
+            self.close()
+
+        tmp_file = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, capacity, 0, 0))
+            f.truncate(HEADER.size + capacity * RECORD.size)
+        os.replace(tmp_file, self.path)
+
+        self._open_mapped()
+        self.capacity = capacity
+        for point in previous:
+            self.append(*point)
+
+    def _valid_header(self):
+        if len(self.map) < HEADER.size:
+            return False
+        magic, version, capacity, _, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or len(self.map) < HEADER.size + capacity * RECORD.size:
+            return False
+        self.capacity = capacity
+        return True
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _read(self, read):
+        """read() under a shared lock, against a freshly read header"""
+        if self.map is None:
+            self.header = (0, 0, 0)
+            return read()
+        fcntl.flock(self.fd, fcntl.LOCK_SH)
+        try:
+            self.header = HEADER.unpack_from(self.map, 0)[2:]
+            return read()
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _record_at(self, index):
+        """The index-th point by the in-memory header (caller holds the lock)"""
+        capacity, count, head = self.header
+        slot = (head - count + index) % capacity
+        return RECORD.unpack_from(self.map, HEADER.size + slot * RECORD.size)
+
+    @property
+    def count(self):
+        return self._read(lambda: self.header[1])
+
+    def record(self, index):
+        """The index-th point, oldest first"""
+        return self._read(lambda: self._record_at(index))
+
+    def append(self, timestamp, total, ppl, free, invested):
+        capacity, count, head = self.header
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            RECORD.pack_into(self.map, HEADER.size + head * RECORD.size, timestamp, total, ppl, free, invested)
+            count, head = min(count + 1, capacity), (head + 1) % capacity
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, capacity, count, head)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.header = (capacity, count, head)
+
+    def last(self, n):
+        """The newest n points, oldest first"""
+        def read():
+            count = self.header[1]
+            return [self._record_at(i) for i in range(max(count - n, 0), count)]
+        return self._read(read)
+
+    def at_or_before(self, timestamp):
+        """The newest point taken at or before timestamp, or None"""
+        def read():
+            index = bisect.bisect_right(_Timestamps(self), timestamp)
+            return self._record_at(index - 1) if index else None
+        return self._read(read)
+
+
+def sparkline(values):
+    """Unicode block sparkline scaled between the min and max value"""
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return "".join(SPARK_CHARS[int(round((value - low) * scale))] for value in values)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Stale-while-revalidate helpers for the Conky widget scripts
+An expired value is printed straight away and a detached background process
+refreshes it. A per-name lock file keeps that to one refresh at a time
+across every process.
+
+Settings (config.json, "general"):
+  "stale_while_revalidate": true   serve expired values instead of blocking
+  "stale_marker": ""               appended to output served stale, e.g. "*"
+"""
+
+import fcntl
+import os
+import sys
+import time
+
+import widget_config
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# A refresh that failed is not retried for this many seconds
+RESPAWN_INTERVAL = 30
+
+
+def _build_settings(general):
+    return {
+        'enabled': general.get('stale_while_revalidate', True),
+        'marker': general.get('stale_marker', ''),
+    }
+
+
+def _load_settings():
+    return widget_config.settings(_build_settings)
+
+
+def enabled():
+    """Whether expired values are served while refreshing in the background"""
+    return _load_settings()['enabled']
+
+
+def mark(text, stale):
+    """Append the configured stale marker to text served from an expired cache"""
+    marker = _load_settings()['marker']
+    return f"{text}{marker}" if stale and marker else text
+
+
+def spawn_refresh(name, script, args):
+    """Run `python script args` detached, unless a refresh for name is running
+
+    The child inherits the locked file and holds the lock until it exits.
+    Returns True if a refresh was started.
+    """
+    lock_path = os.path.join(BASE_DIR, f'.{name}.refresh.lock')
+    try:
+        lock_fd = open(lock_path, 'a+')
+    except OSError:
+        return False
+
+    try:
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False  # Already refreshing
+
+        lock_fd.seek(0)
+        try:
+            last_spawn = float(lock_fd.read() or 0)
+        except ValueError:
+            last_spawn = 0
+        if time.time() - last_spawn < RESPAWN_INTERVAL:
+            return False
+        lock_fd.truncate(0)
+        lock_fd.write(f"{time.time():.0f}")
+        lock_fd.flush()
+
+        # Imported here: most runs never spawn anything
+        import subprocess
+        subprocess.Popen(
+            [sys.executable, os.path.join(BASE_DIR, script)] + list(args),
+            cwd=BASE_DIR,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            pass_fds=(lock_fd.fileno(),),
+        )
+        return True
+    except OSError:
+        return False
+    finally:
+        lock_fd.close()
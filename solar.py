@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Offline solar position engine (NOAA algorithm)
+Sunrise, sunset and twilight times for any date and location, no network needed
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+# Solar zenith angles (degrees) for each event
+ZENITH_SUNRISE = 90.833  # Refraction + solar disc radius
+ZENITH_CIVIL = 96.0
+ZENITH_NAUTICAL = 102.0
+ZENITH_ASTRONOMICAL = 108.0
+
+
+def julian_day(moment):
+    """Julian day for a timezone-aware datetime"""
+    moment = moment.astimezone(timezone.utc)
+    return moment.timestamp() / 86400.0 + 2440587.5
+
+
+class _ArrayMath:
+    """The math functions solar_parameters uses, over NumPy arrays"""
+
+    def __init__(self, np):
+        self.sin, self.cos, self.tan = np.sin, np.cos, np.tan
+        self.asin = np.arcsin
+        self.radians, self.degrees = np.radians, np.degrees
+
+
+def _load_numpy():
+    """numpy, or None if it isn't installed (only the batch table uses it)"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def solar_parameters(jd, ops=math):
+    """Solar declination (degrees) and equation of time (minutes) at a Julian day
+
+    jd may also be a NumPy array, with ops=_ArrayMath(numpy).
+    """
+    t = (jd - 2451545.0) / 36525.0
+
+    mean_long = (280.46646 + t * (36000.76983 + t * 0.0003032)) % 360
+    mean_anom = 357.52911 + t * (35999.05029 - 0.0001537 * t)
+    eccent = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+
+    m = ops.radians(mean_anom)
+    center = (ops.sin(m) * (1.914602 - t * (0.004817 + 0.000014 * t))
+              + ops.sin(2 * m) * (0.019993 - 0.000101 * t)
+              + ops.sin(3 * m) * 0.000289)
+
+    omega = ops.radians(125.04 - 1934.136 * t)
+    apparent_long = ops.radians(mean_long + center - 0.00569 - 0.00478 * ops.sin(omega))
+
+    mean_obliq = 23 + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+    obliq = ops.radians(mean_obliq + 0.00256 * ops.cos(omega))
+
+    declination = ops.degrees(ops.asin(ops.sin(obliq) * ops.sin(apparent_long)))
+
+    y = ops.tan(obliq / 2) ** 2
+    l0 = ops.radians(mean_long)
+    eq_time = 4 * ops.degrees(
+        y * ops.sin(2 * l0)
+        - 2 * eccent * ops.sin(m)
+        + 4 * eccent * y * ops.sin(m) * ops.cos(2 * l0)
+        - 0.5 * y * y * ops.sin(4 * l0)
+        - 1.25 * eccent * eccent * ops.sin(2 * m)
+    )
+    return declination, eq_time
+
+
+def _hour_angle(latitude, declination, zenith):
+    """Hour angle (degrees) of the event, or None if the sun never reaches it"""
+    lat = math.radians(latitude)
+    dec = math.radians(declination)
+    cos_ha = (math.cos(math.radians(zenith)) / (math.cos(lat) * math.cos(dec))
+              - math.tan(lat) * math.tan(dec))
+    if cos_ha < -1 or cos_ha > 1:
+        return None
+    return math.degrees(math.acos(cos_ha))
+
+
+def _utc_midnight(day):
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+def event_times(day, latitude, longitude, zenith=ZENITH_SUNRISE):
+    """UTC (rising, setting) datetimes for a zenith angle on a calendar date
+
+    Either value is None when the sun stays above or below that zenith all
+    day (polar day/night). Each event is refined once at its own time.
+    """
+    midnight = _utc_midnight(day)
+    results = []
+    for direction in (-1, 1):
+        minutes = 720 - 4 * longitude  # First guess: mean solar noon
+        for _ in range(2):
+            jd = julian_day(midnight + timedelta(minutes=minutes))
+            declination, eq_time = solar_parameters(jd)
+            hour_angle = _hour_angle(latitude, declination, zenith)
+            if hour_angle is None:
+                minutes = None
+                break
+            minutes = 720 - 4 * (longitude - direction * hour_angle) - eq_time
+        results.append(None if minutes is None else midnight + timedelta(minutes=minutes))
+    return results[0], results[1]
+
+
+def solar_noon(day, longitude):
+    """UTC datetime of solar noon"""
+    midnight = _utc_midnight(day)
+    minutes = 720 - 4 * longitude
+    for _ in range(2):
+        _, eq_time = solar_parameters(julian_day(midnight + timedelta(minutes=minutes)))
+        minutes = 720 - 4 * longitude - eq_time
+    return midnight + timedelta(minutes=minutes)
+
+
+def sun_times(day, latitude, longitude, tz):
+    """Local sunrise/sunset/twilight datetimes for a date
+
+    Returns a dict of timezone-aware datetimes in tz (None where the event
+    does not occur) plus 'day_length' as a timedelta.
+    """
+    times = {}
+    for name, zenith in (('sun', ZENITH_SUNRISE),
+                         ('civil', ZENITH_CIVIL),
+                         ('nautical', ZENITH_NAUTICAL),
+                         ('astronomical', ZENITH_ASTRONOMICAL)):
+        rising, setting = event_times(day, latitude, longitude, zenith)
+        times[name] = (rising.astimezone(tz) if rising else None,
+                       setting.astimezone(tz) if setting else None)
+
+    sunrise, sunset = times['sun']
+    if sunrise and sunset:
+        day_length = sunset - sunrise
+    else:
+        day_length = polar_day_length(day, latitude, longitude)
+
+    return {
+        'sunrise': sunrise,
+        'sunset': sunset,
+        'solar_noon': solar_noon(day, longitude).astimezone(tz),
+        'day_length': day_length,
+        'civil_dawn': times['civil'][0],
+        'civil_dusk': times['civil'][1],
+        'nautical_dawn': times['nautical'][0],
+        'nautical_dusk': times['nautical'][1],
+        'astronomical_dawn': times['astronomical'][0],
+        'astronomical_dusk': times['astronomical'][1],
+    }
+
+
+def polar_day_length(day, latitude, longitude):
+    """24h or 0 for a day without sunrise/sunset: up all day if the sun is above the horizon at noon"""
+    declination, _ = solar_parameters(julian_day(solar_noon(day, longitude)))
+    return timedelta(hours=24) if abs(latitude - declination) < 90 else timedelta(0)
+
+
+def event_table(days, latitudes, longitudes, zenith=ZENITH_SUNRISE):
+    """UTC (rising, setting) datetimes for every location x day
+
+    Returns two lists with one row per location and one column per day;
+    None where the event does not happen. With NumPy every cell is solved
+    in one vectorised pass, otherwise each goes through event_times.
+    """
+    np = _load_numpy()
+    if np is None:
+        rows = [[event_times(day, latitude, longitude, zenith) for day in days]
+                for latitude, longitude in zip(latitudes, longitudes)]
+        return ([[cell[0] for cell in row] for row in rows],
+                [[cell[1] for cell in row] for row in rows])
+
+    ops = _ArrayMath(np)
+    lat = np.radians(np.asarray(latitudes, dtype=float))[:, None]
+    lon = np.asarray(longitudes, dtype=float)[:, None]
+    jd_midnight = np.array([julian_day(_utc_midnight(day)) for day in days])[None, :]
+    shape = (len(latitudes), len(days))
+
+    results = []
+    for direction in (-1, 1):
+        minutes = np.broadcast_to(720 - 4 * lon, shape)
+        valid = np.ones(shape, dtype=bool)
+        for _ in range(2):
+            declination, eq_time = solar_parameters(jd_midnight + minutes / 1440.0, ops)
+            dec = np.radians(declination)
+            cos_ha = math.cos(math.radians(zenith)) / (np.cos(lat) * np.cos(dec)) - np.tan(lat) * np.tan(dec)
+            valid &= np.abs(cos_ha) <= 1
+            hour_angle = np.degrees(np.arccos(np.clip(cos_ha, -1, 1)))
+            minutes = 720 - 4 * (lon - direction * hour_angle) - eq_time
+        results.append([
+            [_utc_midnight(day) + timedelta(minutes=value) if ok else None
+             for day, value, ok in zip(days, row, valid_row)]
+            for row, valid_row in zip(minutes.tolist(), valid.tolist())
+        ])
+    return results[0], results[1]
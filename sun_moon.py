@@ -4,11 +4,23 @@ Conky Sun/Moon Times - Clean version with shared config
 Provides sunrise, sunset, and moon phase information
 """
 
-import requests
 import sys
 import json
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
+
+import http_client
+import lunar
+import metrics
+import solar
+from widget_cache import WidgetCache
+
+# Days shown by `table` unless --days is given, and the most it will compute
+DEFAULT_TABLE_DAYS = 7
+MAX_TABLE_DAYS = 366
+# Computed table rows stay valid; this only bounds how long unused ones are kept
+TABLE_TTL = 30 * 86400
 
 class SunMoonManager:
     def __init__(self, config_path=None):
@@ -21,13 +33,74 @@ class SunMoonManager:
         
         self.location = self.config['location']
         self.api_url = self.config['sun_moon']['api_url']
+        self._tz = None
+        self.cache = WidgetCache('sun_moon')
+        self.phase_table = None
+    
+    @property
+    def tz(self):
+        """The main location's timezone, loaded on first use (the moon commands never need it)"""
+        if self._tz is None:
+            self._tz = self.get_timezone()
+        return self._tz
+    
+    def get_timezone(self, location=None):
+        """Configured IANA timezone, falling back to the fixed offset"""
+        location = location or self.location
+        name = location.get('timezone')
+        if name:
+            try:
+                from zoneinfo import ZoneInfo
+                return ZoneInfo(name)
+            except Exception:
+                pass  # Python < 3.9, unknown zone or no tz database installed
+        return timezone(timedelta(hours=location.get('timezone_offset_hours', 0)))
+    
+    @staticmethod
+    def format_time(moment):
+        return moment.strftime('%H:%M') if moment else "--:--"
+    
+    @staticmethod
+    def format_duration(duration):
+        """H:MM:SS, without microseconds or a '1 day' prefix"""
+        seconds = int(duration.total_seconds())
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    
+    def get_sun_times(self, day=None):
+        """Calculate sunrise, sunset and twilight times locally"""
+        try:
+            if day is None:
+                day = datetime.now(self.tz).date()
+            
+            times = solar.sun_times(day, self.location['latitude'], self.location['longitude'], self.tz)
+            
+            return {
+                'sunrise': self.format_time(times['sunrise']),
+                'sunset': self.format_time(times['sunset']),
+                'day_length': self.format_duration(times['day_length']),
+                'solar_noon': self.format_time(times['solar_noon']),
+                'civil_dawn': self.format_time(times['civil_dawn']),
+                'civil_dusk': self.format_time(times['civil_dusk']),
+                'nautical_dawn': self.format_time(times['nautical_dawn']),
+                'nautical_dusk': self.format_time(times['nautical_dusk']),
+            }
+        
+        except Exception as e:
+            metrics.record_error('sun_moon', e, 'solar')
+            return "Calculation Error"
     
-    def get_sun_times(self):
-        """Fetch sunrise and sunset times"""
+    def get_api_sun_times(self):
+        """Fetch sunrise and sunset times from the remote API (cross-check only)"""
+        key = f"api:{datetime.now(self.tz).date().isoformat()}"
+        cached = self.cache.get(key)
+        if cached:
+            return cached
+        
         try:
             url = f"{self.api_url}?lat={self.location['latitude']}&lng={self.location['longitude']}&formatted=0"
             
-            response = requests.get(url, timeout=10)
+            with metrics.timer('conky_widget_fetch_seconds', component='sun_moon', target='sunrise-sunset'):
+                response = http_client.get(url)
             response.raise_for_status()
             
             data = response.json()
@@ -40,81 +113,234 @@ class SunMoonManager:
             sunset_utc = datetime.fromisoformat(data['results']['sunset'].replace('Z', '+00:00'))
             
             # Convert to local time
-            local_offset = timedelta(hours=self.location['timezone_offset_hours'])
+            sunrise_local = sunrise_utc.astimezone(self.tz)
+            sunset_local = sunset_utc.astimezone(self.tz)
             
-            sunrise_local = sunrise_utc + local_offset
-            sunset_local = sunset_utc + local_offset
-            
-            return {
+            times = {
                 'sunrise': sunrise_local.strftime('%H:%M'),
                 'sunset': sunset_local.strftime('%H:%M'),
                 'day_length': str(sunset_local - sunrise_local).split('.')[0]  # Remove microseconds
             }
+            self.cache.put(key, times)
+            return times
         
         except Exception as e:
+            metrics.record_error('sun_moon', e, 'sunrise-sunset')
             return "Network Error"
     
+    def check_against_api(self):
+        """Compare local sunrise/sunset with the remote API"""
+        local = self.get_sun_times()
+        remote = self.get_api_sun_times()
+        if isinstance(remote, str) or isinstance(local, str):
+            return remote if isinstance(remote, str) else local
+        
+        def minutes(hhmm):
+            hours, mins = hhmm.split(':')
+            return int(hours) * 60 + int(mins)
+        
+        diffs = [minutes(local[key]) - minutes(remote[key]) for key in ('sunrise', 'sunset')]
+        status = "OK" if all(abs(diff) <= 2 for diff in diffs) else "MISMATCH"
+        return (f"{status} local ↑{local['sunrise']} ↓{local['sunset']} | "
+                f"api ↑{remote['sunrise']} ↓{remote['sunset']}")
+    
+    def get_phase_table(self, year):
+        """Lunar phase events for a year, kept in memory and in the widget cache"""
+        if self.phase_table is None or self.phase_table.year != year:
+            self.phase_table = lunar.PhaseTable.load(year, self.cache)
+        return self.phase_table
+    
+    def get_moon_info(self, timestamp=None):
+        """Moon phase name, illumination, age and next new/full moon"""
+        if timestamp is None:
+            timestamp = time.time()
+        year = time.gmtime(timestamp).tm_year
+        return self.get_phase_table(year).moon_info(timestamp)
+    
     def get_moon_phase(self):
-        """Get current moon phase (simple calculation)"""
+        """Get current moon phase name"""
         try:
-            # Simple moon phase calculation
-            now = datetime.now()
-            # Known new moon date (update periodically for accuracy)
-            known_new_moon = datetime(2024, 1, 11)
-            days_since = (now - known_new_moon).days
-            lunar_cycle = 29.53059  # Average lunar cycle in days
-            
-            phase = (days_since % lunar_cycle) / lunar_cycle
-            
-            if phase < 0.0625:
-                return "New Moon"
-            elif phase < 0.1875:
-                return "Waxing Crescent"
-            elif phase < 0.3125:
-                return "First Quarter"
-            elif phase < 0.4375:
-                return "Waxing Gibbous"
-            elif phase < 0.5625:
-                return "Full Moon"
-            elif phase < 0.6875:
-                return "Waning Gibbous"
-            elif phase < 0.8125:
-                return "Third Quarter"
-            else:
-                return "Waning Crescent"
-        except:
+            return self.get_moon_info()['name']
+        except Exception as e:
+            metrics.record_error('sun_moon', e, 'lunar')
             return "Unknown"
+    
+    def format_event(self, timestamp):
+        """Local date and time of a phase event"""
+        return datetime.fromtimestamp(timestamp, self.tz).strftime('%d %b %H:%M')
+    
+    def get_locations(self, names=None):
+        """The main location plus sun_moon.locations, or just the named ones"""
+        locations = [self.location] + [location for location in self.config['sun_moon'].get('locations', [])
+                                       if location['name'] != self.location['name']]
+        if not names:
+            return locations
+        
+        by_name = {location['name'].lower(): location for location in locations}
+        selected = []
+        for name in names:
+            if name.lower() not in by_name:
+                raise ValueError(f"unknown location {name!r}")
+            selected.append(by_name[name.lower()])
+        return selected
+    
+    def get_table(self, days=DEFAULT_TABLE_DAYS, names=None):
+        """{location name: [(date, sunrise, sunset, day length, moon phase), ...]} from today
+        
+        Each location starts from its own local today. Rows come from its
+        precomputed table in the widget cache; locations missing any of their
+        days are computed in one solar.event_table pass per distinct date
+        range (usually one) and stored back.
+        """
+        locations = self.get_locations(names)
+        
+        zones = {}
+        dates = {}
+        tables = {}
+        missing = {}
+        for location in locations:
+            name = location['name']
+            zones[name] = self.get_timezone(location)
+            today = datetime.now(zones[name]).date()
+            dates[name] = tuple(today + timedelta(days=offset) for offset in range(days))
+            table = self.cache.get(self.table_key(location, zones[name])) or {}
+            tables[name] = table
+            if any(day.isoformat() not in table for day in dates[name]):
+                missing.setdefault(dates[name], []).append(location)
+        
+        for group_dates, group in missing.items():
+            rising, setting = solar.event_table(group_dates, [location['latitude'] for location in group],
+                                                [location['longitude'] for location in group])
+            # The phase depends only on the instant; noon UTC stands for the day
+            moons = [self.get_moon_info(datetime(day.year, day.month, day.day, 12, tzinfo=timezone.utc).timestamp())['name']
+                     for day in group_dates]
+            for i, location in enumerate(group):
+                tz = zones[location['name']]
+                table = {key: row for key, row in tables[location['name']].items()
+                         if key >= group_dates[0].isoformat()}
+                for j, day in enumerate(group_dates):
+                    sunrise, sunset = rising[i][j], setting[i][j]
+                    if sunrise and sunset:
+                        length = sunset - sunrise
+                    else:
+                        length = solar.polar_day_length(day, location['latitude'], location['longitude'])
+                    table[day.isoformat()] = [
+                        self.format_time(sunrise.astimezone(tz) if sunrise else None),
+                        self.format_time(sunset.astimezone(tz) if sunset else None),
+                        self.format_duration(length)[:-3],  # H:MM
+                        moons[j],
+                    ]
+                tables[location['name']] = table
+                self.cache.put(self.table_key(location, tz), table, ttl=TABLE_TTL)
+        
+        return {location['name']: [(day, *tables[location['name']][day.isoformat()]) for day in dates[location['name']]]
+                for location in locations}
+    
+    @staticmethod
+    def table_key(location, tz):
+        # Coordinates and timezone are part of the key so editing a location recomputes it
+        return f"table:{location['name']}:{location['latitude']},{location['longitude']}:{tz}"
+    
+    @staticmethod
+    def format_table(table):
+        """One block per location, one line per day"""
+        lines = []
+        for name, rows in table.items():
+            lines.append(name)
+            for day, sunrise, sunset, length, moon in rows:
+                lines.append(f"  {day:%a %d %b} ↑{sunrise} ↓{sunset} {length:>5} {moon}")
+        return "\n".join(lines)
 
-def main():
+
+def parse_table_args(args):
+    """(days, location names) from `--days N --locations A B` (names may also be comma-separated)"""
+    days = DEFAULT_TABLE_DAYS
+    names = []
+    option = None
+    for arg in args:
+        if arg in ('--days', '--locations'):
+            option = arg
+        elif option == '--days':
+            days = int(arg)
+            option = None
+        elif option == '--locations':
+            names.extend(name for name in arg.split(',') if name)
+        else:
+            raise ValueError(f"unexpected argument {arg!r}")
+    return min(max(days, 1), MAX_TABLE_DAYS), names
+
+USAGE = ("Usage: sun_moon.py [sunrise|sunset|day_length|solar_noon|civil_dawn|civil_dusk|"
+         "nautical_dawn|nautical_dusk|twilight|moon|moon_illumination|moon_age|"
+         "moon_phase_angle|next_new|next_full|all|check|stats|"
+         "table [--days N] [--locations NAME ...]]")
+
+# Commands that print one field of get_sun_times() as-is
+SUN_FIELDS = ('sunrise', 'sunset', 'day_length', 'solar_noon', 'civil_dawn',
+              'civil_dusk', 'nautical_dawn', 'nautical_dusk')
+
+def run(args, manager=None):
+    """Run a CLI command and return its output text"""
+    command = args[0].lower() if args else ''
+    with metrics.timer('conky_widget_command_seconds', component='sun_moon', command=command):
+        return _run_command(args, manager)
+
+def _run_command(args, manager):
     try:
-        manager = SunMoonManager()
+        if manager is None:
+            manager = SunMoonManager()
         
-        if len(sys.argv) < 2:
-            print("Usage: sun_moon.py [sunrise|sunset|day_length|moon|all]")
-            sys.exit(1)
+        if not args:
+            return USAGE
+        
+        command = args[0].lower()
+        if command == 'stats':
+            return metrics.format_stats('sun_moon')
+        if command == 'check':
+            return manager.check_against_api()
+        if command == 'table':
+            try:
+                days, names = parse_table_args(args[1:])
+                return manager.format_table(manager.get_table(days, names))
+            except ValueError as e:
+                return f"Table error: {e}"
+        
+        # Moon commands are pure calculation - no sun times needed
+        if command == 'moon':
+            return manager.get_moon_phase()
+        elif command.startswith('moon_') or command in ('next_new', 'next_full'):
+            moon = manager.get_moon_info()
+            if command == 'moon_illumination':
+                return f"{moon['illumination'] * 100:.0f}%"
+            elif command == 'moon_age':
+                return f"{moon['age_days']:.1f} days"
+            elif command == 'moon_phase_angle':
+                return f"{moon['phase_angle']:.0f}°"
+            elif command in ('next_new', 'next_full'):
+                return manager.format_event(moon[command])
+            return f"Unknown command: {command}"
         
-        command = sys.argv[1].lower()
         sun_data = manager.get_sun_times()
         
         if isinstance(sun_data, str):  # Error occurred
-            print(sun_data)
-            return
-        
-        if command == 'sunrise':
-            print(sun_data['sunrise'])
-        elif command == 'sunset':
-            print(sun_data['sunset'])
-        elif command == 'day_length':
-            print(sun_data['day_length'])
-        elif command == 'moon':
-            print(manager.get_moon_phase())
+            return sun_data
+        
+        if command in SUN_FIELDS:
+            return sun_data[command]
+        elif command == 'twilight':
+            return f"{sun_data['civil_dawn']}-{sun_data['civil_dusk']}"
         elif command == 'all':
-            print(f"↑{sun_data['sunrise']} ↓{sun_data['sunset']} ({sun_data['day_length']})")
+            return f"↑{sun_data['sunrise']} ↓{sun_data['sunset']} ({sun_data['day_length']})"
         else:
-            print(f"Unknown command: {command}")
+            return f"Unknown command: {command}"
     
     except Exception as e:
-        print("Sun/Moon service unavailable")
+        metrics.record_error('sun_moon', e, 'run')
+        return "Sun/Moon service unavailable"
+
+def main():
+    print(run(sys.argv[1:]))
+    if len(sys.argv) < 2:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Tests for the merged headline pool"""
+
+import unittest
+
+from headline_pool import build_pool, dedup_key, matches
+
+
+def titles(pool):
+    return [headline['title'] for headline in pool['headlines']]
+
+
+class DedupKeyTest(unittest.TestCase):
+    def test_ignores_case_order_punctuation_and_stopwords(self):
+        self.assertEqual(dedup_key("PM's speech on the economy"), dedup_key("Economy: PMs speech"))
+
+    def test_different_stories_differ(self):
+        self.assertNotEqual(dedup_key("Rates rise"), dedup_key("Rates fall"))
+
+
+class BuildPoolTest(unittest.TestCase):
+    FEEDS = [
+        ('bbc', ["Storm hits coast", "Rates rise again", "Football final tonight"]),
+        ('sky', ["The storm hits the coast", "Election called"]),
+    ]
+
+    def test_interleaves_sources_and_drops_duplicates(self):
+        pool = build_pool(self.FEEDS)
+        self.assertEqual(titles(pool), ["Storm hits coast", "Rates rise again",
+                                        "Election called", "Football final tonight"])
+        self.assertEqual([headline['source'] for headline in pool['headlines']], ['BBC', 'BBC', 'SKY', 'BBC'])
+
+    def test_skips_empty_titles_and_sources(self):
+        pool = build_pool([('bbc', ["", "Rates rise"]), ('sky', [])])
+        self.assertEqual(titles(pool), ["Rates rise"])
+        self.assertEqual(build_pool([])['headlines'], [])
+
+    def test_include_and_exclude(self):
+        self.assertEqual(titles(build_pool(self.FEEDS, include=['storm', 'election'])),
+                         ["Storm hits coast", "Election called"])
+        self.assertEqual(titles(build_pool(self.FEEDS, exclude=['football', 'rates rise'])),
+                         ["Storm hits coast", "Election called"])
+
+    def test_rank_orders_by_weight_keeping_ties_stable(self):
+        pool = build_pool(self.FEEDS, rank={'football': 2, 'rates': 1, 'election': 1})
+        self.assertEqual(titles(pool), ["Football final tonight", "Rates rise again",
+                                        "Election called", "Storm hits coast"])
+
+    def test_index_matches_ranked_positions(self):
+        pool = build_pool(self.FEEDS, rank={'election': 5})
+        self.assertEqual(matches(pool['index'], 'election'), {0})
+        self.assertEqual(matches(pool['index'], 'storm coast'), {1})
+        self.assertEqual(matches(pool['index'], 'storm election'), set())
+        self.assertEqual(matches(pool['index'], '...'), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
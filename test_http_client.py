@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Tests for the shared per-host circuit breaker"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import http_client
+
+HOST = 'api.example.com'
+URL = f'https://{HOST}/feed'
+OTHER_URL = f'https://{HOST}/other'
+
+SETTINGS = {
+    'user_agent': 'test',
+    'timeout': (1, 1),
+    'circuit_failures': 3,
+    'circuit_cooloff': 60,
+    'circuit_max_cooloff': 600,
+    'negative_ttl': 30,
+}
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.now = 1000.0
+        for target, value in (('CIRCUIT_FILE', os.path.join(self.directory.name, 'circuits.json')),
+                              ('_load_settings', lambda: SETTINGS)):
+            patcher = mock.patch.object(http_client, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('http_client.time.time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail(self, url=URL):
+        http_client._record_result(HOST, url, failed=True)
+
+    def test_closed_until_threshold(self):
+        self.fail()
+        self.fail()
+        self.assertFalse(http_client.is_blocked(OTHER_URL))
+        http_client._before_request(HOST, OTHER_URL, 5)
+
+    def test_failed_url_is_negatively_cached(self):
+        self.fail()
+        self.assertTrue(http_client.is_blocked(URL))
+        with self.assertRaises(http_client.CircuitOpenError):
+            http_client._before_request(HOST, URL, 5)
+        self.now += 31
+        http_client._before_request(HOST, URL, 5)
+
+    def test_opens_after_threshold(self):
+        for _ in range(3):
+            self.fail()
+        self.assertTrue(http_client.is_blocked(OTHER_URL))
+        with self.assertRaises(http_client.CircuitOpenError):
+            http_client._before_request(HOST, OTHER_URL, 5)
+
+    def test_half_open_allows_one_probe(self):
+        for _ in range(3):
+            self.fail()
+        self.now += 61
+        http_client._before_request(HOST, OTHER_URL, 5)
+        with self.assertRaises(http_client.CircuitOpenError):
+            http_client._before_request(HOST, OTHER_URL, 5)
+        self.now += 6
+        http_client._before_request(HOST, OTHER_URL, 5)  # The first probe timed out
+
+    def test_successful_probe_closes(self):
+        for _ in range(3):
+            self.fail()
+        self.now += 61
+        http_client._before_request(HOST, OTHER_URL, 5)
+        http_client._record_result(HOST, OTHER_URL, failed=False)
+        self.assertEqual(http_client._load_circuits().get('hosts'), {})
+        http_client._before_request(HOST, OTHER_URL, 5)
+
+    def test_failed_probe_doubles_cooloff(self):
+        for _ in range(3):
+            self.fail()
+        self.now += 61
+        http_client._before_request(HOST, OTHER_URL, 5)
+        self.fail(OTHER_URL)
+        circuit = http_client._load_circuits()['hosts'][HOST]
+        self.assertEqual(circuit['cooloff'], 120)
+        self.assertEqual(circuit['open_until'], self.now + 120)
+
+    def test_cooloff_is_capped(self):
+        for _ in range(3):
+            self.fail()
+        for _ in range(6):
+            self.now = http_client._load_circuits()['hosts'][HOST]['open_until'] + 1
+            self.fail()
+        self.assertEqual(http_client._load_circuits()['hosts'][HOST]['cooloff'], 600)
+
+    def test_late_failed_probe_keeps_circuit_open(self):
+        # A probe failing more than circuit_max_cooloff after the last
+        # failure must not count as the first failure of a new outage
+        for _ in range(3):
+            self.fail()
+        for _ in range(4):
+            self.now = http_client._load_circuits()['hosts'][HOST]['open_until'] + 1
+            self.fail()
+        self.now += 700
+        http_client._before_request(HOST, OTHER_URL, 5)
+        self.fail(OTHER_URL)
+        circuit = http_client._load_circuits()['hosts'][HOST]
+        self.assertEqual(circuit['cooloff'], 600)
+        self.assertEqual(circuit['open_until'], self.now + 600)
+        self.assertTrue(http_client.is_blocked(OTHER_URL))
+
+    def test_idle_failures_reset_while_closed(self):
+        self.fail()
+        self.fail()
+        self.now += 601
+        self.fail(OTHER_URL)
+        self.assertEqual(http_client._load_circuits()['hosts'][HOST]['failures'], 1)
+
+    def test_stream_errors_count_as_failures(self):
+        import requests
+        for error in (TimeoutError("deadline"), requests.exceptions.ConnectionError("read timed out"),
+                      requests.exceptions.ChunkedEncodingError("broken")):
+            http_client.record_stream_error(URL, error)
+        http_client.record_stream_error(URL, ValueError("not a transport error"))
+        self.assertEqual(http_client._load_circuits()['hosts'][HOST]['failures'], 3)
+        self.assertTrue(http_client.is_blocked(OTHER_URL))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Tests for the Meeus lunar phase engine against published phase times"""
+
+import calendar
+import unittest
+
+import lunar
+
+
+def utc(year, month, day, hour, minute, second=0):
+    return calendar.timegm((year, month, day, hour, minute, second))
+
+
+# Published phase times (UTC) for January 2026
+JANUARY_2026 = [
+    (utc(2026, 1, 3, 10, 3), lunar.FULL_MOON),
+    (utc(2026, 1, 10, 15, 48), lunar.LAST_QUARTER),
+    (utc(2026, 1, 18, 19, 52), lunar.NEW_MOON),
+    (utc(2026, 1, 26, 4, 47), lunar.FIRST_QUARTER),
+]
+
+
+class PhaseTimeTest(unittest.TestCase):
+    def test_meeus_example(self):
+        # Meeus, Astronomical Algorithms, example 49.a: 1977 Feb 18 03:37:42 TD
+        expected = utc(1977, 2, 18, 3, 37, 42) - lunar.DELTA_T_SECONDS
+        self.assertAlmostEqual(lunar.phase_time(-283), expected, delta=10)
+
+    def test_january_2026(self):
+        times, codes = lunar.build_phase_table(2026)
+        for expected, code in JANUARY_2026:
+            i = min(range(len(times)), key=lambda i: abs(times[i] - expected))
+            self.assertEqual(codes[i], code)
+            self.assertLessEqual(abs(times[i] - expected), 90)
+
+    def test_table_covers_year_boundaries(self):
+        times, codes = lunar.build_phase_table(2026)
+        self.assertLess(times[0], utc(2025, 12, 1, 0, 0))
+        self.assertGreater(times[-1], utc(2027, 1, 31, 0, 0))
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(codes[:8], [(codes[0] + i) % 4 for i in range(8)])
+
+
+class MoonInfoTest(unittest.TestCase):
+    def setUp(self):
+        self.table = lunar.PhaseTable(2026, *lunar.build_phase_table(2026))
+
+    def test_full_moon(self):
+        info = self.table.moon_info(JANUARY_2026[0][0])
+        self.assertEqual(info['name'], "Full Moon")
+        self.assertGreater(info['illumination'], 0.99)
+        self.assertLess(info['phase_angle'], 5)
+
+    def test_new_moon(self):
+        info = self.table.moon_info(JANUARY_2026[2][0] + 3600)
+        self.assertEqual(info['name'], "New Moon")
+        self.assertLess(info['illumination'], 0.01)
+        self.assertLess(info['age_days'], 0.1)
+
+    def test_span_names_and_next_events(self):
+        info = self.table.moon_info(utc(2026, 1, 14, 12, 0))
+        self.assertEqual(info['name'], "Waning Crescent")
+        self.assertAlmostEqual(info['next_new'], JANUARY_2026[2][0], delta=90)
+        self.assertGreater(info['next_full'], utc(2026, 1, 31, 0, 0))
+        self.assertEqual(self.table.moon_info(utc(2026, 1, 22, 0, 0))['name'], "Waxing Crescent")
+
+
+if __name__ == '__main__':
+    unittest.main()
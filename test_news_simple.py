@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Tests for the streaming feed reader, fetch deadlines, cached fallbacks and poll scheduling"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+import xml.etree.ElementTree as ET
+from unittest import mock
+from urllib.parse import urlsplit
+
+import http_client
+import news_simple
+import revalidate
+import widget_cache
+from news_simple import SimpleNewsManager
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench')
+sys.path.insert(0, BENCH_DIR)
+from fake_server import FIXTURES_DIR, FaultProfile, start_server  # noqa: E402
+
+SOURCES = ('bbc', 'guardian', 'sky', 'malformed')
+
+
+def fixture_titles(name, count=news_simple.CACHED_ITEMS_PER_SOURCE):
+    root = ET.parse(os.path.join(FIXTURES_DIR, name)).getroot()
+    return [news_simple.clean_title(item.findtext('title')) for item in root.iter('item')][:count]
+
+
+class NewsTestCase(unittest.TestCase):
+    """A fake server for the feeds, and scratch cache and circuit files"""
+
+    def faults(self):
+        return FaultProfile()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.server = start_server(self.faults())
+        self.addCleanup(self.server.shutdown)
+        for target, name, value in (
+                (widget_cache, 'CACHE_DIR', os.path.join(self.directory.name, 'cache')),
+                (http_client, 'CIRCUIT_FILE', os.path.join(self.directory.name, 'circuits.json')),
+                (revalidate, 'enabled', lambda: False)):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.news = self.make_manager()
+
+    def url(self, source):
+        return f"{self.server.base_url}/feeds/{source}.xml"
+
+    def make_manager(self, sources=SOURCES, **news):
+        path = os.path.join(self.directory.name, 'config.json')
+        news['sources'] = {source: self.url(source) for source in sources}
+        with open(path, 'w') as f:
+            json.dump({'news': news}, f)
+        return SimpleNewsManager(path)
+
+    def requests_to(self, source):
+        return self.server.stats.snapshot()['routes'].get(f"/feeds/{source}.xml", {}).get('requests', 0)
+
+
+class StreamTitlesTest(NewsTestCase):
+    def test_stops_after_the_first_items(self):
+        result = self.news.stream_titles(self.url('bbc'))
+        self.assertEqual(result['titles'], fixture_titles('bbc.xml'))
+        self.assertEqual(len(result['dates']), news_simple.CACHED_ITEMS_PER_SOURCE)
+        self.assertEqual(result['status'], 200)
+        self.assertLess(result['bytes'], os.path.getsize(os.path.join(FIXTURES_DIR, 'bbc.xml')))
+
+    def test_matches_feedparser(self):
+        streamed = self.news.stream_titles(self.url('guardian'))
+        parsed = self.news.parse_titles(self.url('guardian'))
+        self.assertEqual(streamed['titles'], parsed['titles'])
+        self.assertEqual(streamed['dates'], parsed['dates'])
+
+    def test_unchanged_feed_answers_304(self):
+        result = self.news.stream_titles(self.url('bbc'))
+        again = self.news.stream_titles(self.url('bbc'), etag=result['etag'])
+        self.assertEqual((again['status'], again['titles']), (304, []))
+
+    def test_malformed_feed_falls_back_to_feedparser(self):
+        result = self.news.stream_titles(self.url('malformed'))
+        self.assertEqual(result['titles'], ["Rail fares rise as council budget is agreed",
+                                            "Fish & chip shops warn over energy prices",
+                                            "Storm closes coastal roads overnight"])
+        self.assertEqual(len(result['dates']), 3)
+        self.assertEqual(result['status'], 200)
+
+
+class DeadlineTest(NewsTestCase):
+    def faults(self):
+        # guardian answers at once but sends 1 KB every 50 ms; sky takes 2 s to answer
+        return FaultProfile(drip_routes={'/feeds/guardian': 50}, slow_routes={'/feeds/sky': 2000})
+
+    def test_slow_body_stops_at_the_deadline(self):
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.news.stream_titles(self.url('guardian'), deadline=started + 0.3)
+        self.assertLess(time.monotonic() - started, 1)
+        circuit = http_client._load_circuits()['hosts'][urlsplit(self.server.base_url).netloc]
+        self.assertEqual(circuit['failures'], 1)
+        self.assertTrue(http_client.is_blocked(self.url('guardian')))
+
+    def test_source_deadline_drops_a_slow_body(self):
+        news = self.make_manager(source_timeout_seconds=0.3, overall_timeout_seconds=5)
+        started = time.monotonic()
+        feeds = news.fetch_sources_concurrently(['bbc', 'guardian'])
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual([source for source, _ in feeds], ['bbc'])
+
+    def test_overall_deadline_drops_a_slow_answer(self):
+        news = self.make_manager(source_timeout_seconds=5, overall_timeout_seconds=0.3)
+        started = time.monotonic()
+        feeds = news.fetch_sources_concurrently(['bbc', 'sky'])
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual([source for source, _ in feeds], ['bbc'])
+
+    def test_sequential_fetch_shares_the_overall_deadline(self):
+        news = self.make_manager(['bbc', 'guardian', 'sky'], concurrent_fetch=False,
+                                 source_timeout_seconds=5, overall_timeout_seconds=0.5)
+        started = time.monotonic()
+        pool = news.build_pool()
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual({headline['source'] for headline in pool['headlines']}, {'BBC'})
+
+
+class FallbackTest(NewsTestCase):
+    def faults(self):
+        return FaultProfile(drip_routes={'/feeds/guardian': 50})
+
+    def cache_expired(self, source, titles):
+        self.news.cache.put(source, {'url': self.url(source), 'titles': titles, 'fetched_at': 0}, ttl=-60)
+
+    def test_failed_fetch_serves_the_cached_titles(self):
+        self.cache_expired('guardian', ["Earlier headline"])
+        titles = self.news.fetch_feed_titles('guardian', self.url('guardian'), deadline=time.monotonic() + 0.3)
+        self.assertEqual(titles, ["Earlier headline"])
+        self.assertTrue(http_client.is_blocked(self.url('guardian')))
+
+    def test_nothing_cached(self):
+        titles = self.news.fetch_feed_titles('guardian', self.url('guardian'), deadline=time.monotonic() + 0.3)
+        self.assertEqual(titles, [])
+
+    def test_stale_titles_are_served_without_fetching(self):
+        self.cache_expired('guardian', ["Earlier headline"])
+        with mock.patch.object(revalidate, 'enabled', lambda: True), \
+                mock.patch('revalidate.spawn_refresh') as spawn:
+            self.assertEqual(self.news.fetch_feed_titles('guardian', self.url('guardian')), ["Earlier headline"])
+        self.assertTrue(self.news.served_stale)
+        self.assertEqual(self.requests_to('guardian'), 0)
+        spawn.assert_called_once_with('news', 'news_simple.py', ['refresh'])
+
+    def test_feed_moved_to_a_new_url_is_refetched(self):
+        self.news.cache.put('bbc', {'url': 'http://old.example/rss', 'titles': ["Old"]}, ttl=600)
+        self.assertEqual(self.news.fetch_feed_titles('bbc', self.url('bbc')), fixture_titles('bbc.xml'))
+
+
+class PollScheduleTest(unittest.TestCase):
+    NOW = 1_800_000_000
+
+    def setUp(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.json')
+            with open(path, 'w') as f:
+                json.dump({'news': {'sources': {}, 'min_poll_seconds': 120}}, f)
+            self.news = SimpleNewsManager(path)
+        self.news.cache_ttl = 3600
+
+    def dates(self, gap, count=5):
+        """Item dates, newest first, gap seconds apart"""
+        return [self.NOW - i * gap for i in range(count)]
+
+    def schedule(self, entry, now, changed, dates=None):
+        self.news.schedule_next_poll(entry, now, changed, dates)
+        return entry['poll_interval']
+
+    def test_first_poll_learns_from_publish_dates(self):
+        entry = {}
+        self.assertEqual(self.schedule(entry, self.NOW, True, self.dates(600)), 600)
+        self.assertEqual(entry['next_poll'], self.NOW + 600)
+        self.assertEqual((entry['update_interval'], entry['changed_at'], entry['unchanged_polls']), (600, self.NOW, 0))
+
+    def test_interval_is_an_ewma_of_samples(self):
+        entry = {'update_interval': 600}
+        expected = news_simple.EWMA_ALPHA * 1200 + (1 - news_simple.EWMA_ALPHA) * 600
+        self.assertAlmostEqual(self.schedule(entry, self.NOW, True, self.dates(1200)), expected)
+        self.assertAlmostEqual(entry['update_interval'], expected)
+
+    def test_feeds_without_dates_learn_from_changes(self):
+        entry = {}
+        self.assertEqual(self.schedule(entry, self.NOW, True), 3600)  # Nothing learned yet
+        self.assertEqual(self.schedule(entry, self.NOW + 900, True), 900)
+        self.assertEqual(entry['changed_at'], self.NOW + 900)
+
+    def test_unchanged_polls_back_off(self):
+        entry = {'update_interval': 600, 'changed_at': self.NOW}
+        intervals = [self.schedule(entry, self.NOW + i * 60, False) for i in range(1, 5)]
+        self.assertEqual(intervals, [1200, 2400, 3600, 3600])  # Doubled, then capped at the TTL
+        self.assertEqual(entry['unchanged_polls'], 4)
+        self.assertEqual(entry['update_interval'], 600)
+
+    def test_a_change_ends_the_backoff(self):
+        entry = {'update_interval': 600, 'changed_at': self.NOW, 'unchanged_polls': 3}
+        self.assertEqual(self.schedule(entry, self.NOW + 600, True, self.dates(600)), 600)
+        self.assertEqual(entry['unchanged_polls'], 0)
+
+    def test_clamped_to_min_poll_seconds(self):
+        entry = {}
+        self.assertEqual(self.schedule(entry, self.NOW, True, self.dates(30)), 120)
+        self.assertEqual(entry['update_interval'], 30)
+        self.assertEqual(entry['next_poll'], self.NOW + 120)
+
+    def test_fixed_interval_without_adaptive_polling(self):
+        self.news.adaptive_polling = False
+        entry = {'update_interval': 600}
+        self.news.schedule_next_poll(entry, self.NOW, True, self.dates(600))
+        self.assertEqual(entry['next_poll'], self.NOW + 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Tests for the memory-mapped portfolio history ring buffer"""
+
+import os
+import tempfile
+import unittest
+
+from portfolio_history import PortfolioHistory, sparkline
+
+
+class PortfolioHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'history.bin')
+
+    def write(self, timestamps, capacity=4):
+        history = PortfolioHistory(self.path, capacity, writable=True)
+        for timestamp in timestamps:
+            history.append(timestamp, timestamp * 10, 0, 0, 0)
+        history.close()
+
+    def read(self):
+        history = PortfolioHistory(self.path)
+        self.addCleanup(history.close)
+        return history
+
+    def test_missing_file_is_empty(self):
+        history = self.read()
+        self.assertEqual(history.count, 0)
+        self.assertEqual(history.last(5), [])
+        self.assertIsNone(history.at_or_before(100))
+
+    def test_before_wrapping(self):
+        self.write([1, 2, 3])
+        history = self.read()
+        self.assertEqual(history.count, 3)
+        self.assertEqual([point[0] for point in history.last(10)], [1, 2, 3])
+
+    def test_wrap_around_keeps_newest(self):
+        self.write(range(1, 11))
+        history = self.read()
+        self.assertEqual(history.count, 4)
+        self.assertEqual([point[0] for point in history.last(4)], [7, 8, 9, 10])
+        self.assertEqual(history.record(0)[:2], (7, 70))
+        self.assertEqual(history.record(3)[:2], (10, 100))
+
+    def test_appends_continue_after_reopening(self):
+        self.write([1, 2, 3])
+        self.write([4, 5, 6])
+        self.assertEqual([point[0] for point in self.read().last(4)], [3, 4, 5, 6])
+
+    def test_at_or_before_across_the_wrap(self):
+        self.write(range(1, 11))
+        history = self.read()
+        self.assertEqual(history.at_or_before(8.5)[0], 8)
+        self.assertEqual(history.at_or_before(100)[0], 10)
+        self.assertIsNone(history.at_or_before(6))
+
+    def test_capacity_change_keeps_newest(self):
+        self.write(range(1, 11))
+        self.write([11], capacity=3)
+        history = self.read()
+        self.assertEqual([point[0] for point in history.last(5)], [9, 10, 11])
+
+    def test_sparkline(self):
+        self.assertEqual(sparkline([]), "")
+        self.assertEqual(sparkline([0, 2, 14]), "▁▂█")
+        self.assertEqual(sparkline([5, 5]), "▅▅")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Tests for the NOAA solar engine against published sunrise/sunset times"""
+
+import unittest
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+
+import solar
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+LONDON = (51.5074, -0.1278)
+NEW_YORK = (40.7128, -74.0060)
+TROMSO = (69.6492, 18.9553)
+
+
+@unittest.skipIf(ZoneInfo is None, "needs zoneinfo")
+class SunTimesTest(unittest.TestCase):
+    def assertAround(self, moment, expected, tolerance=90):
+        """moment is within tolerance seconds of expected (HH:MM on the same local day)"""
+        hour, minute = map(int, expected.split(':'))
+        target = moment.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        self.assertLessEqual(abs((moment - target).total_seconds()), tolerance, f"{moment:%H:%M:%S} != {expected}")
+
+    def test_london_midsummer(self):
+        times = solar.sun_times(date(2026, 6, 21), *LONDON, ZoneInfo('Europe/London'))
+        self.assertAround(times['sunrise'], '04:43')
+        self.assertAround(times['sunset'], '21:21')
+        self.assertEqual(times['sunrise'].utcoffset(), timedelta(hours=1))
+
+    def test_london_midwinter(self):
+        times = solar.sun_times(date(2026, 12, 21), *LONDON, ZoneInfo('Europe/London'))
+        self.assertAround(times['sunrise'], '08:03')
+        self.assertAround(times['sunset'], '15:53')
+        self.assertAround(times['civil_dawn'], '07:23')
+
+    def test_new_york_midsummer(self):
+        times = solar.sun_times(date(2026, 6, 21), *NEW_YORK, ZoneInfo('America/New_York'))
+        self.assertAround(times['sunrise'], '05:25')
+        self.assertAround(times['sunset'], '20:31')
+        self.assertAround(times['solar_noon'], '12:57')
+
+    def test_day_length(self):
+        times = solar.sun_times(date(2026, 6, 21), *LONDON, ZoneInfo('Europe/London'))
+        self.assertEqual(times['day_length'], times['sunset'] - times['sunrise'])
+
+    def test_polar_day_and_night(self):
+        summer = solar.sun_times(date(2026, 6, 21), *TROMSO, ZoneInfo('Europe/Oslo'))
+        self.assertIsNone(summer['sunrise'])
+        self.assertEqual(summer['day_length'], timedelta(hours=24))
+        winter = solar.sun_times(date(2026, 12, 21), *TROMSO, ZoneInfo('Europe/Oslo'))
+        self.assertIsNone(winter['sunset'])
+        self.assertEqual(winter['day_length'], timedelta(0))
+
+
+class JulianDayTest(unittest.TestCase):
+    def test_julian_day(self):
+        self.assertEqual(solar.julian_day(datetime(2000, 1, 1, 12, tzinfo=timezone.utc)), 2451545.0)
+
+
+class EventTableTest(unittest.TestCase):
+    def test_matches_event_times(self):
+        days = [date(2026, 6, 21), date(2026, 12, 21)]
+        rising, setting = solar.event_table(days, [LONDON[0], TROMSO[0]], [LONDON[1], TROMSO[1]])
+        self.assertEqual(len(rising), 2)
+        self.assertEqual(len(rising[0]), 2)
+        for i, (latitude, longitude) in enumerate((LONDON, TROMSO)):
+            for j, day in enumerate(days):
+                expected = solar.event_times(day, latitude, longitude)
+                for actual, wanted in ((rising[i][j], expected[0]), (setting[i][j], expected[1])):
+                    if wanted is None:
+                        self.assertIsNone(actual)
+                    else:
+                        self.assertLess(abs((actual - wanted).total_seconds()), 1)
+
+    @unittest.skipIf(solar._load_numpy() is None, "needs NumPy")
+    def test_numpy_matches_scalar(self):
+        days = [date(2026, 1, 1) + timedelta(days=offset) for offset in range(0, 365, 7)]
+        latitudes = [LONDON[0], NEW_YORK[0], TROMSO[0], -33.8688, 0.0]
+        longitudes = [LONDON[1], NEW_YORK[1], TROMSO[1], 151.2093, 0.0]
+        vectorised = solar.event_table(days, latitudes, longitudes)
+        with mock.patch.object(solar, '_load_numpy', lambda: None):
+            scalar = solar.event_table(days, latitudes, longitudes)
+        self.assertEqual([[len(row) for row in rows] for rows in vectorised],
+                         [[len(row) for row in rows] for rows in scalar])
+        for fast_rows, slow_rows in zip(vectorised, scalar):
+            for fast_row, slow_row in zip(fast_rows, slow_rows):
+                for fast, slow in zip(fast_row, slow_row):
+                    if slow is None:
+                        self.assertIsNone(fast)
+                    else:
+                        self.assertLess(abs((fast - slow).total_seconds()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Tests for the Trading212 token buckets, single-flight refresh, position formatting and history sync"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import http_client
+import revalidate
+import trading212_api
+import widget_cache
+from history_store import HISTORY_ENDPOINTS, HistoryStore
+from trading212_api import CachedTrading212API, TickerIndex, TokenBucket
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench')
+sys.path.insert(0, BENCH_DIR)
+from fake_server import FIXTURES_DIR, FaultProfile, start_server  # noqa: E402
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r') as f:
+        return json.load(f)
+
+
+def make_api(directory, base_url, **config):
+    """A client for the fake server whose state files live in directory"""
+    config_path = os.path.join(directory, 'trading212_config.json')
+    with open(config_path, 'w') as f:
+        json.dump(dict({'api_key': 'test-key', 'api_secret': 'test-secret',
+                        'base_url': f"{base_url}/t212"}, **config), f)
+    api = CachedTrading212API(config_path)
+    api.rate_limit_file = os.path.join(directory, 'ratelimit.json')
+    api.lock_file = os.path.join(directory, 'fetch.lock')
+    return api
+
+
+class ServerTestCase(unittest.TestCase):
+    """Starts the fake server and keeps circuit state in a scratch directory"""
+
+    def faults(self):
+        return FaultProfile()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.server = start_server(self.faults())
+        self.addCleanup(self.server.shutdown)
+        patcher = mock.patch.object(http_client, 'CIRCUIT_FILE', os.path.join(self.directory.name, 'circuits.json'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def requests_to(self, path):
+        return self.server.stats.snapshot()['routes'].get(path, {}).get('requests', 0)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_refills_at_capacity_per_period(self):
+        bucket = TokenBucket(10, 60, tokens=0, updated=100)
+        self.assertAlmostEqual(bucket.wait_time(100), 6)
+        self.assertAlmostEqual(bucket.wait_time(103), 3)
+        self.assertAlmostEqual(bucket.tokens, 0.5)
+        self.assertEqual(bucket.wait_time(106), 0)
+
+    def test_refill_stops_at_capacity(self):
+        bucket = TokenBucket(5, 10, tokens=4, updated=0)
+        bucket.wait_time(1000)
+        self.assertEqual(bucket.tokens, 5)
+
+    def test_consume_spends_one_token(self):
+        bucket = TokenBucket(2, 10, updated=0)
+        bucket.consume(0)
+        bucket.consume(0)
+        self.assertEqual(bucket.tokens, 0)
+        self.assertAlmostEqual(bucket.wait_time(0), 5)
+
+    def test_429_blocks_for_retry_after(self):
+        bucket = TokenBucket(10, 60, updated=0)
+        bucket.update_from_response(429, {'Retry-After': '20'}, 0)
+        self.assertEqual(bucket.tokens, 0)
+        self.assertAlmostEqual(bucket.wait_time(0), 20)
+
+    def test_headers_replace_limits(self):
+        bucket = TokenBucket(10, 60, updated=0)
+        bucket.update_from_response(200, {'x-ratelimit-limit': '2', 'x-ratelimit-period': '1',
+                                          'x-ratelimit-remaining': '1'}, 0)
+        self.assertEqual((bucket.capacity, bucket.period, bucket.tokens), (2, 1, 1))
+
+    def test_malformed_headers_are_ignored(self):
+        bucket = TokenBucket(10, 60, updated=0)
+        bucket.update_from_response(200, {'x-ratelimit-limit': 'many', 'x-ratelimit-period': '1'}, 0)
+        self.assertEqual((bucket.capacity, bucket.period), (10, 60))
+
+
+class LoadRateLimitsTest(unittest.TestCase):
+    def test_limits_come_from_config_and_tokens_from_file(self):
+        api = CachedTrading212API.__new__(CachedTrading212API)
+        api.config = {'rate_limits': {'/equity/account/cash': {'requests': 3, 'period': 30}}}
+        with tempfile.TemporaryDirectory() as directory:
+            api.rate_limit_file = os.path.join(directory, 'ratelimit.json')
+            with open(api.rate_limit_file, 'w') as f:
+                json.dump({'/equity/account/cash': {'capacity': 50, 'period': 1, 'tokens': 40,
+                                                    'updated': 123, 'blocked_until': 456}}, f)
+            bucket = api.load_rate_limits()['/equity/account/cash']
+        self.assertEqual((bucket.capacity, bucket.period), (3, 30))
+        self.assertEqual((bucket.tokens, bucket.updated, bucket.blocked_until), (3, 123, 456))
+
+
+def position(ticker, quantity, average, current):
+    return {'ticker': ticker, 'quantity': quantity, 'averagePrice': average, 'currentPrice': current}
+
+
+def rounded(rows):
+    return [tuple(round(value, 6) if isinstance(value, float) else value for value in row) for row in rows]
+
+
+class TickerIndexTest(unittest.TestCase):
+    def setUp(self):
+        with open(trading212_api.TICKERS_FILE, 'r') as f:
+            self.index = TickerIndex(json.load(f))
+
+    def test_exchange_suffixes(self):
+        self.assertEqual(self.index.classify('AAPL_US_EQ'), ('AAPL', 'USD', 1))
+        self.assertEqual(self.index.classify('BARC_EQ'), ('BARC', 'GBP', 1))
+        self.assertEqual(self.index.classify('UNKNOWN'), ('UNKNOWN', 'GBP', 1))
+
+    def test_london_tickers_are_quoted_in_pence(self):
+        for ticker in ('VODl_EQ', 'VOD_l_EQ', 'VOD_L_EQ', 'VOD_UK_EQ'):
+            self.assertEqual(self.index.classify(ticker), ('VOD', 'GBX', 0.01), ticker)
+
+    def test_instruments_override_the_suffix(self):
+        self.assertEqual(self.index.classify('VUSA_EQ'), ('VUSA', 'GBX', 0.01))
+        self.assertEqual(self.index.classify('VWRPl_EQ'), ('VWRP', 'GBP', 1))
+
+    def test_results_are_cached(self):
+        self.assertIs(self.index.classify('AAPL_US_EQ'), self.index.classify('AAPL_US_EQ'))
+
+
+class PositionRowsTest(unittest.TestCase):
+    def test_pence_are_converted_to_pounds(self):
+        rows = trading212_api.position_rows([position('VODl_EQ', 100, 70, 77)])
+        self.assertEqual(rounded(rows), [(70.0, 77.0, 10.0, 'VOD', 100, 'GBP')])
+
+    def test_pound_quoted_london_instrument(self):
+        rows = trading212_api.position_rows([position('VWRPl_EQ', 2, 100, 110)])
+        self.assertEqual(rounded(rows), [(200.0, 220.0, 10.0, 'VWRP', 2, 'GBP')])
+
+    def test_converted_to_account_currency(self):
+        portfolio = [position('AAPL_US_EQ', 10, 100, 125)]
+        rows = trading212_api.position_rows(portfolio, 'GBP', {'GBP': 1.0, 'USD': 1.25})
+        self.assertEqual(rounded(rows), [(800.0, 1000.0, 25.0, 'AAPL', 10, 'GBP')])
+        rows = trading212_api.position_rows(portfolio, 'GBP', {'GBP': 1.0})
+        self.assertEqual(rounded(rows), [(1000.0, 1250.0, 25.0, 'AAPL', 10, 'USD')])
+
+    def test_shorts_gain_when_the_price_falls(self):
+        rows = trading212_api.position_rows([position('TSLA_US_EQ', -5, 10, 8)])
+        self.assertEqual(rounded(rows), [(50.0, 40.0, 20.0, 'TSLA', -5, 'USD')])
+
+    def test_no_portfolio(self):
+        self.assertEqual(trading212_api.position_rows(None), [])
+
+
+class PositionFormatTest(unittest.TestCase):
+    ROWS = [
+        (300.0, 330.0, 10.0, 'VOD', 100, 'GBP'),
+        (50.0, 40.0, 20.0, 'TSLA', -5, 'GBP'),
+        (1000.0, 900.0, -10.0, 'BARC', 10, 'GBP'),
+        (200.0, 200.0, 0.0, 'VWRP', 2, 'GBP'),
+    ]
+
+    def test_top_positions_by_invested_amount(self):
+        self.assertEqual(trading212_api.format_top_positions(self.ROWS, 2), "BARC: £1000.00\nVOD: £300.00")
+        lines = trading212_api.format_top_positions(self.ROWS).split("\n")
+        self.assertEqual(lines, [f"{row[3]}: {'SHORT ' if row[4] < 0 else ''}£{row[0]:.2f}"
+                                 for row in sorted(self.ROWS, reverse=True)])
+        self.assertEqual(trading212_api.format_top_positions([]), "No positions")
+
+    def test_movers_are_labelled_by_sign(self):
+        self.assertEqual(trading212_api.format_movers(self.ROWS), "Up: TSLA +20.00%\nDown: BARC -10.00%")
+        self.assertEqual(trading212_api.format_movers(self.ROWS[2:3]), "Down: BARC -10.00%")
+        self.assertEqual(trading212_api.format_movers(self.ROWS[3:]), "Flat: VWRP 0.00%")
+
+    def test_allocation_groups_the_smallest(self):
+        text = trading212_api.format_allocation(self.ROWS, slices=2)
+        self.assertEqual(text, "BARC: 61.2%\nVOD: 22.4%\nOther: 16.3%")
+
+    def test_unconverted_currencies_are_shown_separately(self):
+        rows = [(100.0, 100.0, 0.0, 'VOD', 1, 'GBP'), (60.0, 60.0, 0.0, 'AAPL', 1, 'USD'),
+                (40.0, 40.0, 0.0, 'MSFT', 1, 'USD')]
+        self.assertEqual(trading212_api.format_allocation(rows),
+                         "VOD: 100.0% of GBP\nAAPL: 60.0% of USD\nMSFT: 40.0% of USD")
+
+
+class SingleFlightTest(ServerTestCase):
+    def faults(self):
+        return FaultProfile(latency_ms=300)  # Long enough for the two refreshes to overlap
+
+    def setUp(self):
+        super().setUp()
+        for target, name, value in (
+                (widget_cache, 'CACHE_DIR', os.path.join(self.directory.name, 'cache')),
+                (trading212_api, 'HISTORY_FILE', os.path.join(self.directory.name, 'history.bin'))):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.apis = [make_api(self.directory.name, self.server.base_url) for _ in range(2)]
+
+    def refresh_together(self):
+        """get_all_data() from both clients at once, as two conky execi calls would"""
+        results = [None, None]
+
+        def refresh(i):
+            results[i] = self.apis[i].get_all_data()
+
+        threads = [threading.Thread(target=refresh, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def endpoint_requests(self):
+        return {endpoint: self.requests_to(f"/t212{endpoint}") for endpoint in trading212_api.DATA_ENDPOINTS}
+
+    def test_empty_cache_is_fetched_once(self):
+        first, second = self.refresh_together()
+        self.assertEqual(first['cash'], fixture('t212_cash.json'))
+        self.assertEqual(second, first)  # The waiting client reads what the other fetched
+        self.assertEqual(self.endpoint_requests(), dict.fromkeys(trading212_api.DATA_ENDPOINTS, 1))
+
+    def test_stale_copy_is_served_during_a_refresh(self):
+        for endpoint in trading212_api.DATA_ENDPOINTS:
+            self.apis[0].cache.put(f"GET:{endpoint}", {'stale': True}, ttl=-60)
+        results = self.refresh_together()
+        self.assertCountEqual([result['cash'] for result in results], [{'stale': True}, fixture('t212_cash.json')])
+        self.assertEqual(self.endpoint_requests(), dict.fromkeys(trading212_api.DATA_ENDPOINTS, 1))
+
+
+class SyncHistoryTest(ServerTestCase):
+    ORDERS = '/t212/equity/history/orders'
+
+    def setUp(self):
+        super().setUp()
+        self.api = make_api(self.directory.name, self.server.base_url, history_max_pages=2)
+        self.store = HistoryStore(os.path.join(self.directory.name, 'history.db'))
+        self.addCleanup(self.store.close)
+        patcher = mock.patch.object(trading212_api, 'HISTORY_PAGE_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_order(self, order_id):
+        """Put a new order at the top of the fake history"""
+        orders = json.loads(self.server.fixture('t212_history_orders.json'))
+        orders['items'].insert(0, dict(orders['items'][0], id=order_id))
+        self.server.set_fixture('t212_history_orders.json', json.dumps(orders).encode('utf-8'))
+
+    def test_backfill_resumes_from_saved_cursor(self):
+        # 5 orders in pages of 2, at most 2 pages per run: the third page waits
+        self.assertEqual(self.api.sync_history(self.store), {'orders': 4, 'dividends': 3, 'transactions': 3})
+        pending, synced_at = self.store.get_state('/equity/history/orders')
+        self.assertEqual(pending, [f"{self.ORDERS}?limit=2&cursor=1"])
+        self.assertTrue(synced_at)
+
+        self.add_order(4000001)
+        self.server.stats.reset()
+        self.assertEqual(self.api.sync_history(self.store)['orders'], 2)
+        self.assertEqual(self.requests_to(self.ORDERS), 2)  # Newest page, then the saved cursor
+        self.assertEqual(self.store.get_state('/equity/history/orders')[0], [])
+        count = self.store.conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        self.assertEqual(count, 6)
+
+    def test_routine_sync_reads_one_page(self):
+        self.api.sync_history(self.store)
+        self.api.sync_history(self.store)
+        self.server.stats.reset()
+        self.assertEqual(self.api.sync_history(self.store), {'orders': 0, 'dividends': 0, 'transactions': 0})
+        self.assertEqual(self.requests_to(self.ORDERS), 1)
+
+    def test_ledger_waits_for_first_sync(self):
+        path = os.path.join(self.directory.name, 'history.db')
+        with mock.patch('revalidate.spawn_refresh') as spawn:
+            for command in trading212_api.LEDGER_COMMANDS:
+                self.assertEqual(trading212_api.format_ledger(command, path), "Syncing…")
+            self.assertTrue(spawn.called)
+            for endpoint in HISTORY_ENDPOINTS:
+                self.store.set_state(endpoint, [], 1)
+            self.assertNotEqual(trading212_api.format_ledger('dividends_month', path), "Syncing…")
+            self.assertEqual(trading212_api.format_ledger('last_fill', path), "No fills")
+
+
+class StaleServeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        for target, name, value in (
+                (widget_cache, 'CACHE_DIR', os.path.join(self.directory.name, 'cache')),
+                (trading212_api, 'SNAPSHOT_FILE', os.path.join(self.directory.name, 'snapshot')),
+                (revalidate, 'enabled', lambda: True)):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.api = make_api(self.directory.name, 'http://127.0.0.1:9')
+        for endpoint, name in (('/equity/account/cash', 't212_cash.json'), ('/equity/portfolio', 't212_portfolio.json'),
+                               ('/equity/account/info', 't212_info.json'), ('/equity/orders', 't212_orders.json')):
+            self.api.cache.put(f"GET:{endpoint}", fixture(name), ttl=-60)
+
+    def test_expired_cache_is_served_without_fetching(self):
+        rates = widget_cache.WidgetCache('currency')
+        rates.put('rates:GBP', {'USD': 1.25, 'EUR': 1.15}, ttl=-60)
+        with mock.patch.object(http_client, 'request') as request, mock.patch('revalidate.spawn_refresh') as spawn:
+            self.assertEqual(trading212_api.exchange_rates(cached_only=True), {'USD': 1.25, 'EUR': 1.15, 'GBP': 1.0})
+            text = trading212_api.run(['allocation'], self.api)
+        request.assert_not_called()
+        self.assertNotIn("Error", text)
+        self.assertNotEqual(text, "N/A")
+        spawn.assert_called_with('trading212', 'trading212_api.py', ['snapshot'])
+
+    def test_missing_rates_are_not_fetched(self):
+        with mock.patch.object(http_client, 'request') as request, mock.patch('revalidate.spawn_refresh'):
+            self.assertIsNone(trading212_api.exchange_rates(cached_only=True))
+            self.assertNotIn("Error", trading212_api.run(['allocation'], self.api))
+        request.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Tests for the shared widget cache: expiry by mtime, LRU eviction by atime, settings reload"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import widget_cache
+import widget_config
+from widget_cache import WidgetCache
+
+
+class CacheTestCase(unittest.TestCase):
+    """A scratch cache directory and config.json"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        cache_dir = os.path.join(self.directory.name, 'cache')
+        self.config_file = os.path.join(self.directory.name, 'config.json')
+        self.write_config({'cache_duration_minutes': 1, 'cache': {'max_kilobytes': 1, 'ttl_seconds': {'news': 300}}})
+        for target, name, value in ((widget_cache, 'CACHE_DIR', cache_dir),
+                                    (widget_cache, 'USAGE_FILE', os.path.join(cache_dir, '.usage')),
+                                    (widget_cache, '_size_estimate', None),
+                                    (widget_cache, '_scanned_at', 0),
+                                    (widget_config, 'CONFIG_FILE', self.config_file)):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_config(self, general, mtime=None):
+        with open(self.config_file, 'w') as f:
+            json.dump({'general': general}, f)
+        if mtime:
+            os.utime(self.config_file, (mtime, mtime))
+
+
+class ExpiryTest(CacheTestCase):
+    def test_fresh_value(self):
+        cache = WidgetCache('test', 60)
+        self.assertTrue(cache.put('key', {'a': 1}))
+        self.assertEqual(cache.lookup('key'), ({'a': 1}, True))
+        self.assertEqual(cache.get('key'), {'a': 1})
+        self.assertTrue(cache.is_fresh('key'))
+
+    def test_expired_value_is_only_served_stale(self):
+        cache = WidgetCache('test', 60)
+        cache.put('key', [1, 2], ttl=-1)
+        self.assertEqual(cache.lookup('key'), ([1, 2], False))
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.get('key', allow_stale=True), [1, 2])
+        self.assertFalse(cache.is_fresh('key'))
+
+    def test_expiry_is_the_mtime(self):
+        cache = WidgetCache('test', 60)
+        before = time.time()
+        cache.put('key', 'value', ttl=120)
+        self.assertAlmostEqual(cache.expiry('key'), before + 120, delta=2)
+        self.assertEqual(cache.expiry('missing'), 0)
+
+    def test_missing_and_unreadable(self):
+        cache = WidgetCache('test', 60)
+        self.assertEqual(cache.lookup('missing'), (None, False))
+        os.makedirs(cache.directory)
+        with open(cache.path('broken'), 'w') as f:
+            f.write('{not json')
+        self.assertEqual(cache.lookup('broken'), (None, False))
+
+    def test_keys_are_escaped(self):
+        cache = WidgetCache('test', 60)
+        cache.put('GET:/equity/portfolio?x=1', 1)
+        self.assertEqual(cache.get('GET:/equity/portfolio?x=1'), 1)
+        self.assertEqual(len(os.listdir(cache.directory)), 1)
+
+
+class SettingsTest(CacheTestCase):
+    def test_namespace_ttl_overrides_caller(self):
+        self.assertEqual(WidgetCache('news', 600).ttl, 300)
+        self.assertEqual(WidgetCache('other', 600).ttl, 600)
+        self.assertEqual(WidgetCache('other').ttl, 60)
+
+    def test_config_changes_are_picked_up(self):
+        self.assertEqual(WidgetCache('news').ttl, 300)
+        self.write_config({'cache': {'ttl_seconds': {'news': 30}}}, mtime=time.time() + 5)
+        self.assertEqual(WidgetCache('news').ttl, 30)
+        self.assertEqual(WidgetCache('news').max_bytes, 4096 * 1024)
+
+
+class EvictionTest(CacheTestCase):
+    VALUE = 'x' * 300  # ~300 bytes on disk, so four entries pass the 1 KB cap
+    CAP = 1024
+
+    def fill(self, keys):
+        """A cache holding keys, each used one minute after the previous"""
+        cache = WidgetCache('test', 60)
+        cache.max_bytes = 1024 * 1024  # Nothing is evicted while filling
+        start = time.time() - 3600
+        for i, key in enumerate(keys):
+            cache.put(key, self.VALUE)
+            os.utime(cache.path(key), (start + i * 60, cache.expiry(key)))
+        cache.max_bytes = self.CAP
+        return cache
+
+    def remaining(self, cache):
+        return sorted(name[:-len('.json')] for name in os.listdir(cache.directory))
+
+    def test_least_recently_used_go_first(self):
+        cache = self.fill(['a', 'b', 'c', 'd'])
+        widget_cache.evict(self.CAP)
+        self.assertEqual(self.remaining(cache), ['b', 'c', 'd'])
+
+    def test_reading_an_entry_keeps_it(self):
+        cache = self.fill(['a', 'b', 'c', 'd'])
+        cache.lookup('a')
+        widget_cache.evict(self.CAP)
+        self.assertEqual(self.remaining(cache), ['a', 'c', 'd'])
+
+    def test_eviction_keeps_expiry(self):
+        cache = self.fill(['a', 'b', 'c', 'd'])
+        expiry = cache.expiry('d')
+        widget_cache.evict(self.CAP)
+        self.assertEqual(cache.expiry('d'), expiry)
+
+    def test_put_over_the_cap_evicts(self):
+        cache = self.fill(['a', 'b', 'c'])
+        cache.put('d', self.VALUE)
+        self.assertNotIn('a', self.remaining(cache))
+        self.assertIn('d', self.remaining(cache))
+
+    def test_under_the_cap_nothing_is_evicted(self):
+        cache = self.fill(['a', 'b'])
+        widget_cache.evict(self.CAP)
+        self.assertEqual(self.remaining(cache), ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
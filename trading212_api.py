@@ -4,15 +4,146 @@ Trading212 API Integration for Conky (Enhanced with Caching)
 Fetches portfolio data from Trading212 and formats it for display with rate limit handling
 """
 
+from __future__ import annotations
+
 import json
 import base64
-import requests
 import os
 import sys
 import time
-import pickle
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+import fcntl
+import heapq
+import tempfile
+from operator import itemgetter
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+# requests, sqlite3 and the history modules are imported where they are
+# used, so answering from the snapshot imports nothing heavy
+import http_client
+import metrics
+import revalidate
+from widget_cache import WidgetCache
+
+if TYPE_CHECKING:
+    from history_store import HistoryStore
+
+# Trading212's published per-endpoint limits: (requests, period in seconds)
+DEFAULT_RATE_LIMITS = {
+    '/equity/account/cash': (1, 2),
+    '/equity/portfolio': (1, 5),
+    '/equity/account/info': (1, 30),
+    '/equity/orders': (1, 5),
+    '/equity/history/orders': (6, 60),
+    '/history/dividends': (6, 60),
+    '/history/transactions': (6, 60),
+}
+
+# endpoint path -> key in the get_all_data() result
+DATA_ENDPOINTS = {
+    '/equity/account/cash': 'cash',
+    '/equity/portfolio': 'portfolio',
+    '/equity/account/info': 'info',
+    '/equity/orders': 'orders',
+}
+
+# An endpoint that failed is not retried for this many seconds
+FAILED_RETRY_SECONDS = 30
+
+SNAPSHOT_FILE = os.path.join(os.path.dirname(__file__), '.trading212_snapshot')
+HISTORY_FILE = os.path.join(os.path.dirname(__file__), '.trading212_history.bin')
+
+# Points drawn by `sparkline` when no count is given
+SPARKLINE_POINTS = 24
+# Commands rendered from the history file rather than the snapshot
+HISTORY_COMMANDS = ('sparkline', 'change_1d', 'change_7d')
+
+HISTORY_DB_FILE = os.path.join(os.path.dirname(__file__), '.trading212_history.db')
+HISTORY_PAGE_SIZE = 50
+# Commands answered from the synced orders/dividends/transactions database
+LEDGER_COMMANDS = ('dividends_month', 'realised_ytd', 'last_fill')
+# A ledger query older than this starts a background sync_history
+HISTORY_SYNC_INTERVAL = 3600
+
+# Field returned for an unrecognised command, and for no command at all
+DEFAULT_FIELD = 'default'
+SUMMARY_FIELD = 'summary'
+
+TICKERS_FILE = os.path.join(os.path.dirname(__file__), 'tickers.json')
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
+
+# Minor-unit currencies; price_unit already scales their prices to the major unit
+MAJOR_CURRENCY = {'GBX': 'GBP'}
+CURRENCY_SYMBOLS = {'GBP': '£', 'USD': '$', 'EUR': '€'}
+
+# Longest lines kept in the snapshot for `top_positions N`, and slices shown by `allocation`
+TOP_POSITIONS_MAX = 10
+DEFAULT_TOP_POSITIONS = 5
+ALLOCATION_SLICES = 5
+
+class TokenBucket:
+    """Token bucket for one endpoint, adjusted by the API's rate-limit headers"""
+    
+    def __init__(self, capacity: float, period: float, tokens: float = None,
+                 updated: float = None, blocked_until: float = 0):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = capacity if tokens is None else tokens
+        self.updated = time.time() if updated is None else updated
+        self.blocked_until = blocked_until
+    
+    def _refill(self, now: float):
+        rate = self.capacity / self.period
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+    
+    def wait_time(self, now: float) -> float:
+        """Seconds until a request may be sent"""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) * self.period / self.capacity)
+        return wait
+    
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+    
+    def update_from_response(self, status: int, headers: dict[str, str], now: float):
+        """Adapt to x-ratelimit-* and Retry-After headers"""
+        try:
+            limit = headers.get('x-ratelimit-limit')
+            period = headers.get('x-ratelimit-period')
+            if limit and period and float(limit) > 0 and float(period) > 0:
+                self.capacity, self.period = float(limit), float(period)
+            
+            remaining = headers.get('x-ratelimit-remaining')
+            reset = headers.get('x-ratelimit-reset')
+            if remaining is not None:
+                self.tokens = min(self.capacity, float(remaining))
+                if float(remaining) < 1 and reset:
+                    self.blocked_until = max(self.blocked_until, float(reset))
+            
+            if status == 429:
+                self.tokens = 0
+                retry_after = headers.get('Retry-After')
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + float(retry_after))
+                elif reset:
+                    self.blocked_until = max(self.blocked_until, float(reset))
+                else:
+                    self.blocked_until = max(self.blocked_until, now + self.period)
+        except ValueError:
+            pass  # Malformed header - keep the configured limits
+    
+    def to_dict(self) -> dict[str, float]:
+        return {
+            'capacity': self.capacity,
+            'period': self.period,
+            'tokens': self.tokens,
+            'updated': self.updated,
+            'blocked_until': self.blocked_until,
+        }
 
 class CachedTrading212API:
     def __init__(self, config_path: str = None):
@@ -20,13 +151,19 @@ class CachedTrading212API:
             config_path = os.path.join(os.path.dirname(__file__), 'trading212_config.json')
         
         self.config_path = config_path
-        self.cache_file = os.path.join(os.path.dirname(__file__), '.trading212_cache.pkl')
+        self.lock_file = os.path.join(os.path.dirname(__file__), '.trading212_fetch.lock')
         self.config = self.load_config()
-        self.base_url = "https://live.trading212.com/api/v0"
+        self.base_url = self.config.get('base_url', "https://live.trading212.com/api/v0")
         self.headers = self._build_auth_headers()
-        self.cache_duration = self.config.get('cache_duration', 60)  # seconds
+        self.cache = WidgetCache('trading212', self.config.get('cache_duration', 60))
+        self.cache_duration = self.cache.ttl  # seconds
+        self.lock_wait = self.config.get('refresh_lock_wait', 15)  # seconds
+        self.rate_limit_file = os.path.join(os.path.dirname(__file__), '.trading212_ratelimit.json')
+        self.max_rate_wait = self.config.get('max_rate_wait', 3)  # seconds
+        self.history_capacity = self.config.get('history_capacity')  # points, None for the default
+        self.history_max_pages = self.config.get('history_max_pages', 5)  # per endpoint per sync
         
-    def load_config(self) -> Dict:
+    def load_config(self) -> dict:
         """Load configuration from JSON file"""
         try:
             with open(self.config_path, 'r') as f:
@@ -44,7 +181,7 @@ class CachedTrading212API:
         except json.JSONDecodeError:
             raise ValueError("Invalid JSON in configuration file")
     
-    def _build_auth_headers(self) -> Dict[str, str]:
+    def _build_auth_headers(self) -> dict[str, str]:
         """Build authentication headers for Trading212 API"""
         credentials = f"{self.config['api_key']}:{self.config['api_secret']}"
         encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
@@ -54,111 +191,290 @@ class CachedTrading212API:
             'Content-Type': 'application/json'
         }
     
-    def load_cache(self) -> Dict:
-        """Load cached data if it exists and is still valid"""
-        if not os.path.exists(self.cache_file):
-            return {}
+    def _acquire_refresh_lock(self, timeout: float):
+        """Take the cross-process refresh lock, waiting up to timeout seconds
         
-        try:
-            with open(self.cache_file, 'rb') as f:
-                cache_data = pickle.load(f)
-            
-            # Check if cache is still valid
-            if 'timestamp' in cache_data:
-                cache_age = datetime.now() - cache_data['timestamp']
-                if cache_age.total_seconds() < self.cache_duration:
-                    return cache_data
-            
-            return {}
-        except (FileNotFoundError, pickle.PickleError, KeyError):
-            return {}
+        Returns the open lock file (release with _release_refresh_lock) or
+        None if another process still holds it.
+        """
+        lock_fd = open(self.lock_file, 'w')
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_fd
+            except OSError:
+                if time.monotonic() >= deadline:
+                    lock_fd.close()
+                    return None
+                time.sleep(0.1)
     
-    def save_cache(self, data: Dict):
-        """Save data to cache with timestamp"""
-        cache_data = {
-            'timestamp': datetime.now(),
-            'data': data
-        }
+    def _release_refresh_lock(self, lock_fd):
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        lock_fd.close()
+    
+    def load_rate_limits(self) -> dict[str, TokenBucket]:
+        """Token buckets per endpoint (limits from the config, state from the shared file)"""
+        limits = dict(DEFAULT_RATE_LIMITS)
+        for endpoint, limit in self.config.get('rate_limits', {}).items():
+            limits[endpoint] = (limit['requests'], limit['period'])
         
         try:
-            with open(self.cache_file, 'wb') as f:
-                pickle.dump(cache_data, f)
-        except Exception:
-            pass  # Fail silently if can't write cache
+            with open(self.rate_limit_file, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        
+        # Capacity and period always come from the config; only the
+        # remaining budget carries over from the last process
+        buckets = {}
+        for endpoint, (capacity, period) in limits.items():
+            saved = state.get(endpoint) or {}
+            buckets[endpoint] = TokenBucket(capacity, period,
+                                            min(saved.get('tokens', capacity), capacity),
+                                            saved.get('updated'), saved.get('blocked_until', 0))
+        return buckets
+    
+    def save_rate_limits(self, buckets: dict[str, TokenBucket]):
+        """Persist bucket state so the next process continues the budget"""
+        state = {endpoint: bucket.to_dict() for endpoint, bucket in buckets.items()}
+        _write_atomic(self.rate_limit_file, json.dumps(state))
+    
+    def _send(self, endpoint: str, method: str = 'GET', data: dict = None):
+        """Send one authenticated request (endpoint may also be an absolute URL); returns the requests.Response"""
+        url = endpoint if '://' in endpoint else f"{self.base_url}{endpoint}"
+        
+        if method == 'GET':
+            return http_client.get(url, headers=self.headers)
+        elif method == 'POST':
+            return http_client.post(url, headers=self.headers, json=data)
+        else:
+            raise ValueError(f"Unsupported HTTP method: {method}")
     
-    def make_request(self, endpoint: str, method: str = 'GET', data: Dict = None) -> Optional[Dict]:
+    def make_request(self, endpoint: str, method: str = 'GET', data: dict = None) -> dict | None:
         """Make authenticated request to Trading212 API with caching"""
         cache_key = f"{method}:{endpoint}"
         
         # Try to get from cache first
-        cached_data = self.load_cache()
-        if cache_key in cached_data.get('data', {}):
-            return cached_data['data'][cache_key]
-        
-        url = f"{self.base_url}{endpoint}"
+        cached, fresh = self.cache.lookup(cache_key)
+        if fresh:
+            return cached
         
         try:
-            if method == 'GET':
-                response = requests.get(url, headers=self.headers, timeout=10)
-            elif method == 'POST':
-                response = requests.post(url, headers=self.headers, json=data, timeout=10)
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
-            
+            response = self._send(endpoint, method, data)
             response.raise_for_status()
             result = response.json()
             
             # Save successful result to cache
-            if 'data' not in cached_data:
-                cached_data = {'data': {}}
-            cached_data['data'][cache_key] = result
-            self.save_cache(cached_data['data'])
-            
+            self.cache.put(cache_key, result)
             return result
         
-        except requests.exceptions.RequestException as e:
+        except (http_client.RequestException, http_client.CircuitOpenError):
             # Return cached data if available during network errors
-            cached_data = self.load_cache()
-            if cache_key in cached_data.get('data', {}):
-                return cached_data['data'][cache_key]
-            return None
+            return cached
         except json.JSONDecodeError:
             return None
     
-    def get_all_data(self) -> Dict:
-        """Get all required data in one go and cache it"""
-        cached_data = self.load_cache()
-        if cached_data and 'data' in cached_data:
-            # Return cached data if available
-            all_data = {}
-            endpoints = ['/equity/account/cash', '/equity/portfolio', '/equity/account/info', '/equity/orders']
+    def cached_data(self, allow_stale: bool = False) -> dict | None:
+        """All four endpoints from the cache, or None if any are missing (or expired, unless allow_stale)"""
+        # Expiry is a stat() per entry; nothing is parsed unless all four are fresh
+        if not allow_stale and not all(self.cache.is_fresh(f"GET:{endpoint}") for endpoint in DATA_ENDPOINTS):
+            return None
+        
+        all_data = {}
+        for endpoint, key in DATA_ENDPOINTS.items():
+            value = self.cache.get(f"GET:{endpoint}", allow_stale=True)
+            if value is None:
+                return None
+            all_data[key] = value
+        return all_data
+    
+    def data_expiry(self) -> tuple[float, list[str]]:
+        """(earliest expiry among the four endpoints, data keys already expired)"""
+        now = time.time()
+        expiries = {key: self.cache.expiry(f"GET:{endpoint}") for endpoint, key in DATA_ENDPOINTS.items()}
+        return min(expiries.values()), [key for key, expires in expiries.items() if expires <= now]
+    
+    def get_all_data(self) -> dict:
+        """Get all required data in one go and cache it
+        
+        Refreshes are single-flight across processes: one process takes the
+        refresh lock and fetches, the others serve the stale copy if there
+        is one, or wait briefly for the refresh to land.
+        """
+        all_data = self.cached_data()
+        if all_data:
+            metrics.incr('conky_widget_cache_total', component='trading212', target='cache', result='hit')
+            return all_data
+        
+        stale_data = self.cached_data(allow_stale=True)
+        lock_fd = self._acquire_refresh_lock(0 if stale_data else self.lock_wait)
+        if lock_fd is None:
+            # Someone else is refreshing (or stuck); don't join the herd
+            metrics.incr('conky_widget_cache_total', component='trading212', target='cache', result='stale')
+            return stale_data or self.cached_data(allow_stale=True) or {}
+        
+        try:
+            # Another process may have refreshed while we waited for the lock
+            all_data = self.cached_data()
+            if all_data:
+                metrics.incr('conky_widget_retries_total', component='trading212', target='cache', reason='lock_wait')
+                metrics.incr('conky_widget_cache_total', component='trading212', target='cache', result='hit')
+                return all_data
             
-            # Check if we have all endpoints cached
-            cache_complete = all(f"GET:{endpoint}" in cached_data['data'] for endpoint in endpoints)
+            metrics.incr('conky_widget_cache_total', component='trading212', target='cache', result='miss')
+            return self._fetch_all_data()
+        finally:
+            self._release_refresh_lock(lock_fd)
+    
+    def _fetch_endpoint(self, endpoint: str, bucket: TokenBucket, delay: float,
+                        url: str | None = None) -> dict | None:
+        """Wait for the endpoint's budget, fetch it (or a page url of it) and feed the response headers back"""
+        if delay > 0:
+            metrics.incr('conky_widget_retries_total', component='trading212', target=endpoint, reason='rate_limit_wait')
+            time.sleep(delay)
+        bucket.consume(time.time())
+        
+        try:
+            with metrics.timer('conky_widget_fetch_seconds', component='trading212', target=endpoint):
+                response = self._send(url or endpoint)
+        except (http_client.RequestException, http_client.CircuitOpenError) as e:
+            metrics.record_error('trading212', e, endpoint)
+            return None
+        
+        bucket.update_from_response(response.status_code, response.headers, time.time())
+        if not response.ok:
+            if response.status_code == 429:
+                metrics.incr('conky_widget_retries_total', component='trading212', target=endpoint, reason='throttled')
+            metrics.record_error('trading212', f"HTTP{response.status_code}", endpoint)
+            return None
+        
+        try:
+            return response.json()
+        except ValueError as e:
+            metrics.record_error('trading212', e, endpoint)
+            return None
+    
+    def _fetch_all_data(self) -> dict:
+        """Fetch every endpoint from the API (caller holds the refresh lock)
+        
+        Endpoints whose token bucket allows a request within max_rate_wait
+        seconds are fetched concurrently; the rest keep their stale value,
+        which also keeps its original expiry. An endpoint that fails is left
+        alone for FAILED_RETRY_SECONDS.
+        """
+        buckets = self.load_rate_limits()
+        now = time.time()
+        
+        from concurrent.futures import ThreadPoolExecutor
+        
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(DATA_ENDPOINTS)) as executor:
+            futures = {}
+            for endpoint in DATA_ENDPOINTS:
+                bucket = buckets.get(endpoint) or TokenBucket(*DEFAULT_RATE_LIMITS[endpoint])
+                buckets[endpoint] = bucket
+                delay = bucket.wait_time(now)
+                if http_client.is_blocked(f"{self.base_url}{endpoint}"):
+                    # Host is down: don't spend the rate budget or sleep on it
+                    metrics.record_error('trading212', 'CircuitOpenError', endpoint)
+                elif self.cache.is_fresh(f"failed:{endpoint}"):
+                    metrics.incr('conky_widget_retries_total', component='trading212', target=endpoint, reason='failed_backoff')
+                elif delay <= self.max_rate_wait:
+                    futures[endpoint] = executor.submit(self._fetch_endpoint, endpoint, bucket, delay)
+                else:
+                    metrics.incr('conky_widget_retries_total', component='trading212', target=endpoint, reason='rate_limit_deferred')
             
-            if cache_complete:
-                all_data['cash'] = cached_data['data']['GET:/equity/account/cash']
-                all_data['portfolio'] = cached_data['data']['GET:/equity/portfolio']
-                all_data['info'] = cached_data['data']['GET:/equity/account/info']
-                all_data['orders'] = cached_data['data']['GET:/equity/orders']
-                return all_data
+            for endpoint, future in futures.items():
+                results[endpoint] = future.result()
+        
+        self.save_rate_limits(buckets)
         
-        # Fetch fresh data with rate limit handling
+        # Fall back to the previous value (still expired) for anything
+        # throttled or failed; failures get a short negative entry instead
         all_data = {}
+        for endpoint, key in DATA_ENDPOINTS.items():
+            value = results.get(endpoint)
+            if value is not None:
+                self.cache.put(f"GET:{endpoint}", value)
+            else:
+                if endpoint in results:
+                    self.cache.put(f"failed:{endpoint}", time.time(), ttl=FAILED_RETRY_SECONDS)
+                value = self.cache.get(f"GET:{endpoint}", allow_stale=True)
+            all_data[key] = value
+        
+        if results.get('/equity/account/cash'):
+            self.record_history(results['/equity/account/cash'])
         
-        # Add small delays between requests to avoid rate limiting
-        all_data['cash'] = self.make_request('/equity/account/cash')
-        time.sleep(0.5)
+        return all_data
+    
+    def sync_history(self, store: HistoryStore) -> dict[str, int]:
+        """Pull new orders, dividends and transactions into the SQLite store
+        
+        Pages come newest first. Each endpoint is read from the top until a
+        page contains a record already stored; the remaining page budget
+        then follows the pending cursors (the initial backfill, or a gap
+        left by an earlier sync). Stops early when the rate limit would
+        need more than max_rate_wait seconds.
+        """
+        from history_store import HISTORY_ENDPOINTS
         
-        all_data['portfolio'] = self.make_request('/equity/portfolio')
-        time.sleep(0.5)
+        buckets = self.load_rate_limits()
+        parts = urlsplit(self.base_url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        added = {}
         
-        all_data['info'] = self.make_request('/equity/account/info')
-        time.sleep(0.5)
+        for endpoint, table in HISTORY_ENDPOINTS.items():
+            bucket = buckets.get(endpoint) or TokenBucket(*DEFAULT_RATE_LIMITS[endpoint])
+            buckets[endpoint] = bucket
+            top = f"{endpoint}?limit={HISTORY_PAGE_SIZE}"
+            pending, _ = store.get_state(endpoint)
+            added[table] = 0
+            pages = 0
+            left = []
+            
+            # None is the newest page; nextPagePath cursors are relative to the host
+            for cursor in [None] + pending:
+                path = cursor or top
+                while path:
+                    delay = bucket.wait_time(time.time())
+                    page = None
+                    if (pages < self.history_max_pages and delay <= self.max_rate_wait
+                            and not http_client.is_blocked(f"{self.base_url}{endpoint}")):
+                        url = f"{self.base_url}{top}" if path == top else f"{origin}{path}"
+                        page = self._fetch_endpoint(endpoint, bucket, delay, url)
+                        pages += 1
+                    if page is None:
+                        if path != top:
+                            left.append(path)  # Carry on from here next sync
+                        break
+                    
+                    items = page.get('items', [])
+                    new = store.insert(table, items)
+                    added[table] += new
+                    if new < len(items):
+                        break  # Reached records we already have
+                    path = page.get('nextPagePath')
+            
+            store.set_state(endpoint, left, time.time())
         
-        all_data['orders'] = self.make_request('/equity/orders')
+        # Re-read so a snapshot refresh running meanwhile keeps its buckets
+        current = self.load_rate_limits()
+        current.update((endpoint, buckets[endpoint]) for endpoint in HISTORY_ENDPOINTS)
+        self.save_rate_limits(current)
+        return added
+    
+    def record_history(self, cash_data: dict):
+        """Append freshly fetched account totals to the history ring buffer"""
+        from portfolio_history import DEFAULT_CAPACITY, PortfolioHistory
         
-        return all_data
+        try:
+            history = PortfolioHistory(HISTORY_FILE, self.history_capacity or DEFAULT_CAPACITY, writable=True)
+            history.append(time.time(), cash_data.get('total', 0), cash_data.get('ppl', 0),
+                           cash_data.get('free', 0), cash_data.get('invested', 0))
+            history.close()
+        except (OSError, ValueError) as e:
+            metrics.record_error('trading212', e, 'history')
 
 class ConkyFormatter:
     """Format Trading212 data for Conky display"""
@@ -193,157 +509,425 @@ class ConkyFormatter:
         else:
             return "${color}"
 
-def main():
-    """Main function to fetch and display Trading212 data"""
+def build_snapshot(data: dict, stale: list[str] = (),
+                   rates: dict[str, float] | None = None) -> dict[str, str] | None:
+    """Compute the display text for every command from one set of API data
+    
+    stale names the data keys that could not be refreshed; they show in
+    `status` instead of "Connected". rates (see exchange_rates) convert
+    positions to the account currency.
+    """
+    cash_data = data.get('cash')
+    portfolio_data = data.get('portfolio')
+    account_info = data.get('info')
+    pending_orders = data.get('orders')
+    
+    if not cash_data:
+        return None
+    
+    # Calculate totals
+    total_invested = cash_data.get('invested', 0)
+    total_ppl = cash_data.get('ppl', 0)
+    free_cash = cash_data.get('free', 0)
+    total_value = cash_data.get('total', 0)
+    
+    # Calculate percentage return
+    if total_invested > 0:
+        pct_return = (total_ppl / total_invested) * 100
+    else:
+        pct_return = 0
+    
+    ppl_str = ConkyFormatter.format_currency(total_ppl)
+    pct_str = ConkyFormatter.format_percentage(pct_return)
+    
+    fields = {
+        'total_value': ConkyFormatter.format_currency(total_value),
+        'total_ppl': f"{ppl_str} ({pct_str})",
+        # Just the color indicator for Conky to use
+        'ppl_color': "positive" if total_ppl > 0 else "negative" if total_ppl < 0 else "neutral",
+        'free_cash': ConkyFormatter.format_currency(free_cash),
+        'invested': ConkyFormatter.format_currency(total_invested),
+        'positions_count': str(len(portfolio_data) if portfolio_data else 0),
+        'pending_orders': str(len(pending_orders) if pending_orders else 0),
+        # API connection status
+        'status': f"Stale: {', '.join(stale)}" if stale else "Connected",
+        DEFAULT_FIELD: f"£{total_value:.0f} | {pct_str}",
+        SUMMARY_FIELD: "\n".join([
+            f"Total: {ConkyFormatter.format_currency(total_value)}",
+            f"P/L: {ppl_str} ({pct_str})",
+            f"Free: {ConkyFormatter.format_currency(free_cash)}",
+        ]),
+    }
+    
+    # P&L with embedded Conky color codes
+    if total_ppl > 0:
+        fields['total_ppl_colored'] = f"${{color5}}{ppl_str} ({pct_str})${{color}}"
+    elif total_ppl < 0:
+        fields['total_ppl_colored'] = f"${{color6}}{ppl_str} ({pct_str})${{color}}"
+    else:
+        fields['total_ppl_colored'] = f"{ppl_str} ({pct_str})"
+    
+    rows = position_rows(portfolio_data, (account_info or {}).get('currencyCode', 'GBP'), rates)
+    fields['top_positions'] = format_top_positions(rows)
+    fields['top_position'] = fields['top_positions'].split("\n", 1)[0]
+    fields['allocation'] = format_allocation(rows)
+    fields['movers'] = format_movers(rows)
+    return fields
+
+class TickerIndex:
+    """Exchange suffix and known instrument -> (currency, price unit), loaded once from tickers.json"""
+    
+    _instance = None
+    
+    def __init__(self, data: dict):
+        # Longest suffix first so '_US_EQ' wins over '_EQ'
+        self.suffixes = sorted(
+            ((suffix, (info['currency'], info['price_unit'])) for suffix, info in data.get('suffixes', {}).items()),
+            key=lambda item: len(item[0]), reverse=True)
+        self.instruments = {symbol: (info['currency'], info['price_unit'])
+                            for symbol, info in data.get('instruments', {}).items()}
+        default = data.get('default', {})
+        self.default = (default.get('currency', 'GBP'), default.get('price_unit', 1))
+        self._cache = {}
+    
+    @classmethod
+    def load(cls, path: str | None = None) -> 'TickerIndex':
+        if cls._instance is None:
+            try:
+                with open(path or TICKERS_FILE, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            cls._instance = cls(data)
+        return cls._instance
+    
+    def classify(self, ticker: str) -> tuple[str, str, float]:
+        """(display symbol, currency, price unit) for a Trading212 ticker"""
+        result = self._cache.get(ticker)
+        if result is None:
+            symbol, currency, unit = ticker, self.default[0], self.default[1]
+            for suffix, (suffix_currency, suffix_unit) in self.suffixes:
+                if ticker.endswith(suffix):
+                    symbol, currency, unit = ticker[:-len(suffix)], suffix_currency, suffix_unit
+                    break
+            currency, unit = self.instruments.get(symbol, (currency, unit))
+            result = self._cache[ticker] = (symbol, currency, unit)
+        return result
+
+def exchange_rates(cached_only: bool = False) -> dict[str, float] | None:
+    """Rates per unit of the currency provider's base currency (market_weather's shared cache), or None
+    
+    cached_only answers from the cache however old and never fetches, for
+    paths that must not wait on the network.
+    """
     try:
-        # Initialize API client
-        api = CachedTrading212API()
+        import market_weather
+        with open(CONFIG_FILE, 'r') as f:
+            provider = market_weather.CurrencyProvider(json.load(f))
+        rates = provider.cached_rates() if cached_only else provider.get_rates()
+    except (OSError, ValueError, KeyError) as e:
+        metrics.record_error('trading212', e, 'rates')
+        return None
+    return dict(rates, **{provider.base: 1.0}) if rates else None
+
+def position_rows(portfolio_data: list[dict] | None, account_currency: str = 'GBP',
+                  rates: dict[str, float] | None = None) -> list[tuple]:
+    """One pass over the portfolio: (invested, value, return %, symbol, quantity, currency) per position
+    
+    Amounts are converted to account_currency where rates has both
+    currencies; otherwise they stay in the instrument's currency.
+    """
+    index = TickerIndex.load()
+    rows = []
+    for pos in portfolio_data or []:
+        symbol, currency, unit = index.classify(pos.get('ticker', 'N/A'))
+        currency = MAJOR_CURRENCY.get(currency, currency)
+        quantity = pos.get('quantity', 0)
+        avg_price = pos.get('averagePrice', 0)
+        current_price = pos.get('currentPrice', avg_price)
+        invested = abs(quantity * avg_price * unit)
+        value = abs(quantity * current_price * unit)
+        if currency != account_currency and rates and currency in rates and account_currency in rates:
+            factor = rates[account_currency] / rates[currency]
+            invested, value, currency = invested * factor, value * factor, account_currency
+        if avg_price:
+            pct = (current_price - avg_price) / avg_price * 100
+            if quantity < 0:
+                pct = -pct  # Shorts gain when the price falls
+        else:
+            pct = 0.0
+        rows.append((invested, value, pct, symbol, quantity, currency))
+    return rows
+
+def _position_line(row: tuple) -> str:
+    invested, _, _, symbol, quantity, currency = row
+    # Add direction indicator for short positions
+    direction = "SHORT " if quantity < 0 else ""
+    amount = ConkyFormatter.format_currency(invested, CURRENCY_SYMBOLS.get(currency, f"{currency} "), show_full=True)
+    return f"{symbol}: {direction}{amount}"
+
+def format_top_positions(rows: list[tuple], count: int = TOP_POSITIONS_MAX) -> str:
+    """Largest positions by invested amount, one per line"""
+    if not rows:
+        return "No positions"
+    return "\n".join(_position_line(row) for row in heapq.nlargest(count, rows, key=itemgetter(0)))
+
+def format_allocation(rows: list[tuple], slices: int = ALLOCATION_SLICES) -> str:
+    """Share of current value held in each of the largest positions
+    
+    Positions that could not be converted to one currency are shown as
+    shares of their own currency's total (e.g. "AAPL: 60.0% of USD").
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[5], []).append(row)
+    
+    lines = []
+    for currency, group in groups.items():
+        total = sum(row[1] for row in group)
+        if not total:
+            continue
+        suffix = f" of {currency}" if len(groups) > 1 else ""
+        largest = heapq.nlargest(slices, group, key=itemgetter(1))
+        lines.extend(f"{row[3]}: {row[1] / total * 100:.1f}%{suffix}" for row in largest)
+        other = total - sum(row[1] for row in largest)
+        if len(group) > slices:
+            lines.append(f"Other: {other / total * 100:.1f}%{suffix}")
+    return "\n".join(lines) or "No positions"
+
+def _mover_line(row: tuple) -> str:
+    label = "Up" if row[2] > 0 else "Down" if row[2] < 0 else "Flat"
+    return f"{label}: {row[3]} {ConkyFormatter.format_percentage(row[2])}"
+
+def format_movers(rows: list[tuple]) -> str:
+    """Best and worst position by return since purchase, labelled by the sign of the return"""
+    if not rows:
+        return "No positions"
+    best = max(rows, key=itemgetter(2))
+    worst = min(rows, key=itemgetter(2))
+    if best is worst:
+        return _mover_line(best)
+    return "\n".join([_mover_line(best), _mover_line(worst)])
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _unescape(value: str) -> str:
+    return '\\'.join(part.replace('\\n', '\n') for part in value.split('\\\\'))
+
+def _write_atomic(path: str, text: str):
+    """Replace path with text, ignoring errors
+
+    The temp file is unique per call: the daemon's handler threads share a
+    pid and may write the same file at once.
+    """
+    try:
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_file, path)
+    except OSError:
+        try:
+            os.unlink(tmp_file)
+        except OSError:
+            pass
+
+def write_snapshot(fields: dict[str, str], ttl: float, path: str | None = None):
+    """Write all fields as key=value lines, atomically via rename"""
+    path = path or SNAPSHOT_FILE
+    lines = [f"expires={time.time() + ttl:.0f}"]
+    lines.extend(f"{key}={_escape(value)}" for key, value in fields.items())
+    
+    _write_atomic(path, "\n".join(lines) + "\n")  # Fails silently if the snapshot can't be written
+
+def read_snapshot(path: str | None = None, allow_expired: bool = False) -> dict[str, str]:
+    """Read the snapshot file; empty if missing or expired"""
+    path = path or SNAPSHOT_FILE
+    try:
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    
+    fields = {}
+    for line in lines:
+        key, _, value = line.partition('=')
+        fields[key] = _unescape(value)
+    
+    try:
+        if not allow_expired and float(fields.get('expires', 0)) < time.time():
+            return {}
+    except ValueError:
+        return {}
+    return fields
+
+def run(args: list[str], api: CachedTrading212API | None = None) -> str:
+    """Return the output text for a CLI command, via the snapshot when fresh"""
+    command = args[0] if args else SUMMARY_FIELD
+    with metrics.timer('conky_widget_command_seconds', component='trading212', command=command):
+        return _run_command(command, args[1:], api)
+
+def format_history(command: str, options: list[str], path: str | None = None) -> str:
+    """sparkline / change_1d / change_7d straight from the history ring buffer"""
+    from portfolio_history import PortfolioHistory, sparkline
+    
+    history = PortfolioHistory(path or HISTORY_FILE)
+    try:
+        if not history.count:
+            return "N/A"
+        if command == 'sparkline':
+            try:
+                points = int(options[0]) if options else SPARKLINE_POINTS
+            except ValueError:
+                points = SPARKLINE_POINTS
+            return sparkline([point[1] for point in history.last(max(points, 2))])
         
-        # Fetch all data at once
-        data = api.get_all_data()
+        latest = history.record(history.count - 1)
+        days = 1 if command == 'change_1d' else 7
+        previous = history.at_or_before(latest[0] - days * 86400)
+        if previous is None:
+            return "N/A"
+        change = latest[1] - previous[1]
+        pct = change / previous[1] * 100 if previous[1] else 0
+        return f"{_signed_currency(change)} ({ConkyFormatter.format_percentage(pct)})"
+    finally:
+        history.close()
+
+def _signed_currency(amount: float) -> str:
+    sign = "+" if amount > 0 else "-" if amount < 0 else ""
+    return f"{sign}{ConkyFormatter.format_currency(abs(amount))}"
+
+def format_ledger(command: str, path: str | None = None) -> str:
+    """dividends_month / realised_ytd / last_fill from the local history database
+    
+    Never calls the API; a database older than HISTORY_SYNC_INTERVAL gets a
+    background sync_history instead. Until every endpoint has been synced
+    once the answer is "Syncing…", not a misleading zero.
+    """
+    from datetime import datetime
+    from history_store import HistoryStore, month_start, year_start
+    
+    store = HistoryStore(path or HISTORY_DB_FILE)
+    try:
+        last_synced = store.last_synced()
+        if time.time() - last_synced > HISTORY_SYNC_INTERVAL:
+            revalidate.spawn_refresh('trading212_history', 'trading212_api.py', ['sync_history'])
+        if not last_synced:
+            return "Syncing…"
         
-        cash_data = data.get('cash')
-        portfolio_data = data.get('portfolio')
-        account_info = data.get('info')
-        pending_orders = data.get('orders')
+        if command == 'dividends_month':
+            return ConkyFormatter.format_currency(store.dividends_since(month_start()), show_full=True)
+        if command == 'realised_ytd':
+            return _signed_currency(store.realised_since(year_start()))
         
-        if not cash_data:
-            print("N/A")
-            return
+        fill = store.last_fill()
+        if fill is None:
+            return "No fills"
+        ticker, quantity, price, executed_at = fill
+        symbol = TickerIndex.load().classify(ticker)[0]
+        side = "SELL" if quantity < 0 else "BUY"
+        return f"{symbol} {side} {abs(quantity):g} @ {price:.2f} ({datetime.fromtimestamp(executed_at):%d %b})"
+    finally:
+        store.close()
+
+def sync_history(api: CachedTrading212API, path: str | None = None) -> str:
+    from history_store import HistoryStore
+    
+    store = HistoryStore(path or HISTORY_DB_FILE)
+    try:
+        added = api.sync_history(store)
+    finally:
+        store.close()
+    return ", ".join(f"{table} +{count}" for table, count in added.items())
+
+def _select(fields: dict[str, str], command: str, options: list[str]) -> str:
+    """The field for a command, trimmed to N lines for `top_positions N`"""
+    if command in HISTORY_COMMANDS:
+        return format_history(command, options)
+    text = fields.get(command, fields[DEFAULT_FIELD])
+    if command == 'top_positions':
+        try:
+            count = int(options[0]) if options else DEFAULT_TOP_POSITIONS
+        except ValueError:
+            count = DEFAULT_TOP_POSITIONS
+        text = "\n".join(text.split("\n")[:max(count, 1)])
+    return text
+
+def _serve_stale(fields: dict[str, str], command: str, options: list[str]) -> str:
+    metrics.incr('conky_widget_cache_total', component='trading212', target='snapshot', result='stale')
+    revalidate.spawn_refresh('trading212', 'trading212_api.py', ['snapshot'])
+    return revalidate.mark(_select(fields, command, options), True)
+
+def _run_command(command: str, options: list[str], api: CachedTrading212API | None) -> str:
+    if command == 'stats':
+        return metrics.format_stats('trading212')
+    
+    if command in LEDGER_COMMANDS:
+        import sqlite3
+        try:
+            return format_ledger(command)
+        except sqlite3.Error as e:
+            metrics.record_error('trading212', e, 'history')
+            return "N/A"
+    
+    if command not in ('snapshot', 'sync_history'):
+        # Cheap path: one small file read, no API client or cache unpickling
+        snapshot = read_snapshot()
+        if snapshot:
+            metrics.incr('conky_widget_cache_total', component='trading212', target='snapshot', result='hit')
+            return _select(snapshot, command, options)
         
-        # Calculate totals
-        total_invested = cash_data.get('invested', 0)
-        total_ppl = cash_data.get('ppl', 0)
-        free_cash = cash_data.get('free', 0)
-        total_value = cash_data.get('total', 0)
+        # Expired: answer with the old values and refresh in a detached process
+        if revalidate.enabled():
+            snapshot = read_snapshot(allow_expired=True)
+            if snapshot:
+                return _serve_stale(snapshot, command, options)
+    
+    try:
+        # Initialize API client
+        if api is None:
+            api = CachedTrading212API()
         
-        # Calculate percentage return
-        if total_invested > 0:
-            pct_return = (total_ppl / total_invested) * 100
-        else:
-            pct_return = 0
+        if command == 'sync_history':
+            return sync_history(api)
         
-        # Format output based on command line argument
-        if len(sys.argv) > 1:
-            data_type = sys.argv[1]
-            
-            if data_type == 'total_value':
-                print(ConkyFormatter.format_currency(total_value))
-            elif data_type == 'total_ppl':
-                ppl_str = ConkyFormatter.format_currency(total_ppl)
-                pct_str = ConkyFormatter.format_percentage(pct_return)
-                print(f"{ppl_str} ({pct_str})")
-            elif data_type == 'ppl_color':
-                # Return just the color indicator for Conky to use
-                print("positive" if total_ppl > 0 else "negative" if total_ppl < 0 else "neutral")
-            elif data_type == 'total_ppl_colored':
-                # Return P&L with embedded Conky color codes
-                ppl_str = ConkyFormatter.format_currency(total_ppl)
-                pct_str = ConkyFormatter.format_percentage(pct_return)
-                if total_ppl > 0:
-                    print(f"${{color5}}{ppl_str} ({pct_str})${{color}}")
-                elif total_ppl < 0:
-                    print(f"${{color6}}{ppl_str} ({pct_str})${{color}}")
-                else:
-                    print(f"{ppl_str} ({pct_str})")
-            elif data_type == 'free_cash':
-                print(ConkyFormatter.format_currency(free_cash))
-            elif data_type == 'invested':
-                print(ConkyFormatter.format_currency(total_invested))
-            elif data_type == 'positions_count':
-                print(len(portfolio_data) if portfolio_data else 0)
-            elif data_type == 'pending_orders':
-                print(len(pending_orders) if pending_orders else 0)
-            elif data_type == 'top_position':
-                if portfolio_data and len(portfolio_data) > 0:
-                    def calculate_invested(pos):
-                        """Calculate invested amount handling both pence and pound stocks"""
-                        ticker = pos.get('ticker', '')
-                        quantity = pos.get('quantity', 0)
-                        avg_price = pos.get('averagePrice', 0)
-                        
-                        # Specific ETFs that are priced in pence despite being UK stocks
-                        pence_etfs = ['CSP1', 'CSP2', 'VUKE', 'VHYL', 'VMID', 'VAPX', 'VUSA', 'VJPN', 'VFEU', 'VEUR', 'VWRL', 'VODL', 'IUKP', 'ISF', 'SUK2']
-                        # US ETFs that might be priced in pence
-                        us_pence_etfs = ['SPY', 'QQQ', 'IWM', 'DIA', 'VTI', 'VOO', 'IVV', 'GLD', 'SLV', 'TLT', 'HYG', 'LQD']
-                        
-                        clean_ticker = ticker.replace('_US_EQ', '').replace('_UK_EQ', '').replace('_L_EQ', '').replace('_l_EQ', '').replace('_EQ', '')
-                        
-                        # Determine if price is in pence
-                        price_in_pence = False
-                        
-                        if clean_ticker in pence_etfs:
-                            price_in_pence = True
-                        elif clean_ticker in us_pence_etfs:
-                            price_in_pence = True
-                        elif ticker.lower().endswith(('l_eq', 'uk_eq')):
-                            # For UK stocks, assume pence unless it's a known pound-priced ETF
-                            if clean_ticker not in ['VWRP', 'VWRPl', 'VWRL', 'ISF', 'VMID']:  # Common UK ETFs priced in pounds
-                                price_in_pence = True
-                        
-                        if price_in_pence:
-                            # Price is in pence, convert to pounds
-                            invested = quantity * (avg_price / 100)
-                        else:
-                            # Price is already in pounds
-                            invested = quantity * avg_price
-                        
-                        return abs(invested)
-                    
-                    # Sort by calculated invested amount
-                    top_pos = max(portfolio_data, key=calculate_invested)
-                    ticker = top_pos.get('ticker', 'N/A').replace('_US_EQ', '').replace('_UK_EQ', '').replace('_L_EQ', '').replace('_l_EQ', '')
-                    quantity = top_pos.get('quantity', 0)
-                    avg_price = top_pos.get('averagePrice', 0)
-                    ppl = top_pos.get('ppl', 0)
-                    
-# Calculate invested amount with proper currency handling
-                    pence_etfs = ['CSP1', 'CSP2', 'VUKE', 'VHYL', 'VMID', 'VAPX', 'VUSA', 'VJPN', 'VFEU', 'VEUR', 'VWRL', 'VODL', 'IUKP', 'ISF', 'SUK2']
-                    us_pence_etfs = ['SPY', 'QQQ', 'IWM', 'DIA', 'VTI', 'VOO', 'IVV', 'GLD', 'SLV', 'TLT', 'HYG', 'LQD']
-                    clean_ticker = ticker.replace('_US_EQ', '').replace('_UK_EQ', '').replace('_L_EQ', '').replace('_l_EQ', '').replace('_EQ', '')
-                    
-                    # Determine if price is in pence
-                    price_in_pence = False
-                    
-                    if clean_ticker in pence_etfs:
-                        price_in_pence = True
-                    elif clean_ticker in us_pence_etfs:
-                        price_in_pence = True
-                    elif ticker.lower().endswith(('l_eq', 'uk_eq')):
-                        # For UK stocks, assume pence unless it's a known pound-priced ETF
-                        if clean_ticker not in ['VWRP', 'VWRPl', 'VWRL', 'ISF', 'VMID']:  # Common UK ETFs priced in pounds
-                            price_in_pence = True
-                    
-                    if price_in_pence:
-                        invested = quantity * (avg_price / 100)
-                    else:
-                        invested = quantity * avg_price
-                    
-                    # Add direction indicator for short positions
-                    direction = "SHORT " if quantity < 0 else ""
-                    print(f"{ticker}: {direction}{ConkyFormatter.format_currency(abs(invested), show_full=True)}")
-                else:
-                    print("No positions")
-            elif data_type == 'status':
-                # API connection status
-                print("Connected" if cash_data else "Disconnected")
-            else:
-                # Default: return summary
-                print(f"£{total_value:.0f} | {ConkyFormatter.format_percentage(pct_return)}")
+        if command != 'snapshot' and revalidate.enabled():
+            # No snapshot yet, but an expired API cache is still better than waiting;
+            # the rates too come from the cache and the detached refresh updates them
+            stale_data = api.cached_data(allow_stale=True)
+            fields = build_snapshot(stale_data, api.data_expiry()[1], exchange_rates(cached_only=True)) if stale_data else None
+            if fields:
+                return _serve_stale(fields, command, options)
         
-        else:
-            # No argument provided, show summary
-            print(f"Total: {ConkyFormatter.format_currency(total_value)}")
-            print(f"P/L: {ConkyFormatter.format_currency(total_ppl)} ({ConkyFormatter.format_percentage(pct_return)})")
-            print(f"Free: {ConkyFormatter.format_currency(free_cash)}")
+        # Fetch all data at once and compute every field; the snapshot
+        # expires with its oldest part, so a failed endpoint shows as stale
+        data = api.get_all_data()
+        expires, stale = api.data_expiry()
+        fields = build_snapshot(data, stale, exchange_rates())
+        if fields is None:
+            return "N/A"
+        write_snapshot(fields, expires - time.time())
+        
+        if command == 'snapshot':
+            return "\n".join(f"{key}={_escape(value)}" for key, value in fields.items())
+        return _select(fields, command, options)
     
     except ValueError as e:
+        metrics.record_error('trading212', e, 'config')
         if "placeholder" in str(e).lower():
-            print("Setup Required")
+            return "Setup Required"
         else:
-            print("Config Error")
+            return "Config Error"
     except Exception as e:
-        print("N/A")
+        metrics.record_error('trading212', e, 'run')
+        return "N/A"
+
+def main():
+    """Main function to fetch and display Trading212 data"""
+    print(run(sys.argv[1:]))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Shared on-disk cache for the widget scripts
+Each entry is a small JSON file under .widget_cache/<namespace>/. The file's
+mtime holds its expiry time and its atime the last use, so a freshness check
+is one stat() and nothing is parsed until the value is needed. The whole
+directory is kept under a size cap by evicting least recently used entries;
+it is only rescanned when a running size estimate passes the cap, or every
+few minutes.
+
+Settings (config.json, "general"):
+  "cache_duration_minutes": 30     TTL for namespaces with no setting of their own
+  "cache": {
+    "max_kilobytes": 4096,         size cap for .widget_cache
+    "ttl_seconds": {}              per-namespace TTLs, e.g. {"trading212": 120}
+  }
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+import widget_config
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, '.widget_cache')
+# Total size found by the last eviction scan; its mtime is the scan time
+USAGE_FILE = os.path.join(CACHE_DIR, '.usage')
+
+# Reads closer together than this don't write the last-use time back
+TOUCH_INTERVAL = 60
+
+# The directory is rescanned for eviction at most this often, unless the
+# size estimate (last scan plus this process's writes) passes the cap
+EVICT_INTERVAL = 300
+# An eviction frees space down to this share of the cap, so the next few
+# writes don't trigger another scan
+EVICT_TARGET = 0.9
+
+_usage_lock = threading.Lock()
+_size_estimate = None
+_scanned_at = 0
+
+
+def _build_settings(general):
+    cache = general.get('cache', {})
+    return {
+        'default_ttl': general.get('cache_duration_minutes', 30) * 60,
+        'ttls': cache.get('ttl_seconds', {}),
+        'max_bytes': cache.get('max_kilobytes', 4096) * 1024,
+    }
+
+
+def _load_settings():
+    """Reread when config.json changes, so the daemon follows edits"""
+    return widget_config.settings(_build_settings)
+
+
+class WidgetCache:
+    """One namespace of entries; values are anything json can encode"""
+
+    def __init__(self, namespace, ttl=None):
+        settings = _load_settings()
+        self.namespace = namespace
+        self.directory = os.path.join(CACHE_DIR, namespace)
+        # general.cache.ttl_seconds, then the caller's own setting, then the global default
+        if ttl is None:
+            ttl = settings['default_ttl']
+        self.ttl = settings['ttls'].get(namespace, ttl)
+        self.max_bytes = settings['max_bytes']
+
+    def path(self, key):
+        return os.path.join(self.directory, quote(key, safe='') + '.json')
+
+    def expiry(self, key):
+        """Expiry time of key's value (0 if there is none), without reading it"""
+        try:
+            return os.stat(self.path(key)).st_mtime
+        except OSError:
+            return 0
+
+    def is_fresh(self, key):
+        """Whether key holds an unexpired value, without reading it"""
+        return self.expiry(key) > time.time()
+
+    def lookup(self, key):
+        """(value, fresh) for key; value is None if missing or unreadable"""
+        now = time.time()
+        try:
+            with open(self.path(key), 'r') as f:
+                st = os.fstat(f.fileno())
+                value = json.load(f)
+                if now - st.st_atime > TOUCH_INTERVAL:
+                    # Through the open file, so a concurrent replace keeps its expiry
+                    os.utime(f.fileno(), (now, st.st_mtime))
+        except (OSError, ValueError):
+            return None, False
+        return value, st.st_mtime > now
+
+    def get(self, key, allow_stale=False):
+        """Value for key if fresh (or at all, if allow_stale), else None"""
+        value, fresh = self.lookup(key)
+        return value if fresh or allow_stale else None
+
+    def put(self, key, value, ttl=None):
+        """Store value for ttl seconds (default: the namespace TTL), atomically via rename"""
+        path = self.path(key)
+        now = time.time()
+        tmp_file = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Unique per call: daemon threads share a pid and may write the same key
+            fd, tmp_file = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f, separators=(',', ':'))
+                f.flush()
+                size = os.fstat(f.fileno()).st_size
+            os.utime(tmp_file, (now, now + (self.ttl if ttl is None else ttl)))
+            try:
+                size -= os.stat(path).st_size
+            except OSError:
+                pass
+            os.replace(tmp_file, path)
+        except (OSError, TypeError, ValueError):
+            if tmp_file:
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
+            return False  # Fail silently if can't write cache
+        _note_write(size, self.max_bytes)
+        return True
+
+
+def _note_write(size, max_bytes):
+    """Add a write to the size estimate; evict() once it passes max_bytes or is out of date"""
+    global _size_estimate, _scanned_at
+    with _usage_lock:
+        if _size_estimate is None:
+            # Start from another process's recent scan instead of rescanning
+            try:
+                with open(USAGE_FILE, 'r') as f:
+                    scanned_at = os.fstat(f.fileno()).st_mtime
+                    if time.time() - scanned_at < EVICT_INTERVAL:
+                        _size_estimate, _scanned_at = int(f.read()), scanned_at
+            except (OSError, ValueError):
+                pass
+        if _size_estimate is not None:
+            # Concurrent writers to one key can make size a little off; a rescan corrects it
+            _size_estimate = max(_size_estimate + size, 0)
+            if _size_estimate <= max_bytes and time.time() - _scanned_at < EVICT_INTERVAL:
+                return
+    evict(max_bytes)
+
+
+def evict(max_bytes):
+    """Remove least recently used entries once the cache is over max_bytes (down to EVICT_TARGET of it)"""
+    entries = []
+    total = 0
+    try:
+        for namespace in os.scandir(CACHE_DIR):
+            if not namespace.is_dir():
+                continue
+            for entry in os.scandir(namespace.path):
+                if entry.name.endswith('.tmp'):
+                    continue  # Another process is mid-write
+                st = entry.stat()
+                total += st.st_size
+                entries.append((st.st_atime, st.st_size, entry.path))
+    except OSError:
+        return
+
+    if total > max_bytes:
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= max_bytes * EVICT_TARGET:
+                break
+    _record_usage(total)
+
+
+def _record_usage(total):
+    """Keep a scan's total as this process's estimate and in USAGE_FILE for the others"""
+    global _size_estimate, _scanned_at
+    with _usage_lock:
+        _size_estimate, _scanned_at = total, time.time()
+    try:
+        fd, tmp_file = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(total))
+        os.replace(tmp_file, USAGE_FILE)
+    except OSError:
+        pass
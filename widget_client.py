@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Thin Conky client for widget_daemon.py
+Usage: widget_client.py <script> [command] [args]
+e.g.   widget_client.py trading212_api.py total_value
+       widget_client.py news_simple.py single 2
+
+Deliberately imports nothing beyond os, socket and sys. When the daemon is
+not running it is started in the background and this call falls back to
+running the script directly, so output is always the same as the script's.
+"""
+
+import os
+import socket
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOCKET_PATH = os.environ.get('CONKY_WIDGET_SOCKET', os.path.join(BASE_DIR, '.widget_daemon.sock'))
+TIMEOUT_SECONDS = 30
+
+
+def query(argv):
+    """Send argv to the daemon and return its raw reply"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT_SECONDS)
+    try:
+        sock.connect(SOCKET_PATH)
+        sock.sendall(('\0'.join(argv) + '\n').encode('utf-8'))
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+    finally:
+        sock.close()
+
+
+def start_daemon():
+    """Launch the daemon detached from Conky's process group"""
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            os.execv(sys.executable, [sys.executable, os.path.join(BASE_DIR, 'widget_daemon.py')])
+        finally:
+            os._exit(1)
+
+
+def main():
+    argv = sys.argv[1:]
+    if not argv:
+        print("Usage: widget_client.py <script> [command] [args]")
+        sys.exit(1)
+
+    try:
+        reply = query(argv)
+    except OSError:
+        start_daemon()
+        script = os.path.join(BASE_DIR, os.path.basename(argv[0]))
+        os.execv(sys.executable, [sys.executable, script] + argv[1:])
+
+    sys.stdout.buffer.write(reply)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+The "general" section of config.json, for the shared helper modules
+widget_cache, http_client, revalidate and metrics each derive their settings
+from it through settings(), which rereads the file only when its mtime
+changes, so the long-running widget daemon follows edits without a restart.
+"""
+
+import json
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(BASE_DIR, 'config.json')
+
+# build function -> (config.json mtime it was built at, its settings)
+_built = {}
+
+
+def general():
+    """config.json's general section; {} if the file is missing or invalid"""
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            return json.load(f).get('general', {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def settings(build):
+    """build(general()), built again only when config.json has changed since"""
+    try:
+        stamp = os.stat(CONFIG_FILE).st_mtime_ns
+    except OSError:
+        stamp = None
+    built = _built.get(build)
+    if built is None or built[0] != stamp:
+        built = (stamp, build(general()))
+        _built[build] = built
+    return built[1]
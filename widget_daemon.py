@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Conky Widget Daemon
+Keeps the Trading212, news, sun/moon, market/weather and panel managers in
+memory and answers widget_client.py requests over a Unix domain socket
+"""
+
+import importlib
+import os
+import signal
+import socketserver
+import sys
+import threading
+import fcntl
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOCKET_PATH = os.environ.get('CONKY_WIDGET_SOCKET', os.path.join(BASE_DIR, '.widget_daemon.sock'))
+LOCK_PATH = SOCKET_PATH + '.lock'
+
+# script name -> (module, manager class, files whose changes trigger a rebuild, fallback text)
+SCRIPTS = {
+    'trading212_api.py': ('trading212_api', 'CachedTrading212API', ['trading212_config.json', 'config.json'], 'N/A'),
+    'news_simple.py': ('news_simple', 'SimpleNewsManager', ['config.json'], 'News service temporarily unavailable'),
+    'sun_moon.py': ('sun_moon', 'SunMoonManager', ['config.json'], 'Sun/Moon service unavailable'),
+    'market_weather.py': ('market_weather', 'MarketWeatherManager', ['config.json'], 'N/A'),
+    'panel.py': ('panel', 'PanelRenderer', ['config.json', 'trading212_config.json'], ''),
+}
+
+
+class ScriptHandle:
+    """Lazily imported script module plus its long-lived manager"""
+
+    def __init__(self, module_name, class_name, watched_files, fallback):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.watched_files = [os.path.join(BASE_DIR, name) for name in watched_files]
+        self.fallback = fallback
+        self.module = None
+        self.manager = None
+        self.manager_stamp = None
+        self.lock = threading.Lock()
+
+    def _config_stamp(self):
+        """Modification times of the config files this manager was built from"""
+        stamp = []
+        for path in self.watched_files:
+            try:
+                stamp.append(os.path.getmtime(path))
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+    def _get_manager(self):
+        """Build the manager once, rebuilding it when its config changes"""
+        if self.module is None:
+            self.module = importlib.import_module(self.module_name)
+
+        stamp = self._config_stamp()
+        if self.manager is None or stamp != self.manager_stamp:
+            self.manager = None
+            self.manager_stamp = stamp
+            # Construction errors (e.g. missing credentials) are reported by run()
+            try:
+                self.manager = getattr(self.module, self.class_name)()
+            except Exception:
+                return None
+        return self.manager
+
+    def run(self, args):
+        """Run one CLI command against the cached manager"""
+        with self.lock:
+            try:
+                manager = self._get_manager()
+                return self.module.run(args, manager)
+            except Exception:
+                return self.fallback
+
+
+class WidgetRequestHandler(socketserver.StreamRequestHandler):
+    """One request per connection: NUL-separated argv terminated by a newline"""
+
+    def handle(self):
+        line = self.rfile.readline().decode('utf-8').rstrip('\n')
+        argv = line.split('\0') if line else []
+
+        if not argv:
+            output = "Usage: widget_client.py <script> [command] [args]"
+        elif argv[0] == 'ping':
+            output = "pong"
+        else:
+            handle = self.server.scripts.get(os.path.basename(argv[0]))
+            if handle is None:
+                output = f"Unknown script: {argv[0]}"
+            else:
+                output = handle.run(argv[1:])
+
+        self.wfile.write((output + "\n").encode('utf-8'))
+
+
+class WidgetServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        self.scripts = {name: ScriptHandle(*spec) for name, spec in SCRIPTS.items()}
+        super().__init__(socket_path, WidgetRequestHandler)
+
+
+def main():
+    # Only one daemon per socket; a second copy exits quietly
+    lock_file = open(LOCK_PATH, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        sys.exit(0)
+
+    # Any socket file left now is from a daemon that died without cleaning up
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+
+    sys.path.insert(0, BASE_DIR)
+    server = WidgetServer(SOCKET_PATH)
+    os.chmod(SOCKET_PATH, 0o600)
+
+    def shutdown(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, shutdown)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(SOCKET_PATH)
+        except OSError:
+            pass
+
+if __name__ == "__main__":
+    main()